@@ -51,9 +51,28 @@ class Settings(BaseSettings):
     MAX_CONCURRENT_USERS: int = 5
     DEFAULT_USAGE_LIMIT: int = 1
     SEGMENT_SKIP_THRESHOLD: int = 15
+    SEGMENT_PARALLELISM: int = 4  # 会话开启 parallel_segments 时，同一会话内最多同时处理的段落数
+    SEGMENT_CONTEXT_NEIGHBORS: int = 1  # 并行模式下作为上下文的前后相邻段落数
+    CONCURRENCY_BACKEND: str = "memory"  # memory: 进程内（单进程部署）；sql: 数据库租约表；redis: 使用 REDIS_URL。多 worker 部署时用 sql 或 redis 共享上限与排队顺序
+    CONCURRENCY_LEASE_SECONDS: int = 60  # sql/redis 后端中名额与排队记录的租约（秒），进程崩溃后到期自动释放
+    CONCURRENCY_POLL_INTERVAL_SECONDS: float = 1.0  # sql/redis 后端等待名额时的检查间隔（秒），其他进程释放名额无法直接唤醒
+    JOB_LEASE_SECONDS: int = 60  # 任务租约时长（秒），进程崩溃后超过该时间任务由其他进程或重启后的本进程接管
+    JOB_HEARTBEAT_SECONDS: int = 15  # 租约续期间隔（秒），应明显小于租约时长
+    JOB_POLL_INTERVAL_SECONDS: float = 2.0  # 工作池空闲时轮询任务表的间隔（秒），本进程入队时立即唤醒
+    SEGMENT_DEDUP: bool = True  # 内容相同（连续空白视为一个空格）的段落每个阶段只调用一次 AI，结果复制到其余段落
+    SEGMENT_PASSTHROUGH: bool = True  # 分割文本时识别非正文段落（参考文献、代码、公式、表格、链接），原样保留不调用 AI
+    STAGE_PIPELINING: bool = True  # 润色+增强模式下按段落流水线执行：段落润色完成即开始增强
+    WRITE_BEHIND_MAX_DELAY_MS: int = 500  # 进度等非关键更新的最长缓冲时间（毫秒），AI 调用前总会先写入
+    
+    # 段落上下文配置
+    CONTEXT_STRATEGY: str = "summary"  # summary: 全部历史输出，超过阈值压缩为滚动摘要；window: 最近 K 段输出；neighbors: 相邻段落原文；none: 不带上下文
+    CONTEXT_STRATEGY_OVERRIDES: str = ""  # JSON，按处理模式覆盖，如 {"emotion_polish": "window", "paper_polish": "neighbors"}
+    CONTEXT_WINDOW_SIZE: int = 3  # window 策略保留的最近输出段数
     
     # 会话压缩配置
-    HISTORY_COMPRESSION_THRESHOLD: int = 5000  # 汉字数量阈值
+    HISTORY_COMPRESSION_THRESHOLD: int = 5000  # 历史上下文 token 阈值（中文约 1 汉字 = 1 token）
+    HISTORY_SUMMARY_MAX_TOKENS: int = 800  # 滚动摘要的 token 上限，每次压缩将上次摘要与新增输出合并为不超过该长度的摘要；0 表示不限制
+    HISTORY_COMPRESSION_SPECULATIVE_RATIO: float = 0.8  # 历史达到阈值的该比例时在后台提前压缩，与后续段落并行；0 表示超过阈值时才同步压缩
     COMPRESSION_MODEL: str = "gpt-5"
     COMPRESSION_API_KEY: Optional[str] = None
     COMPRESSION_BASE_URL: Optional[str] = None
@@ -65,6 +84,66 @@ class Settings(BaseSettings):
     
     # 流式输出配置
     USE_STREAMING: bool = False  # 默认使用非流式模式，避免被API阻止
+    MESSAGE_LAYOUT: str = "prefix_cache"  # prefix_cache: 系统提示词在前，利于上游前缀缓存；legacy: 历史在前
+    STREAM_SNAPSHOT_INTERVAL: int = 64  # 流式输出每隔多少个增量发送一次带校验和的全文快照，0 表示只在段落结束时发送
+    
+    # token 估算与预算（离线估算，不访问网络）
+    TOKEN_ESTIMATOR: str = "heuristic"  # heuristic: 校准过的启发式规则；tiktoken: 本地已缓存编码时使用真实 BPE
+    TOKEN_ENCODING: str = "o200k_base"
+    TOKEN_CJK_RATIO: float = 1.0  # 每个汉字折算的 token 数
+    SEGMENT_MAX_TOKENS: int = 500  # 单个段落的 token 上限，超出按句子切分
+    LLM_MAX_TOKENS_RATIO: float = 0.0  # 段落输出上限 = 输入 token × 比例 + 余量，0 表示不限制（默认，推理模型的推理 token 也计入上限）
+    LLM_MAX_TOKENS_MARGIN: int = 256
+    LLM_MAX_TOKENS_CEILING: int = 32768  # 输出被截断后重试时上限逐次翻倍，最多放大到该值
+    LLM_MAX_TOKENS_PARAM: str = "auto"  # 输出上限参数名: auto（o1/o3/o4/gpt-5 等推理模型用 max_completion_tokens，其余用 max_tokens）、max_tokens、max_completion_tokens
+    
+    # LLM 连接池配置（按 base_url + api_key 共享客户端）
+    LLM_REQUEST_TIMEOUT: float = 60.0
+    LLM_POOL_MAX_CONNECTIONS: int = 100
+    LLM_POOL_MAX_KEEPALIVE: int = 20
+    LLM_POOL_KEEPALIVE_EXPIRY: float = 30.0  # 空闲连接保活时间（秒）
+    LLM_HTTP2: bool = False  # 需要安装 h2，未安装时自动回退到 HTTP/1.1
+    LLM_STREAM_USAGE: bool = True  # 流式请求附带 stream_options.include_usage 以统计用量，上游不支持时关闭
+    
+    # 调用截止时间（按模型观测的生成速度自适应，LLM_REQUEST_TIMEOUT 为关闭自适应时的固定值）
+    LLM_DEADLINE_ADAPTIVE: bool = True
+    LLM_DEADLINE_MIN: float = 20.0  # 单次调用截止时间下限（秒），模型样本不足时取 LLM_REQUEST_TIMEOUT
+    LLM_DEADLINE_MAX: float = 600.0  # 单次调用截止时间上限（秒）
+    LLM_DEADLINE_SAFETY: float = 2.0  # 预计耗时的安全系数
+    LLM_DEADLINE_DEFAULT_TPS: float = 20.0  # 尚无观测样本时假定的生成速度（token/s）
+    LLM_FIRST_TOKEN_TIMEOUT: float = 30.0  # 流式调用等待首个 token 的最短截止时间（秒）
+    
+    # 多端点路由（*_BASE_URL / *_API_KEY 可填写逗号分隔的多个值）
+    LLM_ENDPOINT_EWMA_ALPHA: float = 0.3  # 延迟与错误率的指数加权系数
+    LLM_ENDPOINT_EJECT_FAILURES: int = 3  # 连续失败多少次后摘除端点，0 表示不摘除
+    LLM_ENDPOINT_EJECT_SECONDS: float = 30.0  # 首次摘除时长，再次摘除翻倍
+    LLM_ENDPOINT_EJECT_MAX_SECONDS: float = 300.0
+    LLM_HEDGE_ENABLED: bool = False  # 非流式请求超过端点 p95 未返回时向另一端点补发
+    LLM_HEDGE_MIN_SAMPLES: int = 20  # 端点累计多少个延迟样本后才启用对冲
+    
+    # 日志配置（可在管理后台实时切换）
+    LOG_LEVEL: str = "INFO"  # DEBUG / INFO / WARNING / ERROR / OFF，DEBUG 才输出请求与响应正文
+    LOG_BODY_SAMPLE_RATE: float = 1.0  # 正文日志采样率 0-1
+    LOG_MAX_BODY_CHARS: int = 2000  # 正文日志截断长度，0 表示不截断
+    LOG_QUEUE_SIZE: int = 10000  # 日志队列容量，满时丢弃
+    
+    # LLM 调用重试配置（限流 / 超时 / 5xx / 连接错误）
+    RETRY_MAX_ATTEMPTS: int = 3  # 单次调用最多尝试次数（含首次）
+    RETRY_BASE_DELAY: float = 1.0  # 指数退避基准时间（秒）
+    RETRY_MAX_DELAY: float = 30.0  # 单次退避上限（秒）
+    RETRY_MAX_RETRY_AFTER: float = 60.0  # Retry-After 最长遵守时间（秒）
+    RETRY_SESSION_BUDGET: int = 20  # 每个会话的重试总预算
+    
+    # 上游限流配置（按 base_url + model 共享，0 表示不限制）
+    RATE_LIMIT_RPM: int = 0  # 每分钟请求数
+    RATE_LIMIT_TPM: int = 0  # 每分钟预估 token 数
+    RATE_LIMIT_MAX_INFLIGHT: int = 0  # 单个端点最大并发请求数（舱壁）
+    RATE_LIMIT_OVERRIDES: str = ""  # JSON，按 "base_url|model" 或 "model" 覆盖，如 {"gpt-5": {"rpm": 60, "tpm": 200000}}
+    
+    # LLM 响应缓存（按模型、消息、temperature 和阶段内容寻址）
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_TTL_SECONDS: int = 604800  # 缓存有效期（秒），0 表示永不过期
+    LLM_CACHE_MAX_ENTRIES: int = 50000  # 最大缓存条目数，超出按最近访问时间淘汰
     
     # JWT 密钥
     SECRET_KEY: str = "your-secret-key-change-this-in-production"
@@ -112,6 +191,8 @@ def reload_settings():
                         try:
                             if field_type == int:
                                 setattr(settings, key, int(value))
+                            elif field_type == float:
+                                setattr(settings, key, float(value))
                             elif field_type == bool:
                                 setattr(settings, key, value.lower() in ('true', '1', 'yes'))
                             else:
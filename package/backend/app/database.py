@@ -1,6 +1,9 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
 from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from app.config import settings
 
 engine = create_engine(
@@ -22,6 +25,43 @@ def get_db():
         db.close()
 
 
+T = TypeVar("T")
+
+
+class SessionExecutor:
+    """在专用线程中执行同一个同步 Session 的数据库操作
+
+    后台优化任务运行在事件循环中，直接调用同步 Session 的提交、查询会阻塞
+    SSE 推送、状态查询和其他会话。所有读写（包括修改 ORM 对象的属性）都放进
+    run() 的回调中执行：单线程执行器保证同一 Session 的操作按提交顺序串行，
+    即使多个协程（流水线、段落并行）同时使用，或调用方在等待时被取消。
+    """
+
+    def __init__(self, session: Session):
+        self.session = session
+        # ORM 对象的属性会在事件循环中读取，提交后不能过期，否则读取时会触发懒加载查询
+        self.session.expire_on_commit = False
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-session")
+
+    async def run(self, fn: Callable[..., T], *args) -> T:
+        # 已提交的操作即使调用方被取消（如会话停止）也会执行完，不会丢失排队中的写入
+        future = self._executor.submit(fn, *args)
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    async def commit(self):
+        await self.run(self.session.commit)
+
+    async def refresh(self, instance):
+        await self.run(self.session.refresh, instance)
+
+    async def close(self):
+        """关闭 Session 并在已排队的操作完成后结束线程"""
+        try:
+            await self.run(self.session.close)
+        finally:
+            self._executor.shutdown(wait=False)
+
+
 def init_db():
     """初始化数据库 - 安全地创建或更新数据库结构"""
     try:
@@ -78,6 +118,9 @@ def _add_performance_indexes():
             ("idx_change_log_session_id", "change_logs", "session_id"),
             ("idx_change_log_segment_index", "change_logs", "segment_index"),
             ("idx_change_log_stage", "change_logs", "stage"),
+            
+            # QueueStatus indexes
+            ("idx_queue_status_status", "queue_status", "status"),
         ]
         
         with engine.connect() as conn:
@@ -141,6 +184,22 @@ def _migrate_database_schema():
                         _add_column_safely(conn, "optimization_sessions", "emotion_base_url", "VARCHAR(255)")
                         if added:
                             print("  ✓ 添加字段: optimization_sessions.emotion_* 字段")
+                    
+                    if "use_cache" not in columns:
+                        if _add_column_safely(conn, "optimization_sessions", "use_cache", "BOOLEAN DEFAULT 1"):
+                            print("  ✓ 添加字段: optimization_sessions.use_cache")
+                    
+                    if "parallel_segments" not in columns:
+                        if _add_column_safely(conn, "optimization_sessions", "parallel_segments", "BOOLEAN DEFAULT 0"):
+                            print("  ✓ 添加字段: optimization_sessions.parallel_segments")
+                    
+                    if "deduplicated_calls" not in columns:
+                        if _add_column_safely(conn, "optimization_sessions", "deduplicated_calls", "INTEGER DEFAULT 0"):
+                            print("  ✓ 添加字段: optimization_sessions.deduplicated_calls")
+                    
+                    if "passthrough_stats" not in columns:
+                        if _add_column_safely(conn, "optimization_sessions", "passthrough_stats", "TEXT"):
+                            print("  ✓ 添加字段: optimization_sessions.passthrough_stats")
             
                 # 迁移 users 表
                 if "users" in tables:
@@ -169,6 +228,10 @@ def _migrate_database_schema():
                     if "is_title" not in segment_columns:
                         if _add_column_safely(conn, "optimization_segments", "is_title", "BOOLEAN DEFAULT 0"):
                             print("  ✓ 添加字段: optimization_segments.is_title")
+                    
+                    if "passthrough" not in segment_columns:
+                        if _add_column_safely(conn, "optimization_segments", "passthrough", "VARCHAR(20)"):
+                            print("  ✓ 添加字段: optimization_segments.passthrough")
             
                 # 迁移 custom_prompts 表
                 if "custom_prompts" in tables:
@@ -181,6 +244,39 @@ def _migrate_database_schema():
                     if "is_active" not in prompt_columns:
                         if _add_column_safely(conn, "custom_prompts", "is_active", "BOOLEAN DEFAULT 1"):
                             print("  ✓ 添加字段: custom_prompts.is_active")
+            
+                # 迁移 queue_status 表
+                if "queue_status" in tables:
+                    queue_columns = {column["name"] for column in inspector.get_columns("queue_status")}
+                    
+                    if "lease_owner" not in queue_columns:
+                        added = _add_column_safely(conn, "queue_status", "lease_owner", "VARCHAR(255)")
+                        _add_column_safely(conn, "queue_status", "lease_expires_at", "TIMESTAMP")
+                        _add_column_safely(conn, "queue_status", "heartbeat_at", "TIMESTAMP")
+                        _add_column_safely(conn, "queue_status", "attempts", "INTEGER DEFAULT 0")
+                        if added:
+                            print("  ✓ 添加字段: queue_status 租约字段")
+            
+                # 迁移 session_history 表
+                if "session_history" in tables:
+                    history_columns = {column["name"] for column in inspector.get_columns("session_history")}
+                    
+                    if "segment_index" not in history_columns:
+                        if _add_column_safely(conn, "session_history", "segment_index", "INTEGER"):
+                            print("  ✓ 添加字段: session_history.segment_index")
+            
+                # 迁移 llm_usage 表: 去掉旧版本创建的外键，删除会话或用户时用量记录保留
+                # （SQLite 默认不启用外键约束，旧表无需重建）
+                if "llm_usage" in tables and engine.dialect.name != "sqlite":
+                    for foreign_key in inspector.get_foreign_keys("llm_usage"):
+                        if not foreign_key.get("name"):
+                            continue
+                        try:
+                            conn.execute(text(f"ALTER TABLE llm_usage DROP CONSTRAINT {foreign_key['name']}"))
+                            conn.commit()
+                            print(f"  ✓ 删除外键: llm_usage.{foreign_key['name']}")
+                        except Exception:
+                            conn.rollback()
     
     except Exception as e:
         print(f"  ⚠ 数据库迁移警告: {str(e)}")
@@ -5,7 +5,10 @@ from app.models.models import (
     OptimizationSegment,
     SessionHistory,
     ChangeLog,
-    QueueStatus
+    QueueStatus,
+    ConcurrencySlot,
+    LLMResponseCache,
+    LLMUsage
 )
 
 __all__ = [
@@ -15,5 +18,8 @@ __all__ = [
     "OptimizationSegment",
     "SessionHistory",
     "ChangeLog",
-    "QueueStatus"
+    "QueueStatus",
+    "ConcurrencySlot",
+    "LLMResponseCache",
+    "LLMUsage"
 ]
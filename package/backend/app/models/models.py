@@ -1,3 +1,4 @@
+import json
 from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey, Float
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -75,6 +76,18 @@ class OptimizationSession(Base):
     # 处理模式: 'paper_polish', 'paper_polish_enhance', 'emotion_polish'
     processing_mode = Column(String(50), default='paper_polish_enhance')
     
+    # 是否使用 LLM 响应缓存（会话级开关）
+    use_cache = Column(Boolean, default=True)
+    
+    # 段落并行处理（以相邻段落为上下文，不依赖前一段输出）
+    parallel_segments = Column(Boolean, default=False)
+    
+    # 重复段落（忽略空白差异）直接复制结果节省的 AI 调用次数
+    deduplicated_calls = Column(Integer, default=0)
+    
+    # 按类别统计的非正文段落数（JSON，如 {"reference": 12, "code": 5}）
+    passthrough_stats = Column(Text, nullable=True)
+    
     # 关系
     user = relationship("User", back_populates="sessions")
     segments = relationship("OptimizationSegment", back_populates="session", cascade="all, delete-orphan")
@@ -85,6 +98,11 @@ class OptimizationSession(Base):
         """Return how many segments finished successfully."""
         return sum(1 for segment in self.segments if segment.status == "completed")
 
+    @property
+    def passthrough_counts(self) -> dict:
+        """按类别统计的非正文段落数"""
+        return json.loads(self.passthrough_stats) if self.passthrough_stats else {}
+
 
 class OptimizationSegment(Base):
     """优化段落表"""
@@ -99,6 +117,7 @@ class OptimizationSegment(Base):
     enhanced_text = Column(Text, nullable=True)
     status = Column(String(50), index=True)  # 'pending', 'processing', 'completed', 'failed'
     is_title = Column(Boolean, default=False)
+    passthrough = Column(String(20), nullable=True)  # 非正文段落类别: 'reference', 'code', 'formula', 'table', 'url'，原样保留
     created_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
     
@@ -115,7 +134,8 @@ class SessionHistory(Base):
     stage = Column(String(50))  # 'polish' 或 'enhance'
     history_data = Column(Text)  # JSON格式的历史会话
     is_compressed = Column(Boolean, default=False)
-    character_count = Column(Integer, default=0)  # 汉字数量
+    character_count = Column(Integer, default=0)  # 历史 token 数（token_estimator 估算，旧数据为汉字数量）
+    segment_index = Column(Integer, nullable=True)  # 压缩快照覆盖到的段落序号（含），续跑时只补入之后的输出
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # 关系
@@ -137,17 +157,35 @@ class ChangeLog(Base):
 
 
 class QueueStatus(Base):
-    """队列状态表"""
+    """队列状态表（持久化任务队列，每个排队中或处理中的会话一行）"""
     __tablename__ = "queue_status"
     
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(String(255), unique=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     position = Column(Integer)  # 队列位置
-    status = Column(String(50))  # 'queued' 或 'processing'
+    status = Column(String(50), index=True)  # 'queued' 或 'processing'
     created_at = Column(DateTime, default=datetime.utcnow)
     started_at = Column(DateTime, nullable=True)
 
+    # 租约：处理中的任务由持有租约的工作进程定期续期，过期后可被其他进程（或重启后的本进程）接管
+    lease_owner = Column(String(255), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    attempts = Column(Integer, default=0)  # 被领取的次数，大于 1 表示中断后恢复
+
+
+class ConcurrencySlot(Base):
+    """并发名额表（CONCURRENCY_BACKEND=sql 时多个 worker 进程共享名额与排队顺序）"""
+    __tablename__ = "concurrency_slots"
+
+    id = Column(Integer, primary_key=True, index=True)  # 自增主键即排队顺序
+    session_id = Column(String(255), unique=True, index=True)
+    state = Column(String(20))  # 'active' 或 'queued'
+    owner = Column(String(255))  # 写入该记录的进程
+    expires_at = Column(DateTime, index=True)  # 持有者或等待者停止续期后自动释放
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 
 class SystemSetting(Base):
     """系统设置表"""
@@ -157,3 +195,47 @@ class SystemSetting(Base):
     key = Column(String(100), unique=True, nullable=False)
     value = Column(String(255), nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class LLMResponseCache(Base):
+    """LLM 响应缓存表（按模型、消息、温度和阶段的哈希寻址）"""
+    __tablename__ = "llm_response_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    cache_key = Column(String(64), unique=True, index=True, nullable=False)
+    stage = Column(String(50))
+    model = Column(String(100))
+    response = Column(Text, nullable=False)
+    hit_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_accessed_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class LLMUsage(Base):
+    """LLM 调用用量表（每个段落每个阶段一条，用于容量规划）
+
+    user_id 与 processing_mode 冗余保存，会话删除后仍可按卡密和模式统计。
+    session_id 和 user_id 不设外键，删除会话或用户时用量记录保留。
+    """
+    __tablename__ = "llm_usage"
+
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer, index=True)
+    user_id = Column(Integer, index=True)
+    processing_mode = Column(String(50))
+    segment_index = Column(Integer)
+    stage = Column(String(50), index=True)  # 'polish'、'enhance'、'emotion_polish' 或 'compression'
+    model = Column(String(100), index=True)
+    endpoint = Column(String(255))
+    system_tokens = Column(Integer, default=0)  # 阶段系统提示词
+    history_tokens = Column(Integer, default=0)  # 历史上下文
+    input_tokens = Column(Integer, default=0)  # 当前段落
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    cached_tokens = Column(Integer, default=0)
+    latency_ms = Column(Float, default=0.0)  # 墙钟耗时（不含限流排队）
+    ttft_ms = Column(Float, nullable=True)  # 首 token 耗时，仅流式调用
+    streamed = Column(Boolean, default=False)
+    from_cache = Column(Boolean, default=False)  # 命中本地响应缓存
+    estimated = Column(Boolean, default=False)  # 上游未返回 usage，token 数为本地估算
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
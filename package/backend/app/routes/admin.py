@@ -3,6 +3,7 @@ from datetime import datetime, timedelta
 from typing import Any, Dict, List, Optional, Type
 
 from fastapi import APIRouter, Depends, Header, HTTPException, status, Request
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from sqlalchemy import inspect, func, case
 from sqlalchemy.orm import Session, defer, joinedload
@@ -11,6 +12,8 @@ from app.config import reload_settings, settings
 from app.database import get_db
 from app.models.models import (
     ChangeLog,
+    LLMResponseCache,
+    LLMUsage,
     OptimizationSegment,
     OptimizationSession,
     SessionHistory,
@@ -24,7 +27,15 @@ from app.schemas import (
     UserResponse,
     UserUsageUpdate,
 )
+from app.services.ai_service import prompt_cache_stats
+from app.services.cancellation import cancellation_registry
 from app.services.concurrency import concurrency_manager
+from app.services.job_queue import job_queue
+from app.services.deadline_policy import deadline_policy
+from app.services.endpoint_router import endpoint_router
+from app.services.metrics import metrics
+from app.services.rate_limiter import rate_limiter
+from app.services.token_estimator import token_estimator
 from app.utils.auth import (
     create_access_token,
     generate_access_link,
@@ -62,6 +73,8 @@ ALLOWED_TABLES: Dict[str, Type] = {
     "session_history": SessionHistory,
     "change_logs": ChangeLog,
     "system_settings": SystemSetting,
+    "llm_response_cache": LLMResponseCache,
+    "llm_usage": LLMUsage,
 }
 
 
@@ -115,7 +128,7 @@ async def verify_admin_token_endpoint(authorization: Optional[str] = Header(None
 
 
 @router.post("/verify-card-key")
-async def verify_card_key(data: CardKeyVerify, db: Session = Depends(get_db)) -> Dict[str, Any]:
+def verify_card_key(data: CardKeyVerify, db: Session = Depends(get_db)) -> Dict[str, Any]:
     # 速率限制: 每分钟最多10次卡密验证 (在 main.py 的 limiter 中配置)
     user = db.query(User).filter(User.card_key == data.card_key, User.is_active.is_(True)).first()
     if not user:
@@ -127,7 +140,7 @@ async def verify_card_key(data: CardKeyVerify, db: Session = Depends(get_db)) ->
 
 
 @router.post("/card-keys")
-async def create_card_key(
+def create_card_key(
     data: CardKeyCreate,
     _: str = Depends(get_admin_from_token),
     db: Session = Depends(get_db),
@@ -158,7 +171,7 @@ async def create_card_key(
 
 
 @router.post("/batch-generate-keys")
-async def batch_generate_keys(
+def batch_generate_keys(
     count: int,
     prefix: str = "",
     usage_limit: Optional[int] = None,
@@ -189,12 +202,12 @@ async def batch_generate_keys(
 
 
 @router.get("/users", response_model=List[UserResponse])
-async def get_all_users(_: str = Depends(get_admin_from_token), db: Session = Depends(get_db)) -> List[User]:
+def get_all_users(_: str = Depends(get_admin_from_token), db: Session = Depends(get_db)) -> List[User]:
     return db.query(User).order_by(User.created_at.desc()).all()
 
 
 @router.patch("/users/{user_id}/toggle")
-async def toggle_user_status(
+def toggle_user_status(
     user_id: int,
     _: str = Depends(get_admin_from_token),
     db: Session = Depends(get_db),
@@ -215,7 +228,7 @@ async def toggle_user_status(
 
 
 @router.patch("/users/{user_id}/usage")
-async def update_user_usage(
+def update_user_usage(
     user_id: int,
     payload: UserUsageUpdate,
     _: str = Depends(get_admin_from_token),
@@ -239,7 +252,7 @@ async def update_user_usage(
 
 
 @router.post("/sessions/{session_id}/stop")
-async def admin_stop_session(
+def admin_stop_session(
     session_id: str,
     _: str = Depends(get_admin_from_token),
     db: Session = Depends(get_db)
@@ -257,13 +270,15 @@ async def admin_stop_session(
         
     session.status = "stopped"
     session.error_message = "管理员手动停止"
+    job_queue.remove(db, session_id)
     db.commit()
+    cancellation_registry.cancel(session_id)
     
     return {"message": "会话已停止"}
 
 
 @router.delete("/users/{user_id}")
-async def delete_user(
+def delete_user(
     user_id: int,
     _: str = Depends(get_admin_from_token),
     db: Session = Depends(get_db),
@@ -277,8 +292,8 @@ async def delete_user(
     return {"message": "用户已删除", "card_key": user.card_key}
 
 
-@router.get("/statistics")
-async def get_statistics(_: str = Depends(get_admin_from_token), db: Session = Depends(get_db)) -> Dict[str, Any]:
+def _collect_statistics(db: Session) -> Dict[str, Any]:
+    """统计数据库中的用户、会话和段落数据（在线程池中执行）"""
     total_users = db.query(User).count() or 0
     active_users = db.query(User).filter(User.is_active.is_(True)).count() or 0
     inactive_users = total_users - active_users
@@ -367,11 +382,114 @@ async def get_statistics(_: str = Depends(get_admin_from_token), db: Session = D
             "paper_polish_enhance_count": paper_polish_enhance_count,
             "emotion_polish_count": emotion_polish_count,
         },
+        "llm_cache_entries": db.query(func.count(LLMResponseCache.id)).scalar() or 0,
+    }
+
+
+@router.get("/statistics")
+async def get_statistics(_: str = Depends(get_admin_from_token), db: Session = Depends(get_db)) -> Dict[str, Any]:
+    # 数据库统计在线程池中执行；各组件的内存计数只在事件循环中读取，避免与写入并发
+    statistics = await run_in_threadpool(_collect_statistics, db)
+    cache_entries = statistics.pop("llm_cache_entries")
+    return {
+        **statistics,
+        "retries": metrics.snapshot("retry"),
+        "rate_limits": {
+            "throttled": metrics.snapshot("rate_limit"),
+            "endpoints": rate_limiter.snapshot(),
+        },
+        "upstream_endpoints": {
+            "routing": endpoint_router.snapshot(),
+            "hedging": metrics.snapshot("endpoint"),
+        },
+        "deadlines": deadline_policy.snapshot(),
+        "cancellations": metrics.snapshot("cancellation"),
+        "history_compression": metrics.snapshot("history_compression"),
+        "segment_dedup": metrics.snapshot("segment_dedup"),
+        "segment_passthrough": metrics.snapshot("segment_passthrough"),
+        "job_queue": {
+            "owner": job_queue.owner,
+            "running": job_queue.running_count(),
+            **metrics.snapshot("job_queue"),
+        },
+        "prompt_cache": prompt_cache_stats(),
+        "token_budget": {
+            "estimator": token_estimator.backend,
+            **metrics.snapshot("token_budget"),
+        },
+        "llm_cache": {
+            **metrics.snapshot("llm_cache"),
+            "entries": cache_entries,
+        },
     }
 
 
+USAGE_GROUP_COLUMNS = {
+    "card_key": User.card_key,
+    "model": LLMUsage.model,
+    "day": func.date(LLMUsage.created_at),
+    "processing_mode": LLMUsage.processing_mode,
+    "stage": LLMUsage.stage,
+}
+
+
+@router.get("/usage")
+def get_usage(
+    group_by: str = "day",
+    days: int = 30,
+    _: str = Depends(get_admin_from_token),
+    db: Session = Depends(get_db),
+) -> Dict[str, Any]:
+    """按卡密 / 模型 / 日期 / 处理模式 / 阶段汇总 LLM 用量"""
+    group_keys = [key.strip() for key in group_by.split(",") if key.strip()]
+    invalid = [key for key in group_keys if key not in USAGE_GROUP_COLUMNS]
+    if not group_keys or invalid:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"group_by 仅支持: {', '.join(USAGE_GROUP_COLUMNS)}",
+        )
+
+    group_columns = [USAGE_GROUP_COLUMNS[key].label(key) for key in group_keys]
+    query = db.query(
+        *group_columns,
+        func.count(LLMUsage.id).label("calls"),
+        func.sum(LLMUsage.system_tokens).label("system_tokens"),
+        func.sum(LLMUsage.history_tokens).label("history_tokens"),
+        func.sum(LLMUsage.input_tokens).label("input_tokens"),
+        func.sum(LLMUsage.prompt_tokens).label("prompt_tokens"),
+        func.sum(LLMUsage.completion_tokens).label("completion_tokens"),
+        func.sum(LLMUsage.cached_tokens).label("cached_tokens"),
+        func.avg(LLMUsage.latency_ms).label("avg_latency_ms"),
+        func.max(LLMUsage.latency_ms).label("max_latency_ms"),
+        func.avg(LLMUsage.ttft_ms).label("avg_ttft_ms"),
+        func.sum(case((LLMUsage.from_cache.is_(True), 1), else_=0)).label("cache_hits"),
+        func.sum(case((LLMUsage.estimated.is_(True), 1), else_=0)).label("estimated_calls"),
+    )
+    if "card_key" in group_keys:
+        query = query.outerjoin(User, User.id == LLMUsage.user_id)
+    if days > 0:
+        query = query.filter(LLMUsage.created_at >= datetime.utcnow() - timedelta(days=days))
+
+    rows = query.group_by(*group_columns).order_by(*group_columns).all()
+
+    items = []
+    for row in rows:
+        data = row._asdict()
+        for key in ("avg_latency_ms", "max_latency_ms", "avg_ttft_ms"):
+            if data[key] is not None:
+                data[key] = round(float(data[key]), 1)
+        for key in group_keys:
+            if data[key] is not None and not isinstance(data[key], str):
+                data[key] = str(data[key])
+        prompt_tokens = data["prompt_tokens"] or 0
+        data["cache_hit_ratio"] = round((data["cached_tokens"] or 0) / prompt_tokens, 4) if prompt_tokens else 0.0
+        items.append(data)
+
+    return {"group_by": group_keys, "days": days, "items": items}
+
+
 @router.get("/users/{user_id}/details")
-async def get_user_details(
+def get_user_details(
     user_id: int,
     _: str = Depends(get_admin_from_token),
     db: Session = Depends(get_db),
@@ -433,7 +551,7 @@ async def get_user_details(
 
 
 @router.post("/generate-keys", response_model=List[CardKeyResponse])
-async def generate_keys(
+def generate_keys(
     data: CardKeyGenerate,
     admin_password: str,
     db: Session = Depends(get_db),
@@ -467,7 +585,7 @@ async def generate_keys(
 
 
 @router.get("/sessions")
-async def get_all_sessions(
+def get_all_sessions(
     _: str = Depends(get_admin_from_token),
     db: Session = Depends(get_db),
     limit: int = 100,
@@ -545,6 +663,8 @@ async def get_all_sessions(
             "enhanced_char_count": int(stats['enhanced_chars']),
             "total_segments": stats['total'],
             "completed_segments": stats['completed'],
+            "deduplicated_calls": session.deduplicated_calls or 0,
+            "passthrough_counts": session.passthrough_counts,
             "progress": round((stats['completed'] / stats['total'] * 100) if stats['total'] > 0 else 0, 1),
             "created_at": session.created_at.isoformat() if session.created_at else None,
             "completed_at": session.completed_at.isoformat() if session.completed_at else None,
@@ -556,7 +676,7 @@ async def get_all_sessions(
 
 
 @router.get("/sessions/active")
-async def get_active_sessions(
+def get_active_sessions(
     _: str = Depends(get_admin_from_token),
     db: Session = Depends(get_db)
 ) -> List[Dict[str, Any]]:
@@ -631,7 +751,7 @@ async def get_active_sessions(
 
 
 @router.get("/users/{user_id}/sessions")
-async def get_user_sessions(
+def get_user_sessions(
     user_id: int,
     _: str = Depends(get_admin_from_token),
     db: Session = Depends(get_db)
@@ -713,6 +833,8 @@ async def get_user_sessions(
             "enhanced_char_count": int(stats['enhanced_chars']),
             "total_segments": stats['total'],
             "completed_segments": stats['completed'],
+            "deduplicated_calls": session.deduplicated_calls or 0,
+            "passthrough_counts": session.passthrough_counts,
             "progress": session.progress,
             "created_at": session.created_at.isoformat() if session.created_at else None,
             "completed_at": session.completed_at.isoformat() if session.completed_at else None,
@@ -748,10 +870,23 @@ async def get_config(_: str = Depends(get_admin_from_token)) -> Dict[str, Any]:
         },
         "system": {
             "max_concurrent_users": settings.MAX_CONCURRENT_USERS,
+            "context_strategy": settings.CONTEXT_STRATEGY,
+            "context_window_size": settings.CONTEXT_WINDOW_SIZE,
             "history_compression_threshold": settings.HISTORY_COMPRESSION_THRESHOLD,
+            "history_summary_max_tokens": settings.HISTORY_SUMMARY_MAX_TOKENS,
+            "history_compression_speculative_ratio": settings.HISTORY_COMPRESSION_SPECULATIVE_RATIO,
             "default_usage_limit": settings.DEFAULT_USAGE_LIMIT,
             "segment_skip_threshold": settings.SEGMENT_SKIP_THRESHOLD,
+            "segment_parallelism": settings.SEGMENT_PARALLELISM,
+            "segment_dedup": settings.SEGMENT_DEDUP,
+            "segment_passthrough": settings.SEGMENT_PASSTHROUGH,
+            "stage_pipelining": settings.STAGE_PIPELINING,
+            "write_behind_max_delay_ms": settings.WRITE_BEHIND_MAX_DELAY_MS,
             "use_streaming": settings.USE_STREAMING,
+            "message_layout": settings.MESSAGE_LAYOUT,
+            "log_level": settings.LOG_LEVEL,
+            "log_body_sample_rate": settings.LOG_BODY_SAMPLE_RATE,
+            "log_max_body_chars": settings.LOG_MAX_BODY_CHARS,
         },
     }
 
@@ -807,12 +942,12 @@ async def update_config(
 
 
 @router.get("/database/tables")
-async def list_tables(_: str = Depends(get_admin_from_token)) -> Dict[str, List[str]]:
+def list_tables(_: str = Depends(get_admin_from_token)) -> Dict[str, List[str]]:
     return {"tables": list(ALLOWED_TABLES.keys())}
 
 
 @router.get("/database/{table_name}")
-async def fetch_table_records(
+def fetch_table_records(
     table_name: str,
     skip: int = 0,
     limit: int = 50,
@@ -831,7 +966,7 @@ async def fetch_table_records(
 
 
 @router.put("/database/{table_name}/{record_id}")
-async def update_table_record(
+def update_table_record(
     table_name: str,
     record_id: int,
     payload: DatabaseUpdateRequest,
@@ -859,7 +994,7 @@ async def update_table_record(
 
 
 @router.delete("/database/{table_name}/{record_id}")
-async def delete_table_record(
+def delete_table_record(
     table_name: str,
     record_id: int,
     _: str = Depends(get_admin_from_token),
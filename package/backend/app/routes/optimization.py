@@ -1,16 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Request
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session, defer
 from sqlalchemy import func, and_, case
 from typing import List
 import json
-from app.database import get_db
+from app.database import get_db, SessionLocal, SessionExecutor
 from app.models.models import User, OptimizationSession, OptimizationSegment, ChangeLog
 from app.schemas import (
     OptimizationCreate, SessionResponse, SessionDetailResponse,
     QueueStatusResponse, ProgressUpdate, ChangeLogResponse, ExportConfirmation
 )
+from app.services.cancellation import cancellation_registry
 from app.services.optimization_service import OptimizationService
 from app.services.concurrency import concurrency_manager
+from app.services.job_queue import job_queue
 from app.services.stream_manager import stream_manager
 from app.utils.auth import generate_session_id
 from datetime import datetime
@@ -37,24 +40,46 @@ def get_current_user(card_key: str, db: Session = Depends(get_db)) -> User:
     return user
 
 
-async def run_optimization(session_id: int, db: Session):
-    """后台运行优化任务"""
-    session_obj = db.query(OptimizationSession).filter(
-        OptimizationSession.id == session_id
-    ).first()
-    
-    if not session_obj:
-        return
-    
-    service = OptimizationService(db, session_obj)
-    await service.start_optimization()
+async def run_optimization(session_id: int):
+    """运行优化任务（由 job_queue 工作池调用）
+
+    使用独立的数据库会话，所有数据库操作在专用线程中执行，不阻塞事件循环
+    """
+    db_executor = SessionExecutor(SessionLocal())
+    try:
+        session_obj = await db_executor.run(
+            lambda: db_executor.session.query(OptimizationSession).filter(
+                OptimizationSession.id == session_id
+            ).first()
+        )
+        
+        if not session_obj:
+            return
+        
+        service = OptimizationService(db_executor, session_obj)
+        # 在独立任务中运行并登记，停止接口只取消该任务，不影响请求本身
+        session_key = session_obj.session_id
+        task = asyncio.create_task(service.start_optimization())
+        cancellation_registry.register(session_key, task)
+        try:
+            await asyncio.wait({task})
+        except asyncio.CancelledError:
+            # 工作池停止：等待任务保存续跑位置后再关闭数据库会话
+            task.cancel()
+            await asyncio.wait({task})
+            raise
+        finally:
+            cancellation_registry.unregister(session_key, task)
+        if not task.cancelled():
+            task.result()
+    finally:
+        await db_executor.close()
 
 
 @router.post("/start", response_model=SessionResponse)
-async def start_optimization(
+def start_optimization(
     card_key: str,
     data: OptimizationCreate,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     """开始优化任务"""
@@ -98,16 +123,19 @@ async def start_optimization(
         enhance_base_url=data.enhance_config.base_url if data.enhance_config else None,
         emotion_model=data.emotion_config.model if data.emotion_config else None,
         emotion_api_key=data.emotion_config.api_key if data.emotion_config else None,
-        emotion_base_url=data.emotion_config.base_url if data.emotion_config else None
+        emotion_base_url=data.emotion_config.base_url if data.emotion_config else None,
+        use_cache=data.use_cache,
+        parallel_segments=data.parallel_segments
     )
     
     db.add(session)
     user.usage_count = usage_count + 1
+    # 排队记录与会话在同一事务提交，进程重启后仍会被处理
+    job_queue.enqueue(db, session)
     db.commit()
     db.refresh(session)
     
-    # 添加后台任务
-    background_tasks.add_task(run_optimization, session.id, db)
+    job_queue.notify()
     
     return session
 
@@ -119,14 +147,21 @@ async def get_queue_status(
     db: Session = Depends(get_db)
 ):
     """获取队列状态"""
-    user = get_current_user(card_key, db)
+    user = await run_in_threadpool(get_current_user, card_key, db)
     
     status = await concurrency_manager.get_status(session_id)
+    # 排队信息以持久化队列为准，工作池只在有空闲名额时领取任务
+    queue_length, position = await run_in_threadpool(job_queue.queue_status, db, session_id)
+    status["queue_length"] = queue_length
+    if position is not None:
+        status["your_position"] = position
+        # 估算等待时间(假设每个任务平均5分钟)
+        status["estimated_wait_time"] = position * 300
     return QueueStatusResponse(**status)
 
 
 @router.get("/sessions", response_model=List[SessionResponse])
-async def list_sessions(
+def list_sessions(
     card_key: str,
     limit: int = 20,
     offset: int = 0,
@@ -159,7 +194,7 @@ async def list_sessions(
 
 
 @router.get("/sessions/{session_id}", response_model=SessionDetailResponse)
-async def get_session_detail(
+def get_session_detail(
     session_id: str,
     card_key: str,
     db: Session = Depends(get_db)
@@ -182,12 +217,13 @@ async def get_session_detail(
     
     return SessionDetailResponse(
         **session.__dict__,
+        passthrough_counts=session.passthrough_counts,
         segments=[seg.__dict__ for seg in segments]
     )
 
 
 @router.get("/sessions/{session_id}/progress", response_model=ProgressUpdate)
-async def get_session_progress(
+def get_session_progress(
     session_id: str,
     card_key: str,
     db: Session = Depends(get_db)
@@ -219,16 +255,23 @@ async def get_session_progress(
 async def stream_session_progress(
     session_id: str,
     request: Request,
-    card_key: str,  # 简单的鉴权，实际可能需要更严格的检查
-    db: Session = Depends(get_db)
+    card_key: str  # 简单的鉴权，实际可能需要更严格的检查
 ):
     """流式获取会话进度和内容"""
-    # 验证用户权限
-    user = get_current_user(card_key, db)
-    session = db.query(OptimizationSession).filter(
-        OptimizationSession.session_id == session_id,
-        OptimizationSession.user_id == user.id
-    ).first()
+    # 鉴权使用短期数据库会话：依赖注入的会话会在整个 SSE 连接期间占用连接池
+    def authorize():
+        db = SessionLocal()
+        try:
+            # 验证用户权限
+            user = get_current_user(card_key, db)
+            return db.query(OptimizationSession).filter(
+                OptimizationSession.session_id == session_id,
+                OptimizationSession.user_id == user.id
+            ).first()
+        finally:
+            db.close()
+
+    session = await run_in_threadpool(authorize)
     
     if not session:
         raise HTTPException(status_code=404, detail="会话不存在")
@@ -255,7 +298,7 @@ async def stream_session_progress(
 
 
 @router.get("/sessions/{session_id}/changes", response_model=List[ChangeLogResponse])
-async def get_session_changes(
+def get_session_changes(
     session_id: str,
     card_key: str,
     db: Session = Depends(get_db)
@@ -321,7 +364,7 @@ async def get_session_changes(
 
 
 @router.post("/sessions/{session_id}/export")
-async def export_session(
+def export_session(
     session_id: str,
     card_key: str,
     confirmation: ExportConfirmation,
@@ -371,7 +414,7 @@ async def export_session(
 
 
 @router.delete("/sessions/{session_id}")
-async def delete_session(
+def delete_session(
     session_id: str,
     card_key: str,
     db: Session = Depends(get_db)
@@ -387,6 +430,9 @@ async def delete_session(
     if not session:
         raise HTTPException(status_code=404, detail="会话不存在")
     
+    # 先标记删除并取消运行中的任务，任务收尾时不再写入已删除的会话
+    cancellation_registry.cancel(session_id, deleted=True)
+    job_queue.remove(db, session_id)
     db.delete(session)
     db.commit()
     
@@ -394,10 +440,9 @@ async def delete_session(
 
 
 @router.post("/sessions/{session_id}/retry")
-async def retry_session(
+def retry_session(
     session_id: str,
     card_key: str,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     """重新尝试处理失败的会话，继续未完成的段落"""
@@ -418,15 +463,16 @@ async def retry_session(
     old_error = session.error_message or "未知错误"
     session.status = "queued"
     session.error_message = f"[重试中] 上次失败原因: {old_error}"
+    job_queue.enqueue(db, session)
     db.commit()
 
-    background_tasks.add_task(run_optimization, session.id, db)
+    job_queue.notify()
 
     return {"message": "已重新排队处理未完成段落"}
 
 
 @router.post("/sessions/{session_id}/stop")
-async def stop_session(
+def stop_session(
     session_id: str,
     card_key: str,
     db: Session = Depends(get_db)
@@ -448,6 +494,10 @@ async def stop_session(
     # 更新状态为 stopped
     session.status = "stopped"
     session.error_message = "用户手动停止"
+    job_queue.remove(db, session_id)
     db.commit()
 
+    # 取消正在运行的任务：进行中的 LLM 请求立即断开，并发名额随任务退出释放
+    cancellation_registry.cancel(session_id)
+
     return {"message": "会话已停止"}
@@ -30,7 +30,7 @@ def get_current_user(card_key: str, db: Session = Depends(get_db)) -> User:
 
 
 @router.get("/system", response_model=List[PromptResponse])
-async def get_system_prompts(db: Session = Depends(get_db)):
+def get_system_prompts(db: Session = Depends(get_db)):
     """获取系统预设提示词"""
     prompts = db.query(CustomPrompt).filter(
         CustomPrompt.is_system == True
@@ -39,7 +39,7 @@ async def get_system_prompts(db: Session = Depends(get_db)):
 
 
 @router.get("/", response_model=List[PromptResponse])
-async def get_user_prompts(
+def get_user_prompts(
     card_key: str,
     stage: str = None,
     db: Session = Depends(get_db)
@@ -57,7 +57,7 @@ async def get_user_prompts(
 
 
 @router.post("/", response_model=PromptResponse)
-async def create_prompt(
+def create_prompt(
     card_key: str,
     prompt_data: PromptCreate,
     db: Session = Depends(get_db)
@@ -90,7 +90,7 @@ async def create_prompt(
 
 
 @router.put("/{prompt_id}", response_model=PromptResponse)
-async def update_prompt(
+def update_prompt(
     prompt_id: int,
     card_key: str,
     prompt_data: PromptUpdate,
@@ -131,7 +131,7 @@ async def update_prompt(
 
 
 @router.delete("/{prompt_id}")
-async def delete_prompt(
+def delete_prompt(
     prompt_id: int,
     card_key: str,
     db: Session = Depends(get_db)
@@ -154,7 +154,7 @@ async def delete_prompt(
 
 
 @router.post("/{prompt_id}/set-default")
-async def set_default_prompt(
+def set_default_prompt(
     prompt_id: int,
     card_key: str,
     db: Session = Depends(get_db)
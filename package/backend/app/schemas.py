@@ -39,6 +39,8 @@ class OptimizationCreate(BaseModel):
     polish_config: Optional[ModelConfig] = None
     enhance_config: Optional[ModelConfig] = None
     emotion_config: Optional[ModelConfig] = None
+    use_cache: bool = Field(default=True, description='是否使用 LLM 响应缓存')
+    parallel_segments: bool = Field(default=False, description='段落并行处理（以相邻段落为上下文）')
 
 
 class SegmentResponse(BaseModel):
@@ -51,6 +53,7 @@ class SegmentResponse(BaseModel):
     enhanced_text: Optional[str] = None
     status: str
     is_title: bool
+    passthrough: Optional[str] = None
     created_at: datetime
     completed_at: Optional[datetime] = None
     
@@ -68,6 +71,8 @@ class SessionResponse(BaseModel):
     current_position: int
     total_segments: int
     original_char_count: int = 0
+    deduplicated_calls: int = 0
+    passthrough_counts: Dict[str, int] = {}
     error_message: Optional[str] = None
     created_at: datetime
     updated_at: datetime
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+from typing import Dict, Optional, Set, Tuple
+
+from app.services.log_pipeline import log_pipeline
+from app.services.metrics import metrics
+
+
+class CancellationRegistry:
+    """会话级取消登记
+
+    后台优化任务启动时登记自己的 asyncio 任务，停止接口通过 cancel() 直接取消：
+    进行中的 LLM 请求随任务取消立即断开，并发名额在任务退出时释放，
+    不需要每个段落查询一次数据库来发现停止。
+
+    停止接口是同步路由（在线程池中执行），取消操作通过 call_soon_threadsafe 交给事件循环。
+    删除会话时以 deleted=True 取消，任务据此跳过收尾写入（会话行已不存在）。
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, Tuple[asyncio.Task, asyncio.AbstractEventLoop]] = {}
+        self._deleted: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def register(self, session_id: str, task: Optional[asyncio.Task] = None):
+        """登记会话的运行任务，默认为当前任务"""
+        task = task or asyncio.current_task()
+        with self._lock:
+            self._tasks[session_id] = (task, task.get_loop())
+
+    def unregister(self, session_id: str, task: Optional[asyncio.Task] = None):
+        task = task or asyncio.current_task()
+        with self._lock:
+            entry = self._tasks.get(session_id)
+            if entry and entry[0] is task:
+                del self._tasks[session_id]
+                self._deleted.discard(session_id)
+
+    def cancel(self, session_id: str, deleted: bool = False) -> bool:
+        """取消会话的运行任务，可在任意线程调用；会话未在本进程运行时返回 False
+
+        deleted 为 True 表示会话即将被删除，应在删除提交之前调用。
+        """
+        with self._lock:
+            entry = self._tasks.get(session_id)
+            if entry and deleted:
+                self._deleted.add(session_id)
+        if not entry:
+            return False
+        task, loop = entry
+        try:
+            loop.call_soon_threadsafe(self._cancel_on_loop, task)
+        except RuntimeError:
+            # 事件循环已关闭
+            return False
+        log_pipeline.info(f"[CANCEL] Session {session_id} cancelled")
+        return True
+
+    @staticmethod
+    def _cancel_on_loop(task: asyncio.Task):
+        """在事件循环线程中取消任务并计数（metrics 只能在事件循环线程中调用）"""
+        task.cancel()
+        metrics.incr("cancellation", "cancelled")
+
+    def is_running(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._tasks
+
+    def is_deleted(self, session_id: str) -> bool:
+        """会话是否已随删除被取消（此后不应再写入会话及其段落）"""
+        with self._lock:
+            return session_id in self._deleted
+
+
+# 全局取消登记实例
+cancellation_registry = CancellationRegistry()
@@ -1,114 +1,474 @@
 import asyncio
-from typing import Optional, Dict, List
-from datetime import datetime
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, TypeVar
+
+from sqlalchemy.exc import IntegrityError
+
 from app.config import settings
+from app.database import SessionLocal
+from app.models.models import ConcurrencySlot, SystemSetting
+from app.services.log_pipeline import log_pipeline
 
 # 等待并发权限的最大超时时间（秒）
 ACQUIRE_TIMEOUT = 3600  # 1小时
 
+# sql 后端保存共享并发上限的系统设置键；更新该行同时充当跨进程的互斥锁
+LIMIT_SETTING_KEY = "concurrency_limit"
+
+# redis 后端的键前缀
+REDIS_KEY_PREFIX = "bypassaigc:concurrency"
+
+T = TypeVar("T")
+
+
+class SlotState:
+    """名额与排队状态
+
+    所有后端都通过这里的状态变换修改名额，各后端只负责原子地读取和写回，保证语义一致：
+    - 有空闲名额时按排队顺序依次激活
+    - 已激活的会话重复申请直接返回
+    - 上限调整后立即激活等待中的会话
+    """
+
+    def __init__(self, active: List[str], queue: List[str], limit: int):
+        self.active = active
+        self.queue = queue
+        self.limit = limit
+        # 共享后端加载时已剔除过期记录，过期即视为释放，先补齐空闲名额
+        self.promote()
+
+    def enter(self, session_id: str) -> bool:
+        """申请名额：没有空闲名额时排到队尾，返回是否已激活"""
+        if session_id not in self.active and session_id not in self.queue:
+            self.queue.append(session_id)
+        self.promote()
+        return session_id in self.active
+
+    def state_of(self, session_id: str) -> Optional[bool]:
+        """True 表示已激活，False 表示排队中，None 表示已不在队列中"""
+        if session_id in self.active:
+            return True
+        if session_id in self.queue:
+            return False
+        return None
+
+    def dequeue(self, session_id: str):
+        if session_id in self.queue:
+            self.queue.remove(session_id)
+
+    def release(self, session_id: str):
+        if session_id in self.active:
+            self.active.remove(session_id)
+        self.dequeue(session_id)
+        self.promote()
+
+    def set_limit(self, limit: int):
+        self.limit = max(1, limit)
+        self.promote()
+
+    def promote(self):
+        """为等待队列中的会话分配执行权限"""
+        while self.queue and len(self.active) < self.limit:
+            self.active.append(self.queue.pop(0))
+
+    def snapshot(self, session_id: Optional[str]) -> Tuple[int, int, int, Optional[int]]:
+        """返回 (活跃数, 上限, 排队数, 指定会话的排队位置)"""
+        position = self.queue.index(session_id) + 1 if session_id in self.queue else None
+        return len(self.active), self.limit, len(self.queue), position
+
+
+class ConcurrencyBackend:
+    """并发名额后端：在一次原子操作中加载 SlotState、执行变换并写回"""
+
+    # 名额与排队记录的租约（秒），0 表示不会过期
+    lease_seconds: float = 0
+    # 等待者检查名额的间隔（秒）；同进程内的释放会立即唤醒等待者
+    poll_interval: float = 60
+
+    def __init__(self, default_limit: int):
+        # 最近一次读取到的上限（共享后端以存储中的值为准）
+        self.limit = default_limit
+
+    async def _transact(self, operation: Callable[[SlotState], T], touch: Iterable[str] = ()) -> T:
+        """原子地执行状态变换，并为 touch 中仍存在的会话续期"""
+        raise NotImplementedError
+
+    async def enter(self, session_id: str) -> bool:
+        return await self._transact(lambda state: state.enter(session_id), (session_id,))
+
+    async def poll(self, session_id: str) -> Optional[bool]:
+        return await self._transact(lambda state: state.state_of(session_id), (session_id,))
+
+    async def dequeue(self, session_id: str):
+        await self._transact(lambda state: state.dequeue(session_id))
+
+    async def release(self, session_id: str):
+        await self._transact(lambda state: state.release(session_id))
+
+    async def set_limit(self, limit: int):
+        await self._transact(lambda state: state.set_limit(limit))
+
+    async def snapshot(self, session_id: Optional[str] = None) -> Tuple[int, int, int, Optional[int]]:
+        return await self._transact(lambda state: state.snapshot(session_id))
+
+    async def renew(self, session_ids: Iterable[str]):
+        await self._transact(lambda state: None, tuple(session_ids))
+
+
+class MemoryConcurrencyBackend(ConcurrencyBackend):
+    """进程内名额（单进程部署）"""
+
+    def __init__(self, default_limit: int):
+        super().__init__(default_limit)
+        self.state = SlotState([], [], default_limit)
+
+    async def _transact(self, operation, touch=()):
+        # 状态变换中没有 await，在事件循环中天然是原子的
+        result = operation(self.state)
+        self.limit = self.state.limit
+        return result
+
+
+class SqlConcurrencyBackend(ConcurrencyBackend):
+    """数据库租约表（concurrency_slots），多个 worker 进程共享名额与排队顺序
+
+    每次操作先更新 system_settings 中的上限行：SQLite（含 WAL 模式）下这会取得数据库写锁，
+    PostgreSQL 等数据库下会锁住该行，从而串行化所有进程的名额操作。
+    持有者与等待者定期续期，进程崩溃后记录在租约到期时自动释放。
+    数据库读写放到线程池执行，每次操作使用独立的数据库会话。
+    """
+
+    def __init__(self, default_limit: int, session_factory=SessionLocal):
+        super().__init__(default_limit)
+        self.lease_seconds = settings.CONCURRENCY_LEASE_SECONDS
+        self.poll_interval = settings.CONCURRENCY_POLL_INTERVAL_SECONDS
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._session_factory = session_factory
+        # 本进程的第一次操作以配置中的上限为准
+        self._limit_synced = False
+
+    async def _transact(self, operation, touch=()):
+        return await asyncio.to_thread(self._transact_sync, operation, tuple(touch))
+
+    def _lock_limit(self, db) -> int:
+        """锁住上限行并返回当前上限"""
+        while True:
+            locked = db.query(SystemSetting).filter(SystemSetting.key == LIMIT_SETTING_KEY).update(
+                {"value": SystemSetting.value}, synchronize_session=False
+            )
+            if locked:
+                break
+            db.add(SystemSetting(key=LIMIT_SETTING_KEY, value=str(self.limit)))
+            try:
+                db.flush()
+            except IntegrityError:
+                # 其他进程同时创建了该行
+                db.rollback()
+        if not self._limit_synced:
+            return self.limit
+        value = db.query(SystemSetting.value).filter(SystemSetting.key == LIMIT_SETTING_KEY).scalar()
+        return int(value)
+
+    def _transact_sync(self, operation, touch):
+        db = self._session_factory()
+        try:
+            limit = self._lock_limit(db)
+            now = datetime.utcnow()
+            expiry = now + timedelta(seconds=self.lease_seconds)
+            db.query(ConcurrencySlot).filter(ConcurrencySlot.expires_at < now).delete(synchronize_session=False)
+
+            rows = db.query(ConcurrencySlot).order_by(ConcurrencySlot.id).all()
+            state = SlotState(
+                [row.session_id for row in rows if row.state == "active"],
+                [row.session_id for row in rows if row.state == "queued"],
+                limit
+            )
+            result = operation(state)
+
+            # 写回变化：移除、激活、新增，并为 touch 中的会话续期
+            existing = {row.session_id: row for row in rows}
+            active = set(state.active)
+            queued = set(state.queue)
+            for row in rows:
+                if row.session_id in active:
+                    if row.state != "active":
+                        row.state = "active"
+                        row.expires_at = expiry
+                elif row.session_id not in queued:
+                    db.delete(row)
+            for session_id in state.active + state.queue:
+                if session_id not in existing:
+                    db.add(ConcurrencySlot(
+                        session_id=session_id,
+                        state="active" if session_id in active else "queued",
+                        owner=self.owner,
+                        expires_at=expiry
+                    ))
+            for session_id in touch:
+                row = existing.get(session_id)
+                if row is not None and (session_id in active or session_id in queued):
+                    row.expires_at = expiry
+
+            db.query(SystemSetting).filter(SystemSetting.key == LIMIT_SETTING_KEY).update(
+                {"value": str(state.limit)}, synchronize_session=False
+            )
+            db.commit()
+            self.limit = state.limit
+            self._limit_synced = True
+            return result
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+class RedisConcurrencyBackend(ConcurrencyBackend):
+    """Redis 共享名额（使用 REDIS_URL），多个 worker 进程共享名额与排队顺序
+
+    状态保存在三个有序集合中：激活的会话（分值为租约到期时间）、排队顺序、排队租约到期时间；
+    通过 WATCH/MULTI 乐观事务保证原子性，冲突时重试。可传入兼容 redis.asyncio 的客户端。
+    """
+
+    def __init__(self, default_limit: int, client=None, prefix: str = REDIS_KEY_PREFIX):
+        super().__init__(default_limit)
+        self.lease_seconds = settings.CONCURRENCY_LEASE_SECONDS
+        self.poll_interval = settings.CONCURRENCY_POLL_INTERVAL_SECONDS
+        self._client = client
+        self._limit_key = f"{prefix}:limit"
+        self._active_key = f"{prefix}:active"
+        self._queue_key = f"{prefix}:queue"
+        self._queue_expiry_key = f"{prefix}:queue_expiry"
+        self._limit_synced = False
+
+    def _get_client(self):
+        if self._client is None:
+            import redis.asyncio as redis
+
+            self._client = redis.from_url(settings.REDIS_URL, decode_responses=True)
+        return self._client
+
+    @staticmethod
+    def _text(value) -> str:
+        return value.decode() if isinstance(value, bytes) else value
+
+    async def _transact(self, operation, touch=()):
+        from redis.exceptions import WatchError
+
+        keys = (self._limit_key, self._active_key, self._queue_key, self._queue_expiry_key)
+        async with self._get_client().pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(*keys)
+                    now = time.time()
+                    expiry = now + self.lease_seconds
+                    stored_limit = await pipe.get(self._limit_key)
+                    active_expiry = {
+                        self._text(member): score
+                        for member, score in await pipe.zrange(self._active_key, 0, -1, withscores=True)
+                    }
+                    queue_order = [
+                        (self._text(member), score)
+                        for member, score in await pipe.zrange(self._queue_key, 0, -1, withscores=True)
+                    ]
+                    queue_expiry = {
+                        self._text(member): score
+                        for member, score in await pipe.zrange(self._queue_expiry_key, 0, -1, withscores=True)
+                    }
+
+                    limit = self.limit
+                    if self._limit_synced and stored_limit is not None:
+                        limit = int(self._text(stored_limit))
+                    state = SlotState(
+                        [member for member, score in active_expiry.items() if score >= now],
+                        [member for member, _ in queue_order if queue_expiry.get(member, 0) >= now],
+                        limit
+                    )
+                    previous_active = set(state.active)
+                    previous_queue = set(state.queue)
+                    result = operation(state)
+
+                    pipe.multi()
+                    pipe.set(self._limit_key, state.limit)
+                    active = set(state.active)
+                    queued = set(state.queue)
+                    # 移除已释放、出队或过期的记录
+                    stale_active = [member for member in active_expiry if member not in active]
+                    stale_queue = [member for member, _ in queue_order if member not in queued]
+                    if stale_active:
+                        pipe.zrem(self._active_key, *stale_active)
+                    if stale_queue:
+                        pipe.zrem(self._queue_key, *stale_queue)
+                        pipe.zrem(self._queue_expiry_key, *stale_queue)
+                    # 新激活、新排队以及需要续期的会话
+                    renewed_active = {
+                        member: expiry for member in active
+                        if member not in previous_active or member in touch
+                    }
+                    if renewed_active:
+                        pipe.zadd(self._active_key, renewed_active)
+                    next_order = max((score for _, score in queue_order), default=0)
+                    for member in state.queue:
+                        if member not in previous_queue:
+                            next_order += 1
+                            pipe.zadd(self._queue_key, {member: next_order})
+                            pipe.zadd(self._queue_expiry_key, {member: expiry})
+                        elif member in touch:
+                            pipe.zadd(self._queue_expiry_key, {member: expiry})
+                    await pipe.execute()
+
+                    self.limit = state.limit
+                    self._limit_synced = True
+                    return result
+                except WatchError:
+                    continue
+
+
+def create_backend(name: str, default_limit: int) -> ConcurrencyBackend:
+    """按 CONCURRENCY_BACKEND 创建名额后端"""
+    if name == "sql":
+        return SqlConcurrencyBackend(default_limit)
+    if name == "redis":
+        return RedisConcurrencyBackend(default_limit)
+    if name != "memory":
+        log_pipeline.warning(f"[CONCURRENCY] 未知的并发后端 {name}，使用进程内后端")
+    return MemoryConcurrencyBackend(default_limit)
+
 
 class ConcurrencyManager:
-    """并发控制管理器"""
-    
-    def __init__(self, max_concurrent: int = None):
-        self.max_concurrent = max_concurrent or settings.MAX_CONCURRENT_USERS
-        self.active_sessions: Dict[str, datetime] = {}
-        self.queue: List[str] = []
-        self._lock = asyncio.Lock()
-        self._condition = asyncio.Condition(self._lock)  # 添加条件变量
-    
+    """并发控制管理器
+
+    名额与排队顺序保存在 CONCURRENCY_BACKEND 指定的后端中：memory 为进程内状态；
+    sql、redis 在多个 worker 进程之间共享同一个上限和排队顺序。
+    """
+
+    def __init__(self, max_concurrent: int = None, backend: Optional[ConcurrencyBackend] = None):
+        self._default_limit = max_concurrent or settings.MAX_CONCURRENT_USERS
+        self._backend = backend
+        self._condition = asyncio.Condition()  # 本进程内释放名额时唤醒等待者
+        # 每次唤醒递增，等待者据此发现查询后端期间发生的释放
+        self._wakeups = 0
+        # 本进程持有的名额，共享后端中需要定期续期
+        self._held: Set[str] = set()
+        self._renewal: Optional[asyncio.Task] = None
+
+    @property
+    def backend(self) -> ConcurrencyBackend:
+        if self._backend is None:
+            self._backend = create_backend(settings.CONCURRENCY_BACKEND, self._default_limit)
+        return self._backend
+
+    @property
+    def max_concurrent(self) -> int:
+        """当前并发上限（共享后端为最近一次读取到的值）"""
+        return self.backend.limit
+
     async def acquire(self, session_id: str, timeout: float = ACQUIRE_TIMEOUT) -> bool:
         """获取执行权限
-        
+
         Args:
             session_id: 会话ID
             timeout: 等待超时时间（秒），默认1小时
-            
+
         Returns:
             True if acquired, False if timed out or removed from queue
         """
-        async with self._condition:
-            # 如果已经在活跃会话中,直接返回
-            if session_id in self.active_sessions:
-                return True
-            
-            if len(self.active_sessions) < self.max_concurrent:
-                self.active_sessions[session_id] = datetime.utcnow()
-                return True
+        if await self.backend.enter(session_id):
+            self._hold(session_id)
+            return True
 
-            if session_id not in self.queue:
-                self.queue.append(session_id)
-            
-            # 等待被唤醒，设置超时防止无限等待
-            start_time = datetime.utcnow()
-            while session_id not in self.active_sessions and session_id in self.queue:
+        # 等待被唤醒，设置超时防止无限等待；查询后端时不持有锁，避免共享后端的 I/O 串行化所有等待者
+        start_time = time.monotonic()
+        while True:
+            wakeups = self._wakeups
+            state = await self.backend.poll(session_id)
+            if state:
+                self._hold(session_id)
+                return True
+            if state is None:
+                # 已被移出队列（如会话被停止）
+                return False
+            remaining_timeout = timeout - (time.monotonic() - start_time)
+            if remaining_timeout <= 0:
+                # 超时，从队列中移除
+                await self.backend.dequeue(session_id)
+                return False
+            async with self._condition:
+                if self._wakeups != wakeups:
+                    # 查询期间本进程已有释放，立即重新检查
+                    continue
                 try:
-                    # 使用 wait_for 设置超时
-                    remaining_timeout = timeout - (datetime.utcnow() - start_time).total_seconds()
-                    if remaining_timeout <= 0:
-                        # 超时，从队列中移除
-                        if session_id in self.queue:
-                            self.queue.remove(session_id)
-                        return False
-                    await asyncio.wait_for(self._condition.wait(), timeout=min(remaining_timeout, 60))
+                    await asyncio.wait_for(
+                        self._condition.wait(),
+                        timeout=min(remaining_timeout, self.backend.poll_interval)
+                    )
                 except asyncio.TimeoutError:
-                    # 每60秒检查一次是否超时
+                    # 共享后端中其他进程释放名额无法直接唤醒，定期检查
                     continue
-            
-            return session_id in self.active_sessions
-    
+
     async def release(self, session_id: str):
         """释放执行权限"""
-        async with self._condition:
-            if session_id in self.active_sessions:
-                del self.active_sessions[session_id]
-            if session_id in self.queue:
-                self.queue.remove(session_id)
-            self._activate_waiting_locked()
-            self._condition.notify_all()  # 唤醒所有等待者
-    
+        self._held.discard(session_id)
+        await self.backend.release(session_id)
+        await self._notify_waiters()
+
     async def get_status(self, session_id: Optional[str] = None) -> Dict:
         """获取队列状态"""
-        async with self._lock:
-            current_users = len(self.active_sessions)
-            queue_list = list(self.queue)
-            
-            status = {
-                "current_users": current_users,
-                "max_users": self.max_concurrent,
-                "queue_length": len(queue_list),
-                "your_position": None,
-                "estimated_wait_time": None
-            }
-            
-            if session_id and session_id in queue_list:
-                position = queue_list.index(session_id) + 1
-                status["your_position"] = position
-                # 估算等待时间(假设每个任务平均5分钟)
-                status["estimated_wait_time"] = position * 300
-            
-            return status
-    
+        current_users, max_users, queue_length, position = await self.backend.snapshot(session_id)
+
+        status = {
+            "current_users": current_users,
+            "max_users": max_users,
+            "queue_length": queue_length,
+            "your_position": None,
+            "estimated_wait_time": None
+        }
+
+        if position is not None:
+            status["your_position"] = position
+            # 估算等待时间(假设每个任务平均5分钟)
+            status["estimated_wait_time"] = position * 300
+
+        return status
+
     def is_active(self, session_id: str) -> bool:
-        """检查会话是否活跃"""
-        return session_id in self.active_sessions
-    
-    def get_active_count(self) -> int:
-        """获取活跃会话数量"""
-        return len(self.active_sessions)
+        """检查会话是否在本进程持有名额"""
+        return session_id in self._held
+
+    async def get_active_count(self) -> int:
+        """获取活跃会话数量（所有进程）"""
+        current_users, _, _, _ = await self.backend.snapshot()
+        return current_users
 
     async def update_limit(self, new_limit: int):
         """更新并发限制"""
+        await self.backend.set_limit(max(1, new_limit))
+        await self._notify_waiters()  # 唤醒所有等待者以检查新的限制
+
+    async def _notify_waiters(self):
         async with self._condition:
-            self.max_concurrent = max(1, new_limit)
-            self._activate_waiting_locked()
-            self._condition.notify_all()  # 唤醒所有等待者以检查新的限制
-
-    def _activate_waiting_locked(self):
-        """尝试为等待队列中的会话分配执行权限 (需持有锁)"""
-        while self.queue and len(self.active_sessions) < self.max_concurrent:
-            next_session = self.queue.pop(0)
-            self.active_sessions[next_session] = datetime.utcnow()
+            self._wakeups += 1
+            self._condition.notify_all()
+
+    def _hold(self, session_id: str):
+        self._held.add(session_id)
+        if self.backend.lease_seconds and (self._renewal is None or self._renewal.done()):
+            self._renewal = asyncio.create_task(self._renew_loop())
+
+    async def _renew_loop(self):
+        """为本进程持有的名额续期，全部释放后退出"""
+        while self._held:
+            await asyncio.sleep(self.backend.lease_seconds / 3)
+            if not self._held:
+                break
+            try:
+                await self.backend.renew(list(self._held))
+            except Exception as e:
+                log_pipeline.warning(f"[CONCURRENCY] 名额续期失败: {str(e)}")
 
 
 # 全局并发管理器实例
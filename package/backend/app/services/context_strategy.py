@@ -0,0 +1,168 @@
+from collections import deque
+from typing import TYPE_CHECKING, Deque, Dict, List
+
+from app.config import settings
+from app.models.models import OptimizationSegment
+from app.services.ai_service import estimate_tokens
+from app.services.log_pipeline import log_pipeline
+from app.utils.json_setting import parse_json_object
+
+if TYPE_CHECKING:
+    from app.services.optimization_service import OptimizationService
+
+
+class ContextStrategy:
+    """段落上下文策略
+
+    串行和流水线模式下每个阶段使用一个策略实例，决定调用 AI 时附带哪些上下文消息：
+    context() 在调用前返回上下文，record() 在段落完成后（包括续跑时已完成的段落）更新状态。
+    并行模式（parallel_segments）的段落互不依赖，始终使用相邻段落原文作为上下文。
+    """
+
+    name = ""
+
+    def __init__(self, service: "OptimizationService", stage: str):
+        self.service = service
+        self.stage = stage
+
+    async def start(self):
+        """阶段开始时调用"""
+
+    async def context(self, segments: List[OptimizationSegment], position: int) -> List[Dict[str, str]]:
+        """返回处理 segments[position] 时附带的上下文消息"""
+        return []
+
+    async def record(self, segment: OptimizationSegment, output_text: str, replayed: bool = False):
+        """记录段落输出（标题和非正文段落不会传入）；replayed 表示续跑时已完成的段落"""
+
+    def close(self):
+        """阶段结束时调用"""
+
+
+class NoContext(ContextStrategy):
+    """不带上下文，每个段落独立处理"""
+
+    name = "none"
+
+
+class WindowContext(ContextStrategy):
+    """最近 CONTEXT_WINDOW_SIZE 段的输出"""
+
+    name = "window"
+
+    def __init__(self, service: "OptimizationService", stage: str):
+        super().__init__(service, stage)
+        self._window: Deque[str] = deque(maxlen=max(settings.CONTEXT_WINDOW_SIZE, 0))
+
+    async def context(self, segments: List[OptimizationSegment], position: int) -> List[Dict[str, str]]:
+        return [{"role": "assistant", "content": text} for text in self._window]
+
+    async def record(self, segment: OptimizationSegment, output_text: str, replayed: bool = False):
+        if self._window.maxlen:
+            self._window.append(output_text)
+
+
+class SummaryContext(ContextStrategy):
+    """全部历史输出，超过 HISTORY_COMPRESSION_THRESHOLD 时压缩为滚动摘要
+
+    续跑时从最近一次压缩的历史快照开始：快照之前的段落只以摘要形式保留，之后已完成段落的输出原样补入。
+    """
+
+    name = "summary"
+
+    def __init__(self, service: "OptimizationService", stage: str):
+        super().__init__(service, stage)
+        self.history: List[Dict[str, str]] = []
+        self.history_tokens = 0
+        self.snapshot_index = -1
+
+    async def start(self):
+        service = self.service
+        self.history, self.history_tokens, self.snapshot_index = await service._db(
+            service._load_history_snapshot, self.stage
+        )
+        log_pipeline.info(
+            f"[STAGE] Loaded history snapshot covering segments[:{self.snapshot_index + 1}], "
+            f"{len(self.history)} messages, {self.history_tokens} tokens"
+        )
+
+    async def context(self, segments: List[OptimizationSegment], position: int) -> List[Dict[str, str]]:
+        if self.history_tokens > settings.HISTORY_COMPRESSION_THRESHOLD:
+            # 续跑时补入的已完成段落可能使历史超过阈值，调用前先压缩
+            self.history, self.history_tokens = await self.service._maybe_compress_history(
+                self.history, self.history_tokens, self.stage, position - 1
+            )
+        return self.history
+
+    async def record(self, segment: OptimizationSegment, output_text: str, replayed: bool = False):
+        if replayed and segment.segment_index <= self.snapshot_index:
+            return
+        self.history.append({"role": "assistant", "content": output_text})
+        self.history_tokens += estimate_tokens(output_text)
+        if not replayed:
+            self.history, self.history_tokens = await self.service._maybe_compress_history(
+                self.history, self.history_tokens, self.stage, segment.segment_index
+            )
+
+    def close(self):
+        self.service._discard_speculative_compressions(self.stage)
+
+
+class NeighborContext(ContextStrategy):
+    """前后各 SEGMENT_CONTEXT_NEIGHBORS 个相邻段落的阶段输入，不依赖前面段落的输出"""
+
+    name = "neighbors"
+
+    async def context(self, segments: List[OptimizationSegment], position: int) -> List[Dict[str, str]]:
+        return neighbor_context(segments, position, self.stage)
+
+
+STRATEGIES = {
+    strategy.name: strategy
+    for strategy in (SummaryContext, WindowContext, NeighborContext, NoContext)
+}
+
+
+def neighbor_context(segments: List[OptimizationSegment], position: int, stage: str) -> List[Dict[str, str]]:
+    """前后各 SEGMENT_CONTEXT_NEIGHBORS 个相邻段落的阶段输入"""
+    radius = settings.SEGMENT_CONTEXT_NEIGHBORS
+    if radius <= 0:
+        return []
+
+    def neighbor_text(segment: OptimizationSegment) -> str:
+        if stage == "enhance":
+            return segment.polished_text or segment.original_text
+        return segment.original_text
+
+    # 标题和非正文段落不参与上下文，与串行模式的历史保持一致
+    before = [neighbor_text(s) for s in segments[max(position - radius, 0):position] if not (s.is_title or s.passthrough)]
+    after = [neighbor_text(s) for s in segments[position + 1:position + 1 + radius] if not (s.is_title or s.passthrough)]
+    if not before and not after:
+        return []
+
+    parts = ["相邻段落（仅供理解上下文，不要润色或输出这些内容）："]
+    if before:
+        parts.append("【前文】\n" + "\n".join(before))
+    if after:
+        parts.append("【后文】\n" + "\n".join(after))
+    return [{"role": "system", "content": "\n".join(parts)}]
+
+
+def strategy_name(processing_mode: str) -> str:
+    """处理模式使用的上下文策略：CONTEXT_STRATEGY_OVERRIDES 优先，其余使用 CONTEXT_STRATEGY"""
+    overrides = parse_json_object(
+        "CONTEXT_STRATEGY_OVERRIDES", settings.CONTEXT_STRATEGY_OVERRIDES,
+        on_error=lambda message: log_pipeline.warning(f"[CONTEXT] {message}")
+    )
+    name = overrides.get(processing_mode) or settings.CONTEXT_STRATEGY
+    name = str(name).strip().lower()
+    if name not in STRATEGIES:
+        log_pipeline.warning(f"[CONTEXT] Unknown context strategy '{name}', falling back to summary")
+        return SummaryContext.name
+    return name
+
+
+def create_strategy(service: "OptimizationService", stage: str) -> ContextStrategy:
+    """按会话的处理模式创建阶段的上下文策略"""
+    processing_mode = service.session_obj.processing_mode or "paper_polish_enhance"
+    return STRATEGIES[strategy_name(processing_mode)](service, stage)
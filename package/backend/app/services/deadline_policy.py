@@ -0,0 +1,131 @@
+from typing import Any, Dict, Optional
+
+from app.config import settings
+from app.services.metrics import metrics
+
+# 每个模型至少积累多少个样本后才使用观测值
+_MIN_SAMPLES = 3
+
+# 输出过短时吞吐量噪声太大，不计入样本
+_MIN_SAMPLE_TOKENS = 16
+
+
+class ModelThroughput:
+    """单个模型的吞吐观测：EWMA 生成速度（token/s）、首 token 延迟、整次调用耗时（秒）与推理 token 数"""
+
+    def __init__(self):
+        self.tokens_per_second: Optional[float] = None
+        self.ttft: Optional[float] = None
+        self.latency: Optional[float] = None
+        self.reasoning_tokens = 0.0
+        self.samples = 0
+        self.ttft_samples = 0
+        self.latency_samples = 0
+
+    def record(
+        self,
+        completion_tokens: int,
+        total_seconds: float,
+        ttft_seconds: Optional[float],
+        reasoning_tokens: int = 0
+    ):
+        alpha = settings.LLM_ENDPOINT_EWMA_ALPHA
+        if total_seconds > 0:
+            # 非流式调用没有首 token 时间，整次耗时（含推理）是唯一的延迟样本
+            self.latency = total_seconds if self.latency is None else (1 - alpha) * self.latency + alpha * total_seconds
+            self.reasoning_tokens = (
+                reasoning_tokens if self.latency_samples == 0
+                else (1 - alpha) * self.reasoning_tokens + alpha * reasoning_tokens
+            )
+            self.latency_samples += 1
+        if ttft_seconds is not None and ttft_seconds > 0:
+            self.ttft = ttft_seconds if self.ttft is None else (1 - alpha) * self.ttft + alpha * ttft_seconds
+            self.ttft_samples += 1
+        generation_seconds = total_seconds - (ttft_seconds or 0.0)
+        if completion_tokens < _MIN_SAMPLE_TOKENS or generation_seconds <= 0:
+            return
+        tps = completion_tokens / generation_seconds
+        self.tokens_per_second = tps if self.tokens_per_second is None else (
+            (1 - alpha) * self.tokens_per_second + alpha * tps
+        )
+        self.samples += 1
+
+
+class DeadlinePolicy:
+    """按模型观测吞吐计算每次调用的截止时间
+
+    - 总截止时间 = 安全系数 ×（首 token 延迟 +（预计输出 token + 观测到的推理 token）/ 生成速度），
+      且不低于安全系数 × 观测到的整次调用耗时，限制在 [LLM_DEADLINE_MIN, LLM_DEADLINE_MAX] 之间
+    - 样本不足时下限提高到 LLM_REQUEST_TIMEOUT，避免冷启动的推理模型被过早中断
+    - 流式调用另设首 token 截止时间：不低于 LLM_FIRST_TOKEN_TIMEOUT，
+      观测到的首 token 延迟较长（推理模型）时按安全系数放宽
+    - 样本不足时生成速度按 LLM_DEADLINE_DEFAULT_TPS 估计
+    - LLM_DEADLINE_ADAPTIVE=false 时退回固定的 LLM_REQUEST_TIMEOUT
+    """
+
+    def __init__(self):
+        self._models: Dict[str, ModelThroughput] = {}
+
+    def stats(self, model: str) -> ModelThroughput:
+        stats = self._models.get(model)
+        if stats is None:
+            stats = ModelThroughput()
+            self._models[model] = stats
+        return stats
+
+    def request_timeout(self, model: str, output_tokens: int) -> float:
+        """整次调用的截止时间（秒）"""
+        if not settings.LLM_DEADLINE_ADAPTIVE:
+            return settings.LLM_REQUEST_TIMEOUT
+        stats = self.stats(model)
+        tps = stats.tokens_per_second if stats.samples >= _MIN_SAMPLES else None
+        ttft = stats.ttft if stats.ttft_samples >= _MIN_SAMPLES else None
+        warm = stats.latency_samples >= _MIN_SAMPLES
+        output_tokens = max(output_tokens, 0) + (stats.reasoning_tokens if warm else 0.0)
+        expected = (ttft or 0.0) + output_tokens / max(tps or settings.LLM_DEADLINE_DEFAULT_TPS, 0.1)
+        if warm:
+            expected = max(expected, stats.latency)
+        timeout = settings.LLM_DEADLINE_SAFETY * expected
+        floor = settings.LLM_DEADLINE_MIN if warm else max(settings.LLM_DEADLINE_MIN, settings.LLM_REQUEST_TIMEOUT)
+        return min(max(timeout, floor), settings.LLM_DEADLINE_MAX)
+
+    def first_token_timeout(self, model: str) -> float:
+        """流式调用等待首个 token 的截止时间（秒）"""
+        if not settings.LLM_DEADLINE_ADAPTIVE:
+            return settings.LLM_REQUEST_TIMEOUT
+        stats = self.stats(model)
+        timeout = settings.LLM_FIRST_TOKEN_TIMEOUT
+        if stats.ttft_samples >= _MIN_SAMPLES and stats.ttft is not None:
+            timeout = max(timeout, settings.LLM_DEADLINE_SAFETY * stats.ttft)
+        return min(timeout, settings.LLM_DEADLINE_MAX)
+
+    def record(
+        self,
+        model: str,
+        completion_tokens: int,
+        total_seconds: float,
+        ttft_seconds: Optional[float] = None,
+        reasoning_tokens: int = 0
+    ):
+        """记录一次成功调用；流式调用的生成时间不含首 token 延迟，非流式调用只有整次耗时"""
+        self.stats(model).record(completion_tokens, total_seconds, ttft_seconds, reasoning_tokens)
+
+    def record_timeout(self, first_token: bool):
+        metrics.incr("deadline", "first_token_timeouts" if first_token else "request_timeouts")
+
+    def snapshot(self) -> Dict[str, Any]:
+        models = {
+            model: {
+                "tokens_per_second": round(stats.tokens_per_second, 1) if stats.tokens_per_second else None,
+                "ttft_ms": round(stats.ttft * 1000, 1) if stats.ttft else None,
+                "latency_ms": round(stats.latency * 1000, 1) if stats.latency else None,
+                "reasoning_tokens": round(stats.reasoning_tokens, 1),
+                "samples": stats.samples,
+            }
+            for model, stats in self._models.items()
+        }
+        return {"adaptive": settings.LLM_DEADLINE_ADAPTIVE, "models": models, **metrics.snapshot("deadline")}
+
+
+# 全局截止时间策略实例
+deadline_policy = DeadlinePolicy()
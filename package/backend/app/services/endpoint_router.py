@@ -0,0 +1,177 @@
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+import openai
+
+from app.config import settings
+from app.services.log_pipeline import log_pipeline
+from app.services.metrics import metrics
+from app.services.retry_policy import RETRYABLE_CATEGORIES, classify_error
+
+# p95 统计使用的最近样本数
+_LATENCY_WINDOW = 200
+
+# 尚无延迟样本时的默认估计（秒）
+_DEFAULT_LATENCY = 1.0
+
+# 错误率对评分的放大系数：错误率 50% 时评分约为延迟的 3 倍
+_ERROR_PENALTY = 4.0
+
+# 端点配置错误（密钥无效、路径错误）导致的状态码，同样计入端点故障
+_AUTH_STATUS_CODES = {401, 403, 404}
+
+
+def parse_endpoints(base_urls: Optional[str], api_keys: Optional[str]) -> List[Tuple[str, str]]:
+    """解析逗号分隔的端点与密钥列表
+
+    密钥只有一个时所有端点共用；否则数量必须与端点一致，按顺序配对。
+    """
+    urls = [url.strip().rstrip("/") for url in (base_urls or "").split(",") if url.strip()]
+    keys = [key.strip() for key in (api_keys or "").split(",") if key.strip()]
+    if not urls:
+        raise ValueError("未配置 Base URL")
+    if len(keys) <= 1:
+        key = keys[0] if keys else ""
+        return [(url, key) for url in urls]
+    if len(keys) != len(urls):
+        raise ValueError(f"API Key 数量 ({len(keys)}) 与 Base URL 数量 ({len(urls)}) 不一致")
+    return list(zip(urls, keys))
+
+
+def is_endpoint_fault(exc: BaseException) -> bool:
+    """异常是否应计入端点故障（超时、5xx、限流、连接错误以及鉴权失败）"""
+    if classify_error(exc) in RETRYABLE_CATEGORIES:
+        return True
+    current: Optional[BaseException] = exc
+    while current is not None:
+        if isinstance(current, openai.APIStatusError):
+            return current.status_code in _AUTH_STATUS_CODES
+        current = current.__cause__
+    return False
+
+
+class EndpointStats:
+    """单个端点的健康统计：EWMA 延迟、EWMA 错误率与熔断状态"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.ewma_latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.samples: Deque[float] = deque(maxlen=_LATENCY_WINDOW)
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.successes = 0
+        self.failures = 0
+
+    @property
+    def ejected(self) -> bool:
+        return time.monotonic() < self.ejected_until
+
+    def score(self, default_latency: float) -> float:
+        """评分越低越好"""
+        latency = self.ewma_latency if self.ewma_latency is not None else default_latency
+        return max(latency, 0.001) * (1 + _ERROR_PENALTY * self.error_rate)
+
+    def p95(self) -> Optional[float]:
+        if len(self.samples) < max(settings.LLM_HEDGE_MIN_SAMPLES, 1):
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]
+
+    def record_success(self, latency: float):
+        alpha = settings.LLM_ENDPOINT_EWMA_ALPHA
+        self.ewma_latency = latency if self.ewma_latency is None else (1 - alpha) * self.ewma_latency + alpha * latency
+        self.error_rate *= 1 - alpha
+        self.samples.append(latency)
+        self.successes += 1
+        if self.ejections:
+            log_pipeline.info(f"[ENDPOINT] 端点恢复: {self.url}")
+        self.consecutive_failures = 0
+        self.ejections = 0
+
+    def record_failure(self):
+        alpha = settings.LLM_ENDPOINT_EWMA_ALPHA
+        self.error_rate = (1 - alpha) * self.error_rate + alpha
+        self.failures += 1
+        self.consecutive_failures += 1
+        threshold = settings.LLM_ENDPOINT_EJECT_FAILURES
+        if threshold > 0 and self.consecutive_failures >= threshold and not self.ejected:
+            # 连续被摘除时隔离时间翻倍，到期后重新参与选择（半开探测）
+            duration = min(
+                settings.LLM_ENDPOINT_EJECT_SECONDS * (2 ** self.ejections),
+                settings.LLM_ENDPOINT_EJECT_MAX_SECONDS
+            )
+            self.ejections += 1
+            self.ejected_until = time.monotonic() + duration
+            self.consecutive_failures = 0
+            metrics.incr("endpoint", "ejections")
+            log_pipeline.warning(f"[ENDPOINT] 端点已摘除 {duration:.0f}s: {self.url}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        p95 = self.p95()
+        return {
+            "ewma_latency_ms": round(self.ewma_latency * 1000, 1) if self.ewma_latency is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "error_rate": round(self.error_rate, 4),
+            "successes": self.successes,
+            "failures": self.failures,
+            "ejected": self.ejected,
+            "ejected_for_s": round(max(self.ejected_until - time.monotonic(), 0.0), 1),
+        }
+
+
+class EndpointRouter:
+    """按端点健康度在同一阶段的多个上游之间路由
+
+    - 权重与评分（EWMA 延迟 ×（1 + 错误率惩罚））成反比，随机加权选择
+    - 连续失败达到阈值的端点被摘除，到期后自动重新接纳
+    - 全部端点都被摘除时，选择最早到期的一个，避免完全不可用
+    """
+
+    def __init__(self):
+        self._stats: Dict[str, EndpointStats] = {}
+
+    def stats(self, url: str) -> EndpointStats:
+        stats = self._stats.get(url)
+        if stats is None:
+            stats = EndpointStats(url)
+            self._stats[url] = stats
+        return stats
+
+    def choose(
+        self,
+        endpoints: List[Tuple[str, str]],
+        exclude: Iterable[str] = ()
+    ) -> Tuple[str, str]:
+        """选择一个端点 (base_url, api_key)"""
+        if len(endpoints) == 1:
+            return endpoints[0]
+
+        excluded = set(exclude)
+        candidates = [ep for ep in endpoints if ep[0] not in excluded] or list(endpoints)
+        healthy = [ep for ep in candidates if not self.stats(ep[0]).ejected]
+        if not healthy:
+            return min(candidates, key=lambda ep: self.stats(ep[0]).ejected_until)
+
+        # 未有样本的端点按已知最快延迟估计，保证新端点能获得流量
+        known = [self.stats(ep[0]).ewma_latency for ep in healthy if self.stats(ep[0]).ewma_latency is not None]
+        default_latency = min(known) if known else _DEFAULT_LATENCY
+        weights = [1.0 / self.stats(ep[0]).score(default_latency) for ep in healthy]
+        return random.choices(healthy, weights=weights, k=1)[0]
+
+    def record_success(self, url: str, latency: float):
+        self.stats(url).record_success(latency)
+
+    def record_failure(self, url: str, exc: BaseException):
+        if is_endpoint_fault(exc):
+            self.stats(url).record_failure()
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {url: stats.snapshot() for url, stats in self._stats.items()}
+
+
+# 全局端点路由实例
+endpoint_router = EndpointRouter()
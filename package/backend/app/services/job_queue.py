@@ -0,0 +1,309 @@
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models.models import OptimizationSegment, OptimizationSession, QueueStatus
+from app.services.concurrency import concurrency_manager
+from app.services.log_pipeline import log_pipeline
+from app.services.metrics import metrics
+
+
+class JobQueue:
+    """持久化的优化任务队列与本进程的工作池
+
+    排队记录保存在 queue_status 表中，与会话状态在同一事务提交，进程重启不会丢失。
+    工作池领取任务时写入租约，运行期间定期续期（心跳）；进程崩溃后租约过期，
+    任务会被其他进程或重启后的本进程重新领取，已完成的段落不会重复处理。
+
+    每个任务使用独立的数据库会话运行，与发起请求的会话无关。
+    数据库读写放到线程池执行，每次操作使用独立的数据库会话。
+    """
+
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._runner: Optional[Callable[[int], Awaitable[None]]] = None
+        self._running: Dict[str, asyncio.Task] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers: Tuple[asyncio.Task, ...] = ()
+        self._stopping = False
+
+    # 以下静态方法在路由中调用，由调用方提交事务
+
+    @staticmethod
+    def enqueue(db: Session, session: OptimizationSession):
+        """将会话加入队列（新建或重新排队）"""
+        job = db.query(QueueStatus).filter(QueueStatus.session_id == session.session_id).first()
+        if not job:
+            job = QueueStatus(session_id=session.session_id, user_id=session.user_id, attempts=0)
+            db.add(job)
+        job.status = "queued"
+        job.created_at = datetime.utcnow()
+        job.started_at = None
+        job.lease_owner = None
+        job.lease_expires_at = None
+
+    @staticmethod
+    def remove(db: Session, session_id: str):
+        """移除会话的排队记录（停止或删除会话时）"""
+        db.query(QueueStatus).filter(QueueStatus.session_id == session_id).delete(synchronize_session=False)
+
+    @staticmethod
+    def queue_status(db: Session, session_id: Optional[str] = None) -> Tuple[int, Optional[int]]:
+        """返回 (排队任务数, 指定会话的排队位置)"""
+        queued = db.query(QueueStatus).filter(QueueStatus.status == "queued")
+        queue_length = queued.count()
+        position = None
+        if session_id:
+            job = queued.filter(QueueStatus.session_id == session_id).first()
+            if job:
+                position = queued.filter(or_(
+                    QueueStatus.created_at < job.created_at,
+                    and_(QueueStatus.created_at == job.created_at, QueueStatus.id < job.id)
+                )).count() + 1
+        return queue_length, position
+
+    def notify(self):
+        """唤醒工作池立即领取任务，可在任意线程调用"""
+        if self._loop and self._wakeup:
+            try:
+                self._loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+    async def start(self, runner: Callable[[int], Awaitable[None]]):
+        """启动工作池；runner 接收会话主键并完成整个优化流程"""
+        if self._workers:
+            return
+        self._runner = runner
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        recovered = await asyncio.to_thread(self._recover_sync)
+        if recovered:
+            log_pipeline.info(f"[JOB QUEUE] Re-queued {recovered} sessions without queue records")
+        self._workers = (
+            asyncio.create_task(self._dispatch_loop()),
+            asyncio.create_task(self._heartbeat_loop()),
+        )
+        log_pipeline.info(f"[JOB QUEUE] Worker pool started, owner={self.owner}")
+
+    async def stop(self):
+        """停止工作池：取消运行中的任务并释放租约，重启后立即续跑"""
+        if not self._workers:
+            return
+        self._stopping = True
+        for worker in self._workers:
+            worker.cancel()
+        running = list(self._running.values())
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*self._workers, *running, return_exceptions=True)
+        self._workers = ()
+        released = await asyncio.to_thread(self._release_sync)
+        if released:
+            log_pipeline.info(f"[JOB QUEUE] Released {released} leases on shutdown")
+
+    def running_count(self) -> int:
+        return len(self._running)
+
+    async def _dispatch_loop(self):
+        while True:
+            self._wakeup.clear()
+            # 并发上限沿用 MAX_CONCURRENT_USERS（管理后台修改后立即生效）
+            while len(self._running) < concurrency_manager.max_concurrent:
+                try:
+                    claimed = await asyncio.to_thread(self._claim_sync)
+                except Exception as e:
+                    log_pipeline.error(f"[JOB QUEUE] Claim failed: {str(e)}")
+                    claimed = None
+                if not claimed:
+                    break
+                session_key, session_pk, recovered = claimed
+                metrics.incr("job_queue", "recovered" if recovered else "claimed")
+                self._running[session_key] = asyncio.create_task(self._run_job(session_key, session_pk))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.JOB_POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run_job(self, session_key: str, session_pk: int):
+        try:
+            await self._runner(session_pk)
+        except asyncio.CancelledError:
+            if self._stopping:
+                # 进程退出：保留排队记录，由 stop() 释放租约
+                return
+        except Exception as e:
+            # 失败状态已由优化流程写入会话
+            log_pipeline.error(f"[JOB QUEUE] Session {session_key} failed: {str(e)}")
+        finally:
+            self._running.pop(session_key, None)
+            self._wakeup.set()
+            if not self._stopping:
+                try:
+                    await asyncio.to_thread(self._finish_sync, session_key)
+                except Exception as e:
+                    log_pipeline.error(f"[JOB QUEUE] Finish {session_key} failed: {str(e)}")
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(settings.JOB_HEARTBEAT_SECONDS)
+            if not self._running:
+                continue
+            keys = list(self._running)
+            try:
+                owned = await asyncio.to_thread(self._heartbeat_sync, keys)
+            except Exception as e:
+                log_pipeline.warning(f"[JOB QUEUE] Heartbeat failed: {str(e)}")
+                continue
+            for session_key in keys:
+                task = self._running.get(session_key)
+                if task and session_key not in owned:
+                    # 租约已被接管或排队记录已被移除：停止本地执行，避免同一会话被两处同时处理
+                    metrics.incr("job_queue", "lease_lost")
+                    log_pipeline.warning(f"[JOB QUEUE] Lease lost for session {session_key}, cancelling")
+                    task.cancel()
+
+    # 以下同步方法在线程池中执行，计数结果返回给事件循环线程再写入 metrics
+
+    def _lease_expiry(self, now: datetime) -> datetime:
+        return now + timedelta(seconds=settings.JOB_LEASE_SECONDS)
+
+    def _claim_sync(self) -> Optional[Tuple[str, int, bool]]:
+        """领取一个排队中或租约已过期的任务，返回 (会话标识, 会话主键, 是否为中断后恢复)"""
+        db = SessionLocal()
+        try:
+            while True:
+                now = datetime.utcnow()
+                claimable = or_(
+                    QueueStatus.status == "queued",
+                    and_(QueueStatus.status == "processing", QueueStatus.lease_expires_at < now)
+                )
+                job = db.query(QueueStatus).filter(claimable).order_by(
+                    QueueStatus.created_at, QueueStatus.id
+                ).first()
+                if not job:
+                    return None
+
+                # 条件更新：多个进程同时领取时只有一个成功
+                claimed = db.query(QueueStatus).filter(QueueStatus.id == job.id, claimable).update({
+                    "status": "processing",
+                    "lease_owner": self.owner,
+                    "lease_expires_at": self._lease_expiry(now),
+                    "heartbeat_at": now,
+                    "started_at": now,
+                    "attempts": QueueStatus.attempts + 1,
+                }, synchronize_session=False)
+                if not claimed:
+                    db.rollback()
+                    continue
+
+                session = db.query(OptimizationSession).filter(
+                    OptimizationSession.session_id == job.session_id
+                ).first()
+                if not session or session.status not in ["queued", "processing"]:
+                    # 会话已删除或已结束，丢弃过期的排队记录
+                    db.query(QueueStatus).filter(QueueStatus.id == job.id).delete(synchronize_session=False)
+                    db.commit()
+                    continue
+
+                recovered = job.status == "processing" or session.status == "processing"
+                if recovered:
+                    # 上次运行被中断：处理中的段落恢复为待处理，已完成的段落续跑时直接跳过
+                    db.query(OptimizationSegment).filter(
+                        OptimizationSegment.session_id == session.id,
+                        OptimizationSegment.status == "processing"
+                    ).update({"status": "pending"}, synchronize_session=False)
+                db.commit()
+
+                log_pipeline.info(
+                    f"[JOB QUEUE] {'Recovered' if recovered else 'Claimed'} session {job.session_id}, "
+                    f"owner={self.owner}"
+                )
+                return job.session_id, session.id, recovered
+        finally:
+            db.close()
+
+    def _heartbeat_sync(self, session_keys) -> Set[str]:
+        """续期本进程持有的租约，返回仍由本进程持有的会话"""
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            owned = db.query(QueueStatus).filter(
+                QueueStatus.session_id.in_(session_keys),
+                QueueStatus.lease_owner == self.owner,
+                QueueStatus.status == "processing"
+            )
+            owned.update(
+                {"lease_expires_at": self._lease_expiry(now), "heartbeat_at": now},
+                synchronize_session=False
+            )
+            db.commit()
+            return {session_id for (session_id,) in owned.with_entities(QueueStatus.session_id).all()}
+        finally:
+            db.close()
+
+    def _finish_sync(self, session_key: str):
+        """任务结束（完成、失败或停止）后移除排队记录；租约已被接管时保留"""
+        db = SessionLocal()
+        try:
+            db.query(QueueStatus).filter(
+                QueueStatus.session_id == session_key,
+                QueueStatus.lease_owner == self.owner
+            ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _release_sync(self) -> int:
+        """释放本进程持有的所有租约，任务重新排队"""
+        db = SessionLocal()
+        try:
+            released = db.query(QueueStatus).filter(QueueStatus.lease_owner == self.owner).update({
+                "status": "queued",
+                "lease_owner": None,
+                "lease_expires_at": None,
+            }, synchronize_session=False)
+            db.commit()
+            return released
+        finally:
+            db.close()
+
+    def _recover_sync(self) -> int:
+        """为没有排队记录的排队中/处理中会话补建记录（如升级前由后台任务运行的会话）"""
+        db = SessionLocal()
+        try:
+            queued_keys = {session_id for (session_id,) in db.query(QueueStatus.session_id).all()}
+            orphans = db.query(OptimizationSession).filter(
+                OptimizationSession.status.in_(["queued", "processing"])
+            ).order_by(OptimizationSession.created_at).all()
+            recovered = 0
+            for session in orphans:
+                if session.session_id in queued_keys:
+                    continue
+                db.add(QueueStatus(
+                    session_id=session.session_id,
+                    user_id=session.user_id,
+                    status="queued",
+                    created_at=session.created_at or datetime.utcnow(),
+                    attempts=0
+                ))
+                recovered += 1
+            db.commit()
+            return recovered
+        finally:
+            db.close()
+
+
+# 全局任务队列实例
+job_queue = JobQueue()
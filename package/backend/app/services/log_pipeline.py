@@ -0,0 +1,182 @@
+import queue
+import random
+import re
+import sys
+import threading
+import time
+from typing import Optional, TextIO, Tuple
+from app.config import settings
+
+# 日志级别
+LOG_LEVELS = {
+    "DEBUG": 10,
+    "INFO": 20,
+    "WARNING": 30,
+    "ERROR": 40,
+    "OFF": 100,
+}
+
+# 常见密钥格式：OpenAI 风格的 sk- 密钥以及 Bearer 令牌
+_SECRET_PATTERN = re.compile(r"(sk-[A-Za-z0-9_\-]{8,}|Bearer\s+[A-Za-z0-9_\-\.=]{8,})")
+
+# 写线程每批最多合并的日志条数
+_BATCH_SIZE = 256
+
+_STOP = object()
+
+
+class LogPipeline:
+    """非阻塞日志管道
+
+    事件循环上只做级别判断、采样和入队；格式化、脱敏和写 stdout
+    都放在后台线程中完成，避免同步 I/O 阻塞所有会话和 SSE 连接。
+    队列满时直接丢弃并计数，绝不阻塞调用方。
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None, max_queue_size: Optional[int] = None):
+        self._stream = stream
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue_size or settings.LOG_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.dropped = 0
+        self.written = 0
+
+    def start(self):
+        """启动后台写线程（重复调用无副作用）"""
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="log-pipeline", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 2.0):
+        """写出剩余日志并停止后台线程"""
+        thread = self._thread
+        if not thread or not thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        thread.join(timeout)
+        self._thread = None
+
+    def is_enabled(self, level: str) -> bool:
+        """当前配置下该级别是否需要输出（每次读取 settings，支持运行时切换）"""
+        threshold = LOG_LEVELS.get(str(settings.LOG_LEVEL).upper(), LOG_LEVELS["INFO"])
+        return LOG_LEVELS.get(level, LOG_LEVELS["INFO"]) >= threshold
+
+    def log(self, level: str, message: str):
+        """记录一条日志"""
+        if not self.is_enabled(level):
+            return
+        self._enqueue((time.time(), level, message))
+
+    def debug(self, message: str):
+        self.log("DEBUG", message)
+
+    def info(self, message: str):
+        self.log("INFO", message)
+
+    def warning(self, message: str):
+        self.log("WARNING", message)
+
+    def error(self, message: str):
+        self.log("ERROR", message)
+
+    def log_body(self, level: str, label: str, body: str):
+        """记录请求/响应正文 - 按采样率抽样并截断"""
+        if not self.is_enabled(level) or not self._sampled():
+            return
+        self._enqueue((time.time(), level, f"{label}: {self.truncate(body or '')}"))
+
+    def truncate(self, text: str) -> str:
+        """按 LOG_MAX_BODY_CHARS 截断长文本"""
+        limit = settings.LOG_MAX_BODY_CHARS
+        if limit <= 0 or len(text) <= limit:
+            return text
+        return f"{text[:limit]}...(已截断，共 {len(text)} 字符)"
+
+    def _sampled(self) -> bool:
+        rate = settings.LOG_BODY_SAMPLE_RATE
+        if rate >= 1:
+            return True
+        return rate > 0 and random.random() < rate
+
+    def _enqueue(self, record: Tuple[float, str, str]):
+        if not self._thread or not self._thread.is_alive():
+            self.start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        """后台写线程：批量取出、格式化、脱敏并写出"""
+        while True:
+            record = self._queue.get()
+            batch = [record]
+            while len(batch) < _BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = []
+            stop = False
+            for item in batch:
+                if item is _STOP:
+                    stop = True
+                    continue
+                lines.append(self._format(item))
+
+            if lines:
+                stream = self._stream or sys.stdout
+                try:
+                    stream.write("".join(lines))
+                    stream.flush()
+                    self.written += len(lines)
+                except Exception:
+                    # 输出流不可用时丢弃，不影响业务
+                    self.dropped += len(lines)
+
+            if stop:
+                return
+
+    def _format(self, record: Tuple[float, str, str]) -> str:
+        created, level, message = record
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(created))
+        return f"{timestamp} [{level}] {redact_secrets(message)}\n"
+
+
+def redact_secrets(text: str) -> str:
+    """脱敏 API 密钥（已配置的密钥与常见密钥格式）"""
+    for key in _configured_api_keys():
+        if key in text:
+            text = text.replace(key, _mask(key))
+    return _SECRET_PATTERN.sub(lambda m: _mask(m.group(0)), text)
+
+
+def _configured_api_keys():
+    keys = (
+        settings.OPENAI_API_KEY,
+        settings.POLISH_API_KEY,
+        settings.ENHANCE_API_KEY,
+        settings.EMOTION_API_KEY,
+        settings.COMPRESSION_API_KEY,
+    )
+    # 支持逗号分隔的多个密钥；过短的值（如占位符）不做替换，避免误伤正文
+    return {
+        key.strip()
+        for value in keys if value
+        for key in value.split(",")
+        if len(key.strip()) >= 8
+    }
+
+
+def _mask(secret: str) -> str:
+    return secret[:4] + "****"
+
+
+# 全局日志管道实例
+log_pipeline = LogPipeline()
@@ -0,0 +1,36 @@
+from collections import defaultdict
+from typing import Dict
+
+
+class MetricsRegistry:
+    """进程内指标计数器
+
+    按分组记录计数值，供管理后台统计接口导出。
+    所有调用都在事件循环线程内完成，无需加锁。
+    """
+
+    def __init__(self):
+        self._groups: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+
+    def incr(self, group: str, name: str, value: float = 1):
+        """累加计数"""
+        self._groups[group][name] += value
+
+    def get(self, group: str, name: str) -> float:
+        """读取单个计数"""
+        return self._groups.get(group, {}).get(name, 0)
+
+    def snapshot(self, group: str) -> Dict[str, float]:
+        """导出某一分组的全部计数"""
+        return {
+            name: round(value, 3) if isinstance(value, float) and not value.is_integer() else int(value)
+            for name, value in sorted(self._groups.get(group, {}).items())
+        }
+
+    def reset(self, group: str):
+        """清空某一分组"""
+        self._groups.pop(group, None)
+
+
+# 全局指标实例
+metrics = MetricsRegistry()
@@ -1,122 +1,133 @@
 import json
+import time
 import asyncio
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional, Set, Tuple
 from datetime import datetime
-from sqlalchemy.orm import Session
+from sqlalchemy import insert
+from app.database import SessionExecutor
 from app.models.models import (
     OptimizationSession, OptimizationSegment, 
-    SessionHistory, ChangeLog
+    SessionHistory, ChangeLog, LLMUsage
 )
 from app.services.ai_service import (
-    AIService, split_text_into_segments,
-    count_chinese_characters, count_text_length, get_default_polish_prompt,
+    AIService, CallUsage, split_text_into_segments,
+    count_text_length, estimate_tokens, get_default_polish_prompt,
     get_default_enhance_prompt, get_emotion_polish_prompt, get_compression_prompt
 )
+from app.services.cancellation import cancellation_registry
 from app.services.concurrency import concurrency_manager
+from app.services.context_strategy import ContextStrategy, create_strategy, neighbor_context
 from app.services.stream_manager import stream_manager
+from app.services.log_pipeline import log_pipeline
+from app.services.metrics import metrics
+from app.services.retry_policy import TRUNCATED, RetryBudget, classify_error, retry_policy
+from app.services.segment_classifier import classify_segments
 from app.config import settings
 
 # 错误信息最大长度，避免数据库字段溢出
 MAX_ERROR_MESSAGE_LENGTH = 500
 
+# 压缩后历史（滚动摘要）system 消息的前缀
+HISTORY_SUMMARY_PREFIX = "之前处理的段落摘要：\n"
+
 
 class OptimizationService:
     """优化处理服务"""
     
-    def __init__(self, db: Session, session_obj: OptimizationSession):
-        self.db = db
+    def __init__(self, db_executor: SessionExecutor, session_obj: OptimizationSession):
+        # 数据库操作都通过 db_executor 在专用线程中执行，避免阻塞事件循环
+        self.db_executor = db_executor
+        self.db = db_executor.session
         self.session_obj = session_obj
         self.polish_service: Optional[AIService] = None
         self.enhance_service: Optional[AIService] = None
         self.emotion_service: Optional[AIService] = None
         self.compression_service: Optional[AIService] = None
+        # 流水线模式下各阶段独立的上下文策略
+        self._pipeline_contexts: Dict[str, ContextStrategy] = {}
+        # 延迟写入缓冲：进度、段落状态、结果和变更记录合并到一个事务，每次 AI 调用前写入
+        self._write_buffer: List[Callable[[], None]] = []
+        self._buffer_started: Optional[float] = None
+        # 已存在变更记录的 (段落序号, 阶段)，写入变更记录时无需先查询
+        self._change_log_keys: Set[Tuple[int, str]] = set()
+        # 各阶段已完成段落的结果：阶段 -> {去除空白差异后的输入: 输出}，用于重复段落直接复制
+        self._stage_outputs: Dict[str, Dict[str, str]] = {}
+        # 各阶段进行中的后台预压缩：阶段 -> (任务, 快照包含的历史条数, 快照覆盖到的段落序号)
+        self._speculative_compressions: Dict[str, Tuple[asyncio.Task, int, int]] = {}
+        # 会话级重试预算，所有阶段和压缩调用共享
+        self.retry_budget = RetryBudget()
     
     def _init_ai_services(self):
         """初始化AI服务"""
+        # 旧会话该字段为空时默认启用缓存
+        use_cache = self.session_obj.use_cache is not False
         # 润色服务
         self.polish_service = AIService(
             model=self.session_obj.polish_model or settings.POLISH_MODEL,
             api_key=self.session_obj.polish_api_key or settings.POLISH_API_KEY,
-            base_url=self.session_obj.polish_base_url or settings.POLISH_BASE_URL
+            base_url=self.session_obj.polish_base_url or settings.POLISH_BASE_URL,
+            session_id=self.session_obj.session_id,
+            use_cache=use_cache
         )
         
         # 增强服务
         self.enhance_service = AIService(
             model=self.session_obj.enhance_model or settings.ENHANCE_MODEL,
             api_key=self.session_obj.enhance_api_key or settings.ENHANCE_API_KEY,
-            base_url=self.session_obj.enhance_base_url or settings.ENHANCE_BASE_URL
+            base_url=self.session_obj.enhance_base_url or settings.ENHANCE_BASE_URL,
+            session_id=self.session_obj.session_id,
+            use_cache=use_cache
         )
         
         # 感情文章润色服务
         self.emotion_service = AIService(
             model=self.session_obj.emotion_model or settings.POLISH_MODEL,
             api_key=self.session_obj.emotion_api_key or settings.POLISH_API_KEY,
-            base_url=self.session_obj.emotion_base_url or settings.POLISH_BASE_URL
+            base_url=self.session_obj.emotion_base_url or settings.POLISH_BASE_URL,
+            session_id=self.session_obj.session_id,
+            use_cache=use_cache
         )
         
         # 压缩服务
         self.compression_service = AIService(
             model=settings.COMPRESSION_MODEL,
             api_key=settings.COMPRESSION_API_KEY or settings.OPENAI_API_KEY,
-            base_url=settings.COMPRESSION_BASE_URL or settings.OPENAI_BASE_URL
+            base_url=settings.COMPRESSION_BASE_URL or settings.OPENAI_BASE_URL,
+            session_id=self.session_obj.session_id,
+            use_cache=use_cache
         )
     
     async def start_optimization(self):
         """开始优化流程"""
+        # 提交前取出会话标识：排队期间访问已过期的 ORM 属性会开启新事务，长时间占用数据库连接
+        session_key = self.session_obj.session_id
         try:
             # 初始化AI服务
             self._init_ai_services()
 
             # 重置错误状态
-            self.session_obj.error_message = None
-            self.session_obj.failed_segment_index = None
-            self.db.commit()
+            await self._update(self.session_obj, error_message=None, failed_segment_index=None)
             
             # 获取并发权限
-            acquired = await concurrency_manager.acquire(self.session_obj.session_id)
+            acquired = await concurrency_manager.acquire(session_key)
             if not acquired:
-                self.session_obj.status = "queued"
-                self.db.commit()
+                await self._update(self.session_obj, status="queued")
                 
                 # 等待获取权限 - acquire 方法内部已包含等待逻辑
-                acquired = await concurrency_manager.acquire(self.session_obj.session_id)
+                acquired = await concurrency_manager.acquire(session_key)
                 if not acquired:
                     raise Exception("等待并发权限超时")
             
             # 更新状态为处理中
-            self.session_obj.status = "processing"
-            self.db.commit()
+            await self._update(self.session_obj, status="processing")
             
+            # 排队期间可能已被停止（此时任务尚未登记取消）
+            await self._check_stopped()
+
             # 检查是否已存在段落,避免重复创建
-            # 在每次循环前检查会话状态，如果被停止则中断执行
-            self.db.refresh(self.session_obj)
-            if self.session_obj.status == "stopped":
-                raise Exception("会话已被用户停止")
-
-            existing_segments = self.db.query(OptimizationSegment).filter(
-                OptimizationSegment.session_id == self.session_obj.id
-            ).order_by(OptimizationSegment.segment_index).all()
-
-            if not existing_segments:
-                # 首次运行: 分割文本并创建段落记录
-                segments = split_text_into_segments(self.session_obj.original_text)
-                self.session_obj.total_segments = len(segments)
-                self.db.commit()
-
-                for idx, segment_text in enumerate(segments):
-                    segment = OptimizationSegment(
-                        session_id=self.session_obj.id,
-                        segment_index=idx,
-                        stage="polish",
-                        original_text=segment_text,
-                        status="pending"
-                    )
-                    self.db.add(segment)
-                self.db.commit()
-            else:
-                # 继续运行: 同步总段落数
-                self.session_obj.total_segments = len(existing_segments)
-                self.db.commit()
+            passthrough_counts = await self._db(self._prepare_segments)
+            for category, count in passthrough_counts.items():
+                metrics.incr("segment_passthrough", category, count)
             
             # 根据处理模式执行不同的阶段
             processing_mode = self.session_obj.processing_mode or 'paper_polish_enhance'
@@ -129,238 +140,899 @@ class OptimizationService:
                 await self._process_stage("emotion_polish")
             elif processing_mode == 'paper_polish_enhance':
                 # 论文润色 + 论文增强
-                await self._process_stage("polish")
-                await self._process_stage("enhance")
+                if settings.STAGE_PIPELINING and not self.session_obj.parallel_segments:
+                    await self._process_pipeline()
+                else:
+                    await self._process_stage("polish")
+                    await self._process_stage("enhance")
             else:
                 raise ValueError(f"不支持的处理模式: {processing_mode}")
             
             # 完成
-            self.session_obj.status = "completed"
-            self.session_obj.completed_at = datetime.utcnow()
-            self.session_obj.progress = 100.0
-            self.session_obj.failed_segment_index = None
-            self.db.commit()
+            await self._defer_update(
+                self.session_obj,
+                status="completed",
+                completed_at=datetime.utcnow(),
+                progress=100.0,
+                failed_segment_index=None
+            )
+            await self._flush()
             
+        except asyncio.CancelledError:
+            if cancellation_registry.is_deleted(session_key):
+                # 会话已被删除：丢弃缓冲的写入
+                log_pipeline.info(f"[SESSION DELETED] Session: {session_key}")
+                self._write_buffer.clear()
+                raise
+            # 会话被停止：状态已由停止接口写入，这里只恢复被中断的段落并记录续跑位置
+            log_pipeline.info(f"[SESSION STOPPED] Session: {session_key}, position: {self.session_obj.current_position}")
+            self._write_buffer.append(self._mark_stopped)
+            await self._flush()
+            raise
         except Exception as e:
-            self.session_obj.status = "failed"
-            self.session_obj.error_message = str(e)
-            self.db.commit()
+            if cancellation_registry.is_deleted(session_key):
+                # 删除与进行中的写入并发时写入会失败，不再记录失败状态
+                self._write_buffer.clear()
+                raise
+            await self._defer_update(self.session_obj, status="failed", error_message=str(e))
+            await self._flush()
             raise
         finally:
+            self._discard_speculative_compressions()
             # 释放并发权限
-            await concurrency_manager.release(self.session_obj.session_id)
+            await concurrency_manager.release(session_key)
+
+    def _prepare_segments(self) -> Dict[str, int]:
+        """首次运行时分割文本并创建段落记录，继续运行时同步总段落数（在数据库线程中执行）
+
+        返回本次识别出的非正文段落数（按类别），由调用方在事件循环中计入指标。
+        """
+        passthrough_counts: Dict[str, int] = {}
+        existing_count = self.db.query(OptimizationSegment).filter(
+            OptimizationSegment.session_id == self.session_obj.id
+        ).count()
+
+        if not existing_count:
+            # 首次运行: 分割文本并批量插入段落记录，与总段落数在同一事务提交
+            segments = split_text_into_segments(self.session_obj.original_text)
+            self.session_obj.total_segments = len(segments)
+            # 进入阶段循环前一次性识别非正文段落，处理时原样保留
+            if settings.SEGMENT_PASSTHROUGH:
+                categories = classify_segments(segments)
+            else:
+                categories = [None] * len(segments)
+            for category in categories:
+                if category:
+                    passthrough_counts[category] = passthrough_counts.get(category, 0) + 1
+            if passthrough_counts:
+                self.session_obj.passthrough_stats = json.dumps(passthrough_counts)
+                log_pipeline.info(f"[SEGMENT] Passthrough segments: {passthrough_counts}")
+            if segments:
+                self.db.execute(insert(OptimizationSegment), [
+                    {
+                        "session_id": self.session_obj.id,
+                        "segment_index": idx,
+                        "stage": "polish",
+                        "original_text": segment_text,
+                        "status": "pending",
+                        "passthrough": category,
+                    }
+                    for idx, (segment_text, category) in enumerate(zip(segments, categories))
+                ])
+        else:
+            # 继续运行: 同步总段落数，并记下已有的变更记录
+            self.session_obj.total_segments = existing_count
+            self._change_log_keys = set(self.db.query(ChangeLog.segment_index, ChangeLog.stage).filter(
+                ChangeLog.session_id == self.session_obj.id
+            ).distinct().all())
+        self.db.commit()
+        return passthrough_counts
+
+    async def _db(self, fn, *args):
+        """在数据库线程中执行同步操作"""
+        return await self.db_executor.run(fn, *args)
+
+    async def _update(self, instance, **fields):
+        """在数据库线程中修改 ORM 对象的属性并立即提交"""
+        def apply():
+            for name, value in fields.items():
+                setattr(instance, name, value)
+            self.db.commit()
+        await self._db(apply)
+
+    async def _defer(self, operation: Callable[[], None]):
+        """加入延迟写入缓冲（操作在数据库线程中执行，不自行提交）
+
+        缓冲在下一次 AI 调用前统一提交，保证已完成的结果先落库；
+        长时间没有 AI 调用（如续跑时跳过大量已完成段落）时，超过 WRITE_BEHIND_MAX_DELAY_MS 也会提交。
+        """
+        if not self._write_buffer:
+            self._buffer_started = time.monotonic()
+        self._write_buffer.append(operation)
+        if (time.monotonic() - self._buffer_started) * 1000 >= settings.WRITE_BEHIND_MAX_DELAY_MS:
+            await self._flush()
+
+    async def _defer_update(self, instance, **fields):
+        """延迟修改 ORM 对象的属性"""
+        def apply():
+            for name, value in fields.items():
+                setattr(instance, name, value)
+        await self._defer(apply)
+
+    async def _flush(self):
+        """在一个事务中执行缓冲的所有写入"""
+        if not self._write_buffer:
+            return
+        operations, self._write_buffer = self._write_buffer, []
+        self._buffer_started = None
+
+        def apply():
+            for operation in operations:
+                operation()
+            self.db.commit()
+        await self._db(apply)
+
+    async def _check_stopped(self):
+        """从数据库刷新会话状态，会话已被用户停止时中断执行
+
+        只在开始处理前检查一次；处理过程中的停止由 cancellation_registry 直接取消任务
+        """
+        await self.db_executor.refresh(self.session_obj)
+        if self.session_obj.status == "stopped":
+            raise Exception("会话已被用户停止")
+
+    def _mark_stopped(self):
+        """被中断的段落恢复为待处理，续跑从当前位置开始（在数据库线程中执行，随缓冲一起提交）"""
+        self.db.flush()
+        self.db.query(OptimizationSegment).filter(
+            OptimizationSegment.session_id == self.session_obj.id,
+            OptimizationSegment.status == "processing"
+        ).update({"status": "pending"}, synchronize_session=False)
+        self.session_obj.failed_segment_index = self.session_obj.current_position
     
     async def _process_stage(self, stage: str):
         """处理单个阶段"""
-        print(f"\n[STAGE START] Stage: {stage}, Session: {self.session_obj.session_id}", flush=True)
+        log_pipeline.info(f"[STAGE START] Stage: {stage}, Session: {self.session_obj.session_id}")
         
-        self.session_obj.current_stage = stage
-        self.db.commit()
+        await self._defer_update(self.session_obj, current_stage=stage)
         
         # 获取该阶段的提示词
         prompt = self._get_prompt(stage)
         
         # 获取AI服务
-        if stage == "emotion_polish":
-            ai_service = self.emotion_service
-        elif stage == "polish":
-            ai_service = self.polish_service
-        else:  # enhance
-            ai_service = self.enhance_service
+        ai_service = self._stage_service(stage)
         
         # 获取所有段落
-        segments = self.db.query(OptimizationSegment).filter(
-            OptimizationSegment.session_id == self.session_obj.id
-        ).order_by(OptimizationSegment.segment_index).all()
-        
-        # 如果存在失败段落，跳过已完成的段落
-        start_index = 0
-        if self.session_obj.failed_segment_index is not None:
-            start_index = max(self.session_obj.failed_segment_index, 0)
-        
-        # 历史会话 - 只包含AI的回复内容
-        # 只加载 start_index 之前的段落到历史，避免重试时历史与当前处理位置不一致
-        history: List[Dict[str, str]] = []
-        total_chars = 0
-
-        for segment in segments[:start_index]:
-            if segment.is_title:
-                # 标题段落不参与历史上下文
-                continue
-            if stage == "polish" and segment.polished_text:
-                history.append({"role": "assistant", "content": segment.polished_text})
-                total_chars += count_chinese_characters(segment.polished_text)
-            elif stage == "emotion_polish" and segment.polished_text:
-                history.append({"role": "assistant", "content": segment.polished_text})
-                total_chars += count_chinese_characters(segment.polished_text)
-            elif stage == "enhance" and segment.enhanced_text:
-                history.append({"role": "assistant", "content": segment.enhanced_text})
-                total_chars += count_chinese_characters(segment.enhanced_text)
+        segments = await self._db(self._load_segments)
+
+        if self.session_obj.parallel_segments and settings.SEGMENT_PARALLELISM > 1:
+            await self._process_stage_parallel(stage, segments, prompt, ai_service)
+            return
         
-        print(f"[STAGE] Loaded {len(history)} history messages from segments[:start_index={start_index}]", flush=True)
+        # 段落上下文按处理模式选择的策略构建
+        context = create_strategy(self, stage)
+        log_pipeline.info(f"[STAGE] Context strategy: {context.name}")
+        await context.start()
         
-        skip_threshold = max(settings.SEGMENT_SKIP_THRESHOLD, 0)
-
-        # 获取处理模式，用于正确计算进度
-        processing_mode = self.session_obj.processing_mode or 'paper_polish_enhance'
-
-        for idx, segment in enumerate(segments[start_index:], start=start_index):
-            # 每次处理段落前检查会话状态
-            self.db.refresh(self.session_obj)
-            if self.session_obj.status == "stopped":
-                raise Exception("会话已被用户停止")
-
+        for idx, segment in enumerate(segments):
             # 更新进度（无论是否跳过都更新）
-            self.session_obj.current_position = idx
-            # 根据处理模式正确计算进度
-            if processing_mode == 'paper_polish_enhance':
-                if stage == "polish":
-                    # 第一阶段占 0-50%
-                    progress = (idx / len(segments)) * 50
-                else:  # enhance
-                    # 第二阶段占 50-100%
-                    progress = 50 + (idx / len(segments)) * 50
-            else:
-                # 其他模式占 0-100%
-                progress = (idx / len(segments)) * 100
-            self.session_obj.progress = min(progress, 100.0)
-            self.db.commit()
+            await self._defer_update(
+                self.session_obj,
+                current_position=idx,
+                progress=self._stage_progress(stage, idx, len(segments))
+            )
 
-            # 先判断标题和短段落（提前到这里）
-            if count_text_length(segment.original_text) < skip_threshold:
-                if not segment.is_title:
-                    segment.is_title = True
-                    segment.status = "completed"
-                    segment.polished_text = segment.original_text
-                    segment.enhanced_text = segment.original_text
-                    segment.completed_at = datetime.utcnow()
-                    segment.stage = stage
-                    self.db.commit()
+            # 标题、短段落和已处理的段落无需调用 AI
+            if await self._settle_segment(segment, stage):
+                await self._replay_context(context, segment, stage)
                 continue
 
-            # 然后检查是否已处理
-            if stage in ["polish", "emotion_polish"] and segment.polished_text:
-                continue
-            if stage == "enhance":
-                if segment.enhanced_text:
-                    continue
-                if segment.is_title and not segment.enhanced_text:
-                    segment.enhanced_text = segment.polished_text or segment.original_text
-                    segment.status = "completed"
-                    segment.completed_at = segment.completed_at or datetime.utcnow()
-                    self.db.commit()
-                    continue
-
             try:
 
-                print(f"\n[SEGMENT {idx}] Processing segment {idx+1}/{len(segments)}, Stage: {stage}", flush=True)
-                print(f"[SEGMENT {idx}] Input Length: {count_text_length(segment.original_text)}", flush=True)
+                log_pipeline.info(
+                    f"[SEGMENT {idx}] Processing segment {idx+1}/{len(segments)}, Stage: {stage}, "
+                    f"Input Length: {count_text_length(segment.original_text)}"
+                )
                 
-                segment.status = "processing"
-                segment.stage = stage
-                self.db.commit()
+                await self._defer_update(segment, status="processing", stage=stage)
                 
                 # 准备输入文本
-                input_text = segment.polished_text if stage == "enhance" else segment.original_text
+                input_text = self._stage_input(segment, stage)
                 
                 # 调用AI
-                async def execute_call():
-                    # 使用配置中的流式设置，默认非流式（False）以避免API阻止
-                    use_stream = settings.USE_STREAMING
-                    
-                    if stage == "polish":
-                        response = await ai_service.polish_text(input_text, prompt, history, stream=use_stream)
-                    elif stage == "emotion_polish":
-                        response = await ai_service.polish_emotion_text(input_text, prompt, history, stream=use_stream)
-                    else:  # enhance
-                        response = await ai_service.enhance_text(input_text, prompt, history, stream=use_stream)
-                    
-                    if use_stream:
-                        full_text = ""
-                        async for chunk in response:
-                            if chunk:
-                                full_text += chunk
-                                # 推送流式更新
-                                await stream_manager.broadcast(self.session_obj.session_id, {
-                                    "type": "content",
-                                    "segment_index": idx,
-                                    "stage": stage,
-                                    "content": chunk,
-                                    "full_text": full_text  # 可选:发送全量或增量，这里发送增量chunk，全量用于恢复
-                                })
-                        return full_text
-                    else:
-                        return response
-
-                output_text = await self._run_with_retry(idx, stage, execute_call)
-
-                if stage in ["polish", "emotion_polish"]:
-                    segment.polished_text = output_text
-                else:  # enhance
-                    segment.enhanced_text = output_text
-
-                segment.status = "completed"
-                segment.completed_at = datetime.utcnow()
-                self.db.commit()
-                
-                # 记录变更
-                await self._record_change(segment, input_text, output_text, stage)
-                
-                # 更新历史会话 - 只添加AI的回复内容
-                history.append({"role": "assistant", "content": output_text})
-                total_chars += count_chinese_characters(output_text)
+                messages = await context.context(segments, idx)
+                output_text, call_usage = await self._call_segment(ai_service, stage, idx, input_text, prompt, messages)
+                await self._write_segment_result(segment, stage, input_text, output_text, call_usage)
                 
-                # 检查是否需要压缩历史 - 基于字符数阈值
-                if total_chars > settings.HISTORY_COMPRESSION_THRESHOLD:
-                    print(f"\n[HISTORY COMPRESS] Triggering compression, Stage: {stage}", flush=True)
-                    print(f"[HISTORY COMPRESS] Before: {total_chars} chars, {len(history)} messages", flush=True)
-                    
-                    compressed_history = await self._compress_history(history, stage)
-                    # 压缩后的历史替换原历史，用于后续处理
-                    history = compressed_history
-                    # 重新计算字符数
-                    total_chars = sum(count_chinese_characters(msg.get("content", "")) for msg in history)
-                    
-                    print(f"[HISTORY COMPRESS] After: {total_chars} chars, {len(history)} messages", flush=True)
-                    
-                    # 推送压缩通知给前端
-                    await stream_manager.broadcast(self.session_obj.session_id, {
-                        "type": "history_compressed",
-                        "stage": stage,
-                        "message": f"历史会话已压缩（{stage} 阶段），节省上下文空间",
-                        "new_char_count": total_chars
-                    })
-                    
-                    # 只在压缩后保存历史，减少数据库写入
-                    await self._save_history(history, stage, total_chars)
+                # 更新上下文 - 只记录AI的回复内容
+                await context.record(segment, output_text)
                 
             except Exception as e:
                 import traceback
                 error_trace = traceback.format_exc()
-                print(f"[ERROR] Segment {idx} processing failed:", flush=True)
-                print(error_trace, flush=True)
+                log_pipeline.error(f"[ERROR] Segment {idx} processing failed:\n{error_trace}")
                 
-                segment.status = "failed"
-                self.session_obj.failed_segment_index = idx
-                # 保存错误信息（限制长度避免数据库字段溢出）
-                error_msg = str(e)
-                if len(error_msg) > MAX_ERROR_MESSAGE_LENGTH:
-                    error_msg = error_msg[:MAX_ERROR_MESSAGE_LENGTH] + "..."
-                self.session_obj.error_message = error_msg
-                self.db.commit()
+                await self._mark_segment_failed(segment, idx, e)
                 
                 # 直接抛出原异常，保留堆栈
                 raise
 
+        context.close()
+        await self._flush()
+
+    async def _process_pipeline(self):
+        """论文润色 + 增强的流水线执行
+
+        段落 i 润色完成后立即开始增强，不必等待整个润色阶段结束。
+        两个阶段各自维护历史上下文（与逐阶段执行时相同），进度按两个阶段合计完成的段落数计算。
+        任一阶段失败后，另一阶段完成进行中的段落即停止，不再开始新段落；
+        续跑时两个阶段都从各自第一个未完成的段落继续。
+        """
+        log_pipeline.info(f"[STAGE START] Stage: polish+enhance (pipelined), Session: {self.session_obj.session_id}")
+
+        await self._defer_update(self.session_obj, current_stage="polish")
+
+        segments = await self._db(self._load_segments)
+        total = len(segments)
+        completed = {"polish": 0, "enhance": 0}
+        # 润色完成（或无需处理）的段落位置，按顺序交给增强阶段；None 表示润色阶段已结束
+        polished: asyncio.Queue = asyncio.Queue()
+        halted = asyncio.Event()
+        failures: List[Tuple[OptimizationSegment, BaseException]] = []
+
+        async def advance(stage: str):
+            completed[stage] += 1
+            # 当前位置取落后的增强阶段，失败后续跑从这里开始不会遗漏
+            await self._defer_update(
+                self.session_obj,
+                current_position=completed["enhance"],
+                current_stage="polish" if completed["polish"] < total else "enhance",
+                progress=min((completed["polish"] + completed["enhance"]) / (2 * total) * 100, 100.0)
+            )
+
+        async def polish_worker():
+            try:
+                for segment in segments:
+                    if not await self._pipeline_step("polish", segment, segments, halted, failures):
+                        return
+                    await advance("polish")
+                    polished.put_nowait(segment)
+            finally:
+                polished.put_nowait(None)
+
+        async def enhance_worker():
+            while True:
+                segment = await polished.get()
+                if segment is None:
+                    return
+                if not await self._pipeline_step("enhance", segment, segments, halted, failures):
+                    return
+                await advance("enhance")
+
+        # 两个阶段各自维护上下文，策略与逐阶段执行时相同
+        for stage in ("polish", "enhance"):
+            self._pipeline_contexts[stage] = create_strategy(self, stage)
+            await self._pipeline_contexts[stage].start()
+        log_pipeline.info(f"[STAGE] Context strategy: {self._pipeline_contexts['polish'].name}")
+        outcomes = await asyncio.gather(polish_worker(), enhance_worker(), return_exceptions=True)
+        for context in self._pipeline_contexts.values():
+            context.close()
+        await self._flush()
+
+        if failures:
+            segment, error = failures[0]
+            await self._mark_segment_failed(segment, completed["enhance"], error)
+            raise error
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                raise outcome
+
+    async def _pipeline_step(
+        self,
+        stage: str,
+        segment: OptimizationSegment,
+        segments: List[OptimizationSegment],
+        halted: asyncio.Event,
+        failures: List[Tuple[OptimizationSegment, BaseException]]
+    ) -> bool:
+        """流水线中单个阶段处理一个段落，返回 False 表示该阶段应停止"""
+        if halted.is_set():
+            return False
+
+        context = self._pipeline_contexts[stage]
+        idx = segment.segment_index
+        if await self._settle_segment(segment, stage):
+            # 续跑时已完成的段落同样计入该阶段的上下文
+            await self._replay_context(context, segment, stage)
+            return True
+
+        try:
+            log_pipeline.info(
+                f"[SEGMENT {idx}] Processing segment {idx+1}/{len(segments)}, Stage: {stage} (pipelined), "
+                f"Input Length: {count_text_length(segment.original_text)}"
+            )
+            await self._defer_update(segment, status="processing", stage=stage)
+
+            input_text = self._stage_input(segment, stage)
+            messages = await context.context(segments, idx)
+            output_text, call_usage = await self._call_segment(
+                self._stage_service(stage), stage, idx, input_text, self._get_prompt(stage), messages
+            )
+            await self._write_segment_result(segment, stage, input_text, output_text, call_usage)
+            if stage == "polish":
+                # 润色结果交给增强阶段读取前必须先写入
+                await self._flush()
+
+            await context.record(segment, output_text)
+            return True
+        except Exception as e:
+            import traceback
+            log_pipeline.error(f"[ERROR] Segment {idx} processing failed in {stage} (pipelined):\n{traceback.format_exc()}")
+            await self._defer_update(segment, status="failed")
+            failures.append((segment, e))
+            halted.set()
+            return False
+
+    async def _process_stage_parallel(
+        self,
+        stage: str,
+        segments: List[OptimizationSegment],
+        prompt: str,
+        ai_service: AIService
+    ):
+        """并行处理单个阶段（会话级开关 parallel_segments）
+
+        每个段落的上下文取自处理前就已确定的相邻段落，不依赖前一段的输出，
+        因此同一会话内最多 SEGMENT_PARALLELISM 个段落同时调用 AI。
+        结果按段落顺序写入；失败时已完成的段落同样保存，续跑时按段落状态跳过。
+        """
+        # 先处理标题、短段落和已完成的段落，剩余的才需要调用 AI
+        pending = [segment for segment in segments if not await self._settle_segment(segment, stage)]
+        # 内容相同的段落只调用一次，其余在首个段落完成后复制结果
+        duplicates = self._split_duplicates(pending, stage)
+        order = [segment.segment_index for segment in pending]
+        by_index = {segment.segment_index: segment for segment in pending}
+        log_pipeline.info(
+            f"[STAGE PARALLEL] Stage: {stage}, pending {len(pending)}/{len(segments)} segments, "
+            f"fan-out {settings.SEGMENT_PARALLELISM}"
+        )
+        if not pending:
+            return
+
+        semaphore = asyncio.Semaphore(settings.SEGMENT_PARALLELISM)
+        positions = {segment.segment_index: position for position, segment in enumerate(segments)}
+        started = set()
+
+        async def run(segment: OptimizationSegment):
+            async with semaphore:
+                idx = segment.segment_index
+                started.add(idx)
+                log_pipeline.info(
+                    f"[SEGMENT {idx}] Processing segment {idx+1}/{len(segments)} in parallel, Stage: {stage}, "
+                    f"Input Length: {count_text_length(segment.original_text)}"
+                )
+                await self._defer_update(segment, status="processing", stage=stage)
+                input_text = self._stage_input(segment, stage)
+                context = neighbor_context(segments, positions[idx], stage)
+                output_text, call_usage = await self._call_segment(ai_service, stage, idx, input_text, prompt, context)
+                return input_text, output_text, call_usage
+
+        tasks = {asyncio.create_task(run(segment)): segment for segment in pending}
+        results: Dict[int, Tuple[str, str, CallUsage]] = {}
+        failures: Dict[int, BaseException] = {}
+        next_position = 0
+        running = set(tasks)
+
+        def collect(done):
+            for task in done:
+                if task.cancelled():
+                    continue
+                idx = tasks[task].segment_index
+                if task.exception() is not None:
+                    failures[idx] = task.exception()
+                else:
+                    results[idx] = task.result()
+
+        try:
+            while running and not failures:
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                collect(done)
+
+                # 只写入从头开始连续完成的段落，保证写入顺序与段落顺序一致
+                while next_position < len(order) and order[next_position] in results:
+                    idx = order[next_position]
+                    await self._write_segment_result(by_index[idx], stage, *results.pop(idx))
+                    next_position += 1
+                    position = order[next_position] if next_position < len(order) else len(segments)
+                    await self._defer_update(
+                        self.session_obj,
+                        current_position=position,
+                        progress=self._stage_progress(stage, position, len(segments))
+                    )
+
+            if running:
+                # 出现失败：尚未开始的段落直接取消，已发出的调用等待完成以保存结果
+                for task in running:
+                    if tasks[task].segment_index not in started:
+                        task.cancel()
+                done, running = await asyncio.wait(running)
+                collect(done)
+        finally:
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+
+        if not failures:
+            await self._settle_duplicates(duplicates, stage)
+            await self._flush()
+            return
+
+        # 其余已完成的段落照常保存，续跑时无需重复调用
+        for idx in order[next_position:]:
+            if idx in results:
+                await self._write_segment_result(by_index[idx], stage, *results.pop(idx))
+        await self._settle_duplicates(duplicates, stage)
+        first_failed = min(failures)
+
+        def reset_cancelled():
+            for segment in pending:
+                if segment.status == "processing":
+                    # 被取消的段落恢复为待处理
+                    segment.status = "pending"
+        await self._defer(reset_cancelled)
+        await self._flush()
+        # 续跑位置取第一个未完成的段落，串行模式续跑时也不会遗漏
+        first_unfinished = next(idx for idx in order if by_index[idx].status != "completed")
+        error = failures[first_failed]
+        log_pipeline.error(f"[ERROR] Segment {first_failed} processing failed in parallel: {str(error)}")
+        await self._mark_segment_failed(by_index[first_failed], first_unfinished, error)
+        raise error
+
+    def _split_duplicates(self, pending: List[OptimizationSegment], stage: str) -> List[OptimizationSegment]:
+        """从待处理段落中移出与前面段落内容相同的段落（原地修改 pending），返回移出的段落"""
+        if not settings.SEGMENT_DEDUP:
+            return []
+        seen: Set[str] = set()
+        unique, duplicates = [], []
+        for segment in pending:
+            key = self._dedup_key(self._stage_input(segment, stage) or "")
+            if key and key in seen:
+                duplicates.append(segment)
+            else:
+                seen.add(key)
+                unique.append(segment)
+        pending[:] = unique
+        return duplicates
+
+    async def _settle_duplicates(self, duplicates: List[OptimizationSegment], stage: str):
+        """复制已完成段落的结果到重复段落；首个段落未完成时保持待处理，续跑时再处理"""
+        for segment in duplicates:
+            output_text = self._duplicate_output(segment, stage)
+            if output_text is not None:
+                await self._copy_duplicate_result(segment, stage, output_text)
+
+    def _load_segments(self) -> List[OptimizationSegment]:
+        """按顺序加载会话的所有段落（在数据库线程中执行）"""
+        return self.db.query(OptimizationSegment).filter(
+            OptimizationSegment.session_id == self.session_obj.id
+        ).order_by(OptimizationSegment.segment_index).all()
+
+    def _stage_service(self, stage: str) -> AIService:
+        if stage == "emotion_polish":
+            return self.emotion_service
+        if stage == "polish":
+            return self.polish_service
+        return self.enhance_service  # enhance
+
+    async def _maybe_compress_history(
+        self,
+        history: List[Dict[str, str]],
+        history_tokens: int,
+        stage: str,
+        idx: int
+    ) -> Tuple[List[Dict[str, str]], int]:
+        """按 token 阈值压缩历史（中英文统一计量），返回新的历史与 token 数
+
+        历史达到阈值的 HISTORY_COMPRESSION_SPECULATIVE_RATIO 时在后台开始压缩，与后续段落的调用并行，
+        完成后替换已压缩的部分；超过阈值时后台压缩尚未完成则等待它，没有后台压缩时同步压缩。
+        """
+        threshold = settings.HISTORY_COMPRESSION_THRESHOLD
+        speculative = self._speculative_compressions.get(stage)
+
+        if speculative is not None:
+            task, covered, covered_index = speculative
+            if not task.done() and history_tokens <= threshold:
+                return history, history_tokens
+            del self._speculative_compressions[stage]
+            wait_started = time.monotonic()
+            try:
+                compressed, duration = await task
+            except Exception as e:
+                # 后台压缩失败不影响主流程，超过阈值时改为同步压缩
+                metrics.incr("history_compression", "speculative_failed")
+                log_pipeline.warning(f"[HISTORY COMPRESS] Speculative compression failed, Stage: {stage}: {str(e)}")
+            else:
+                waited = time.monotonic() - wait_started
+                metrics.incr("history_compression", "speculative_used")
+                metrics.incr("history_compression", "waited_ms", waited * 1000)
+                # 压缩调用中与段落处理重叠、无需等待的时间
+                metrics.incr("history_compression", "saved_ms", max(duration - waited, 0) * 1000)
+                # 摘要替换快照部分，快照之后新增的输出原样保留
+                history = compressed + history[covered:]
+                history_tokens = sum(estimate_tokens(msg.get("content", "")) for msg in history)
+                log_pipeline.info(
+                    f"[HISTORY COMPRESS] Speculative summary applied, Stage: {stage}, "
+                    f"waited {waited * 1000:.0f}ms of {duration * 1000:.0f}ms, "
+                    f"After: {history_tokens} tokens, {len(history)} messages"
+                )
+                await self._announce_compression(compressed, stage, history_tokens, covered_index)
+
+        ratio = settings.HISTORY_COMPRESSION_SPECULATIVE_RATIO
+        if history_tokens <= threshold:
+            if 0 < ratio < 1 and history_tokens >= threshold * ratio and stage not in self._speculative_compressions:
+                self._start_speculative_compression(history, history_tokens, stage, idx)
+            return history, history_tokens
+
+        log_pipeline.info(
+            f"[HISTORY COMPRESS] Triggering compression, Stage: {stage}, "
+            f"Before: {history_tokens} tokens, {len(history)} messages"
+        )
+        metrics.incr("history_compression", "inline")
+
+        # 压缩后的历史替换原历史，用于后续处理
+        history = await self._compress_history(history, stage, segment_index=idx)
+        # 重新计算 token 数
+        history_tokens = sum(estimate_tokens(msg.get("content", "")) for msg in history)
+
+        log_pipeline.info(f"[HISTORY COMPRESS] After: {history_tokens} tokens, {len(history)} messages")
+
+        await self._announce_compression(history, stage, history_tokens, idx)
+        return history, history_tokens
+
+    def _start_speculative_compression(
+        self,
+        history: List[Dict[str, str]],
+        history_tokens: int,
+        stage: str,
+        idx: int
+    ):
+        """在后台压缩当前历史的快照"""
+        snapshot = list(history)
+
+        async def compress():
+            started = time.monotonic()
+            compressed = await self._compress_history(snapshot, stage, segment_index=idx)
+            return compressed, time.monotonic() - started
+
+        log_pipeline.info(
+            f"[HISTORY COMPRESS] Starting speculative compression, Stage: {stage}, "
+            f"Before: {history_tokens} tokens, {len(snapshot)} messages"
+        )
+        metrics.incr("history_compression", "speculative_started")
+        self._speculative_compressions[stage] = (asyncio.create_task(compress()), len(snapshot), idx)
+
+    def _discard_speculative_compressions(self, stage: Optional[str] = None):
+        """取消未使用的后台压缩（阶段结束或会话结束时）"""
+        stages = [stage] if stage else list(self._speculative_compressions)
+        for name in stages:
+            speculative = self._speculative_compressions.pop(name, None)
+            if speculative is None:
+                continue
+            task = speculative[0]
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                # 取出异常，避免未读取的异常被记录为警告
+                task.exception()
+            metrics.incr("history_compression", "speculative_discarded")
+
+    async def _announce_compression(
+        self,
+        compressed: List[Dict[str, str]],
+        stage: str,
+        history_tokens: int,
+        segment_index: int
+    ):
+        """推送压缩通知并保存压缩后的摘要，segment_index 为摘要覆盖到的段落序号"""
+        # 推送压缩通知给前端
+        await stream_manager.broadcast(self.session_obj.session_id, {
+            "type": "history_compressed",
+            "stage": stage,
+            "message": f"历史会话已压缩（{stage} 阶段），节省上下文空间",
+            "new_token_count": history_tokens
+        })
+
+        # 只在压缩后保存历史，减少数据库写入
+        compressed_tokens = sum(estimate_tokens(msg.get("content", "")) for msg in compressed)
+        await self._save_history(compressed, stage, compressed_tokens, segment_index)
+
+    def _load_history_snapshot(self, stage: str) -> Tuple[List[Dict[str, str]], int, int]:
+        """读取阶段最近一次压缩的历史快照，返回 (消息列表, token 数, 快照覆盖到的段落序号)
+
+        没有快照或快照未记录覆盖位置（旧数据）时返回空历史，覆盖位置为 -1。
+        """
+        snapshot = self.db.query(SessionHistory).filter(
+            SessionHistory.session_id == self.session_obj.id,
+            SessionHistory.stage == stage,
+            SessionHistory.is_compressed.is_(True),
+            SessionHistory.segment_index.isnot(None)
+        ).order_by(SessionHistory.created_at.desc()).first()
+        if not snapshot:
+            return [], 0, -1
+        try:
+            history = json.loads(snapshot.history_data)
+        except (TypeError, ValueError):
+            return [], 0, -1
+        history_tokens = sum(estimate_tokens(msg.get("content", "")) for msg in history)
+        return history, history_tokens, snapshot.segment_index
+
+    @staticmethod
+    async def _replay_context(context: ContextStrategy, segment: OptimizationSegment, stage: str):
+        """续跑时将已完成段落的输出补入上下文（标题和非正文段落不参与上下文）"""
+        output_text = segment.enhanced_text if stage == "enhance" else segment.polished_text
+        if output_text and not segment.is_title and not segment.passthrough:
+            await context.record(segment, output_text, replayed=True)
+
+    async def _settle_segment(self, segment: OptimizationSegment, stage: str) -> bool:
+        """处理无需调用 AI 的段落（标题、短段落、非正文、已完成），返回 True 表示跳过"""
+        # 先判断标题和短段落
+        skip_threshold = max(settings.SEGMENT_SKIP_THRESHOLD, 0)
+        if count_text_length(segment.original_text) < skip_threshold:
+            if not segment.is_title:
+                await self._defer_update(
+                    segment,
+                    is_title=True,
+                    status="completed",
+                    polished_text=segment.original_text,
+                    enhanced_text=segment.original_text,
+                    completed_at=datetime.utcnow(),
+                    stage=stage
+                )
+            return True
+
+        # 非正文段落（参考文献、代码、公式、表格、链接）原样保留
+        if segment.passthrough:
+            if segment.status != "completed":
+                await self._defer_update(
+                    segment,
+                    status="completed",
+                    polished_text=segment.original_text,
+                    enhanced_text=segment.original_text,
+                    completed_at=datetime.utcnow(),
+                    stage=stage
+                )
+            return True
+
+        # 然后检查是否已处理
+        if stage in ["polish", "emotion_polish"] and segment.polished_text:
+            self._remember_output(self._stage_input(segment, stage), stage, segment.polished_text)
+            return True
+        if stage == "enhance":
+            if segment.enhanced_text:
+                self._remember_output(self._stage_input(segment, stage), stage, segment.enhanced_text)
+                return True
+            if segment.is_title and not segment.enhanced_text:
+                await self._defer_update(
+                    segment,
+                    enhanced_text=segment.polished_text or segment.original_text,
+                    status="completed",
+                    completed_at=segment.completed_at or datetime.utcnow()
+                )
+                return True
+
+        # 内容相同（忽略空白差异）的段落已在本阶段处理过：直接复制结果
+        output_text = self._duplicate_output(segment, stage)
+        if output_text is not None:
+            await self._copy_duplicate_result(segment, stage, output_text)
+            return True
+        return False
+
+    @staticmethod
+    def _dedup_key(text: str) -> str:
+        """重复段落判定：连续空白（空格、换行、缩进）合并为一个空格，首尾空白忽略
+
+        只合并不删除，英文单词之间的分隔仍然保留（"a b" 与 "ab" 不是同一段）。
+        """
+        return " ".join(text.split())
+
+    def _remember_output(self, input_text: Optional[str], stage: str, output_text: str):
+        """记录阶段输入对应的输出，之后内容相同的段落直接复制"""
+        if settings.SEGMENT_DEDUP and input_text:
+            self._stage_outputs.setdefault(stage, {}).setdefault(self._dedup_key(input_text), output_text)
+
+    def _duplicate_output(self, segment: OptimizationSegment, stage: str) -> Optional[str]:
+        """返回本阶段已处理过的相同内容的输出，没有时返回 None"""
+        input_text = self._stage_input(segment, stage)
+        if not settings.SEGMENT_DEDUP or not input_text:
+            return None
+        return self._stage_outputs.get(stage, {}).get(self._dedup_key(input_text))
+
+    async def _copy_duplicate_result(self, segment: OptimizationSegment, stage: str, output_text: str):
+        """重复段落复制已有结果，不调用 AI，节省的调用次数累计到会话"""
+        input_text = self._stage_input(segment, stage)
+
+        def save():
+            if stage in ["polish", "emotion_polish"]:
+                segment.polished_text = output_text
+            else:  # enhance
+                segment.enhanced_text = output_text
+            segment.status = "completed"
+            segment.completed_at = datetime.utcnow()
+            segment.stage = stage
+            self.session_obj.deduplicated_calls = (self.session_obj.deduplicated_calls or 0) + 1
+        await self._defer(save)
+        await self._record_change(segment, input_text, output_text, stage)
+        metrics.incr("segment_dedup", "calls_saved")
+        log_pipeline.info(f"[SEGMENT {segment.segment_index}] Duplicate segment, copied result, Stage: {stage}")
+        # 立即写入：补入上下文（_replay_context）和增强阶段都从段落对象读取复制的结果
+        await self._flush()
+
+    def _stage_progress(self, stage: str, position: int, total: int) -> float:
+        """根据处理模式计算会话进度"""
+        processing_mode = self.session_obj.processing_mode or 'paper_polish_enhance'
+        if processing_mode == 'paper_polish_enhance':
+            if stage == "polish":
+                # 第一阶段占 0-50%
+                progress = (position / total) * 50
+            else:  # enhance
+                # 第二阶段占 50-100%
+                progress = 50 + (position / total) * 50
+        else:
+            # 其他模式占 0-100%
+            progress = (position / total) * 100
+        return min(progress, 100.0)
+
+    @staticmethod
+    def _stage_input(segment: OptimizationSegment, stage: str) -> str:
+        """阶段输入：增强阶段使用润色结果，其余使用原文"""
+        return segment.polished_text if stage == "enhance" else segment.original_text
+
+    async def _call_segment(
+        self,
+        ai_service: AIService,
+        stage: str,
+        idx: int,
+        input_text: str,
+        prompt: str,
+        history: List[Dict[str, str]]
+    ):
+        """调用 AI 处理一个段落（含重试），返回 (输出文本, CallUsage)"""
+        # 调用前先写入缓冲：之前完成的段落结果必须先落库
+        await self._flush()
+        # 输出被截断后，下一次尝试的输出上限翻倍
+        output_scale = 1
+
+        async def execute_call():
+            nonlocal output_scale
+            try:
+                return await attempt(output_scale)
+            except Exception as e:
+                if classify_error(e) == TRUNCATED:
+                    output_scale *= 2
+                raise
+
+        async def attempt(scale: int):
+            # 使用配置中的流式设置，默认非流式（False）以避免API阻止
+            use_stream = settings.USE_STREAMING
+            # 每次尝试单独统计，只记录最终成功的那次调用
+            call_usage = CallUsage()
+
+            if stage == "polish":
+                response = await ai_service.polish_text(
+                    input_text, prompt, history, stream=use_stream, call_usage=call_usage, output_scale=scale
+                )
+            elif stage == "emotion_polish":
+                response = await ai_service.polish_emotion_text(
+                    input_text, prompt, history, stream=use_stream, call_usage=call_usage, output_scale=scale
+                )
+            else:  # enhance
+                response = await ai_service.enhance_text(
+                    input_text, prompt, history, stream=use_stream, call_usage=call_usage, output_scale=scale
+                )
+
+            if use_stream:
+                # 只推送带序号的增量，定期附带校验快照，避免每个 chunk 重复发送全文
+                delta_stream = stream_manager.delta_stream(self.session_obj.session_id, idx, stage)
+                try:
+                    async for chunk in response:
+                        if chunk:
+                            await delta_stream.push(chunk)
+                finally:
+                    # 推送失败或任务被取消时立即关闭生成器，断开上游连接并归还限流名额
+                    await response.aclose()
+                return await delta_stream.finish(), call_usage
+            else:
+                return response, call_usage
+
+        return await self._run_with_retry(idx, stage, execute_call)
+
+    async def _write_segment_result(
+        self,
+        segment: OptimizationSegment,
+        stage: str,
+        input_text: str,
+        output_text: str,
+        call_usage: CallUsage
+    ):
+        """保存段落结果、用量记录和变更对照"""
+        def save():
+            if stage in ["polish", "emotion_polish"]:
+                segment.polished_text = output_text
+            else:  # enhance
+                segment.enhanced_text = output_text
+
+            segment.status = "completed"
+            segment.completed_at = datetime.utcnow()
+            # 用量记录、变更记录与段落结果在同一事务提交
+            self._add_usage(segment.segment_index, stage, call_usage)
+        await self._defer(save)
+        self._remember_output(input_text, stage, output_text)
+
+        # 记录变更
+        await self._record_change(segment, input_text, output_text, stage)
+
+    async def _mark_segment_failed(self, segment: OptimizationSegment, resume_index: int, error: BaseException):
+        """标记段落失败并记录续跑位置与错误信息"""
+        # 保存错误信息（限制长度避免数据库字段溢出）
+        error_msg = str(error)
+        if len(error_msg) > MAX_ERROR_MESSAGE_LENGTH:
+            error_msg = error_msg[:MAX_ERROR_MESSAGE_LENGTH] + "..."
+
+        def mark():
+            segment.status = "failed"
+            self.session_obj.failed_segment_index = resume_index
+            self.session_obj.error_message = error_msg
+        await self._defer(mark)
+        await self._flush()
+
     async def _run_with_retry(self, segment_index: int, stage: str, task):
-        """执行单次任务，不自动重试"""
+        """执行段落任务，按重试策略处理可恢复的错误"""
+        async def notify_retry(attempt: int, category: str, delay: float):
+            # 通知前端丢弃本段已推送的流式内容
+            await stream_manager.broadcast(self.session_obj.session_id, {
+                "type": "segment_retry",
+                "segment_index": segment_index,
+                "stage": stage,
+                "attempt": attempt,
+                "reason": category,
+                "delay": round(delay, 2)
+            })
+
         try:
-            return await task()
+            return await retry_policy.run(
+                task,
+                budget=self.retry_budget,
+                label=f"session={self.session_obj.session_id} segment={segment_index} stage={stage}",
+                on_retry=notify_retry
+            )
         except Exception as exc:
             raise Exception(
                 f"段落 {segment_index + 1} 在 {stage} 阶段失败: {str(exc)}"
             )
     
+    def _add_usage(self, segment_index: Optional[int], stage: str, call_usage: CallUsage):
+        """添加一条 LLM 用量记录（在数据库线程中调用，由调用方提交）"""
+        self.db.add(LLMUsage(
+            session_id=self.session_obj.id,
+            user_id=self.session_obj.user_id,
+            processing_mode=self.session_obj.processing_mode or 'paper_polish_enhance',
+            segment_index=segment_index,
+            stage=stage,
+            model=call_usage.model,
+            endpoint=call_usage.endpoint,
+            system_tokens=call_usage.system_tokens,
+            history_tokens=call_usage.history_tokens,
+            input_tokens=call_usage.input_tokens,
+            prompt_tokens=call_usage.prompt_tokens,
+            completion_tokens=call_usage.completion_tokens,
+            cached_tokens=call_usage.cached_tokens,
+            latency_ms=round(call_usage.latency_ms, 1),
+            ttft_ms=round(call_usage.ttft_ms, 1) if call_usage.ttft_ms is not None else None,
+            streamed=call_usage.streamed,
+            from_cache=call_usage.from_cache,
+            estimated=call_usage.estimated
+        ))
+    
     def _get_prompt(self, stage: str) -> str:
         """获取提示词"""
         if stage == "polish":
@@ -373,64 +1045,90 @@ class OptimizationService:
     async def _compress_history(
         self, 
         history: List[Dict[str, str]], 
-        stage: str
+        stage: str,
+        segment_index: Optional[int] = None
     ) -> List[Dict[str, str]]:
-        """压缩历史会话 - 智能提取关键信息
+        """压缩历史会话 - 增量滚动摘要
         
-        压缩历史会话以减少token使用，但保留处理风格的关键特征。
+        上一次的摘要与之后新增的全部输出合并为一份新摘要，长度不超过 HISTORY_SUMMARY_MAX_TOKENS，
+        摘要不会因为超出最近几条消息的窗口而丢失，压缩后的历史保持在上限以内，两次压缩之间可容纳的新内容稳定。
         压缩后的内容单独保存，不影响已完成的润色和增强文本。
         """
         # 如果历史已经是压缩格式（system消息），直接返回
         if len(history) == 1 and history[0].get("role") == "system":
             return history
         
-        # 保留最近的2-3条消息作为风格参考
-        recent_messages = history[-3:] if len(history) > 3 else history
+        # 拆分已有摘要与之后新增的输出
+        previous_summary = None
+        new_messages = history
+        if history and history[0].get("role") == "system" and history[0].get("content", "").startswith(HISTORY_SUMMARY_PREFIX):
+            previous_summary = history[0]["content"][len(HISTORY_SUMMARY_PREFIX):]
+            new_messages = history[1:]
+        
+        max_tokens = settings.HISTORY_SUMMARY_MAX_TOKENS if settings.HISTORY_SUMMARY_MAX_TOKENS > 0 else None
+        length_rule = f"- 摘要总长度不超过 {max_tokens} 字\n" if max_tokens else "- 压缩后内容不超过原内容的30%\n"
         
         # 选择合适的压缩提示词
         if stage == "emotion_polish":
-            compression_prompt = """你是一个专业的文本摘要助手。请压缩以下历史处理内容，提取关键风格特征：
+            compression_prompt = f"""你是一个专业的文本摘要助手。请压缩以下历史处理内容，提取关键风格特征：
 
 1. 总结文本的表达风格和语言特点
 2. 提取关键的修改方向和处理模式
 3. 保留重要的词汇使用倾向
 4. 删除重复的内容和冗余表述
+5. 如果提供了已有摘要，将新增内容合并进去，保留已有摘要中仍然有效的特征
 
 要求：
-- 压缩后内容不超过原内容的30%
-- 只输出压缩后的摘要，不要添加任何解释和注释
+{length_rule}- 只输出压缩后的摘要，不要添加任何解释和注释
 
 历史处理内容："""
         else:
-            compression_prompt = """你是一个专业的学术文本摘要助手。请压缩以下历史处理内容，提取关键信息：
+            compression_prompt = f"""你是一个专业的学术文本摘要助手。请压缩以下历史处理内容，提取关键信息：
 
 1. 保留论文的主要术语、核心概念和关键数据
 2. 总结已处理段落的主题和要点
 3. 提取处理风格和改进方向的关键特征
 4. 删除重复内容和冗余表述
+5. 如果提供了已有摘要，将新增内容合并进去，保留已有摘要中的术语和要点
 
 要求：
-- 压缩后内容不超过原内容的30%
-- 保持学术性和专业性
+{length_rule}- 保持学术性和专业性
 - 只输出压缩后的摘要文本，不要添加任何解释和注释
 
 
 历史处理内容："""
 
-        compressed_summary = await self.compression_service.compress_history(
-            recent_messages, 
-            compression_prompt
+        await self._flush()
+        call_usage = CallUsage()
+        compressed_summary = await retry_policy.run(
+            lambda: self.compression_service.compress_history(
+                new_messages,
+                compression_prompt,
+                call_usage=call_usage,
+                previous_summary=previous_summary,
+                max_tokens=max_tokens
+            ),
+            budget=self.retry_budget,
+            label=f"session={self.session_obj.session_id} compression stage={stage}"
         )
+        # 压缩调用的用量随后续历史保存一起提交
+        await self._defer(lambda: self._add_usage(segment_index, "compression", call_usage))
         
         # 返回压缩后的历史作为系统消息，用于后续段落的上下文参考
         return [
             {
                 "role": "system",
-                "content": f"之前处理的段落摘要：\n{compressed_summary}"
+                "content": f"{HISTORY_SUMMARY_PREFIX}{compressed_summary}"
             }
         ]
     
-    async def _save_history(self, history: List[Dict[str, str]], stage: str, char_count: int):
+    async def _save_history(
+        self,
+        history: List[Dict[str, str]],
+        stage: str,
+        token_count: int,
+        segment_index: Optional[int] = None
+    ):
         """保存历史会话 - 只在压缩后保存
         
         只有压缩后的历史才保存到数据库，以避免频繁写入导致数据库膨胀。
@@ -440,6 +1138,8 @@ class OptimizationService:
         1. 润色/增强后的文本已经保存在 segments 表中
         2. 压缩只在字符数超过阈值时触发
         3. 压缩后的历史用于后续段落的上下文参考
+        
+        segment_index 记录快照覆盖到的段落序号，续跑时只需补入之后段落的输出。
         """
         # 检测是否为压缩后的历史：压缩后只有一条 system 消息，包含之前处理的摘要
         # 这种检测方式与 _compress_history 的返回格式保持一致
@@ -448,30 +1148,32 @@ class OptimizationService:
         if not is_compressed:
             return  # 非压缩状态不保存，减少数据库写入
         
-        # 检查是否已存在该阶段的压缩记录
-        existing = self.db.query(SessionHistory).filter(
-            SessionHistory.session_id == self.session_obj.id,
-            SessionHistory.stage == stage,
-            SessionHistory.is_compressed.is_(True)
-        ).first()
-        
-        if existing:
-            # 更新现有记录
-            existing.history_data = json.dumps(history, ensure_ascii=False)
-            existing.character_count = char_count
-            existing.created_at = datetime.utcnow()
-        else:
-            # 创建新记录
-            history_obj = SessionHistory(
-                session_id=self.session_obj.id,
-                stage=stage,
-                history_data=json.dumps(history, ensure_ascii=False),
-                is_compressed=True,
-                character_count=char_count
-            )
-            self.db.add(history_obj)
+        def save():
+            # 检查是否已存在该阶段的压缩记录
+            existing = self.db.query(SessionHistory).filter(
+                SessionHistory.session_id == self.session_obj.id,
+                SessionHistory.stage == stage,
+                SessionHistory.is_compressed.is_(True)
+            ).first()
         
-        self.db.commit()
+            if existing:
+                # 更新现有记录
+                existing.history_data = json.dumps(history, ensure_ascii=False)
+                existing.character_count = token_count
+                existing.segment_index = segment_index
+                existing.created_at = datetime.utcnow()
+            else:
+                # 创建新记录
+                history_obj = SessionHistory(
+                    session_id=self.session_obj.id,
+                    stage=stage,
+                    history_data=json.dumps(history, ensure_ascii=False),
+                    is_compressed=True,
+                    character_count=token_count,
+                    segment_index=segment_index
+                )
+                self.db.add(history_obj)
+        await self._defer(save)
     
     async def _record_change(
         self,
@@ -488,27 +1190,32 @@ class OptimizationService:
             "changed": before != after
         }
         
-        existing_log = self.db.query(ChangeLog).filter(
-            ChangeLog.session_id == self.session_obj.id,
-            ChangeLog.segment_index == segment.segment_index,
-            ChangeLog.stage == stage
-        ).order_by(ChangeLog.created_at.desc()).first()
-
-        serialized_detail = json.dumps(changes, ensure_ascii=False)
-
-        if existing_log:
-            # 如果之前已经生成过同一段落同一阶段的记录，直接更新内容避免重复条目
-            existing_log.before_text = before
-            existing_log.after_text = after
-            existing_log.changes_detail = serialized_detail
-        else:
-            change_log = ChangeLog(
-                session_id=self.session_obj.id,
-                segment_index=segment.segment_index,
-                stage=stage,
-                before_text=before,
-                after_text=after,
-                changes_detail=serialized_detail
-            )
-            self.db.add(change_log)
-        self.db.commit()
+        key = (segment.segment_index, stage)
+        exists = key in self._change_log_keys
+        self._change_log_keys.add(key)
+
+        def save():
+            serialized_detail = json.dumps(changes, ensure_ascii=False)
+            # 本次运行之前没有该段落该阶段的记录时直接插入，不必先查询
+            existing_log = self.db.query(ChangeLog).filter(
+                ChangeLog.session_id == self.session_obj.id,
+                ChangeLog.segment_index == segment.segment_index,
+                ChangeLog.stage == stage
+            ).order_by(ChangeLog.created_at.desc()).first() if exists else None
+
+            if existing_log:
+                # 如果之前已经生成过同一段落同一阶段的记录，直接更新内容避免重复条目
+                existing_log.before_text = before
+                existing_log.after_text = after
+                existing_log.changes_detail = serialized_detail
+            else:
+                change_log = ChangeLog(
+                    session_id=self.session_obj.id,
+                    segment_index=segment.segment_index,
+                    stage=stage,
+                    before_text=before,
+                    after_text=after,
+                    changes_detail=serialized_detail
+                )
+                self.db.add(change_log)
+        await self._defer(save)
@@ -0,0 +1,288 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from app.config import settings
+from app.services.log_pipeline import log_pipeline
+from app.services.metrics import metrics
+from app.utils.json_setting import parse_json_object
+
+# RATE_LIMIT_OVERRIDES 条目允许的字段
+_LIMIT_FIELDS = ("rpm", "tpm", "max_inflight")
+
+
+class TokenBucket:
+    """令牌桶 - 按每分钟速率匀速补充，容量为一分钟的额度"""
+
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self.tokens = float(per_minute)
+        self._updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.per_minute <= 0
+
+    def reconfigure(self, per_minute: int):
+        self._refill()
+        self.per_minute = per_minute
+        self.tokens = min(self.tokens, float(per_minute))
+
+    def wait_time(self, amount: float) -> float:
+        """获取 amount 个令牌还需等待的秒数（0 表示立即可用）"""
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        # 单次请求超过桶容量时按容量计算，避免永远无法满足
+        amount = min(amount, self.per_minute)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60.0 / self.per_minute
+
+    def consume(self, amount: float):
+        if self.unlimited:
+            return
+        self._refill()
+        self.tokens -= min(amount, self.per_minute)
+
+    def refund(self, amount: float):
+        """按实际用量修正（amount 为负表示追加扣除）"""
+        if self.unlimited:
+            return
+        self._refill()
+        self.tokens = min(self.tokens + amount, float(self.per_minute))
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.per_minute > 0:
+            self.tokens = min(self.tokens + elapsed * self.per_minute / 60.0, float(self.per_minute))
+
+
+class RatePermit:
+    """一次已获准的上游调用，结束时必须 release"""
+
+    def __init__(self, limiter: "EndpointLimiter", estimated_tokens: int):
+        self.limiter = limiter
+        self.estimated_tokens = estimated_tokens
+        self.actual_tokens: Optional[int] = None
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self.limiter._release(self)
+
+    async def __aenter__(self) -> "RatePermit":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class EndpointLimiter:
+    """单个上游端点 (base_url + model) 的限流器
+
+    - RPM / TPM 两个令牌桶
+    - max_inflight 舱壁：限制同一端点的并发请求数，慢端点不会拖垮其他端点
+    - 会话间轮询公平排队：每个会话一条 FIFO，按会话轮流放行
+    """
+
+    def __init__(self, key: str, rpm: int, tpm: int, max_inflight: int):
+        self.key = key
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self._waiters: "OrderedDict[str, Deque[Tuple[asyncio.Future, int]]]" = OrderedDict()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def configure(self, rpm: int, tpm: int, max_inflight: int):
+        """运行时更新限额"""
+        if (rpm, tpm, max_inflight) == (self.requests.per_minute, self.tokens.per_minute, self.max_inflight):
+            return
+        self.requests.reconfigure(rpm)
+        self.tokens.reconfigure(tpm)
+        self.max_inflight = max_inflight
+        self._dispatch()
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._waiters.values())
+
+    async def acquire(self, session_id: str, estimated_tokens: int) -> RatePermit:
+        """等待放行，返回 RatePermit"""
+        if not self._waiters and self._wait_time(estimated_tokens) == 0.0:
+            self._grant(estimated_tokens)
+            return RatePermit(self, estimated_tokens)
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(session_id or "", deque()).append((future, estimated_tokens))
+        metrics.incr("rate_limit", "throttled")
+        started = time.monotonic()
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已放行但调用方被取消，归还名额
+                self._release(RatePermit(self, estimated_tokens))
+            else:
+                self._remove_waiter(session_id or "", future)
+            raise
+        metrics.incr("rate_limit", "wait_seconds", time.monotonic() - started)
+        return RatePermit(self, estimated_tokens)
+
+    def _wait_time(self, estimated_tokens: int) -> Optional[float]:
+        """可立即放行返回 0；受舱壁限制返回 None；否则返回需等待的秒数"""
+        if self.max_inflight > 0 and self.inflight >= self.max_inflight:
+            return None
+        return max(self.requests.wait_time(1), self.tokens.wait_time(estimated_tokens))
+
+    def _grant(self, estimated_tokens: int):
+        self.requests.consume(1)
+        self.tokens.consume(estimated_tokens)
+        self.inflight += 1
+
+    def _release(self, permit: RatePermit):
+        self.inflight = max(self.inflight - 1, 0)
+        if permit.actual_tokens is not None:
+            self.tokens.refund(permit.estimated_tokens - permit.actual_tokens)
+        self._dispatch()
+
+    def _dispatch(self):
+        """按会话轮询放行等待者，额度不足时定时重试"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._waiters:
+            session_id, queue = next(iter(self._waiters.items()))
+            future, estimated_tokens = queue[0]
+            if future.done():
+                queue.popleft()
+                if not queue:
+                    del self._waiters[session_id]
+                continue
+
+            wait = self._wait_time(estimated_tokens)
+            if wait is None:
+                # 舱壁已满，等待 release 触发
+                return
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+
+            self._grant(estimated_tokens)
+            queue.popleft()
+            future.set_result(None)
+            # 当前会话移到队尾，实现轮询
+            del self._waiters[session_id]
+            if queue:
+                self._waiters[session_id] = queue
+
+    def _remove_waiter(self, session_id: str, future: asyncio.Future):
+        queue = self._waiters.get(session_id)
+        if not queue:
+            return
+        for item in list(queue):
+            if item[0] is future:
+                queue.remove(item)
+                break
+        if not queue:
+            del self._waiters[session_id]
+        self._dispatch()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "rpm": self.requests.per_minute,
+            "tpm": self.tokens.per_minute,
+            "max_inflight": self.max_inflight,
+            "inflight": self.inflight,
+            "waiting": self.waiting,
+            "waiting_sessions": len(self._waiters),
+        }
+
+
+class RateLimiterRegistry:
+    """按 base_url + model 共享的上游限流器注册表"""
+
+    def __init__(self):
+        self._limiters: Dict[str, EndpointLimiter] = {}
+        # (原始配置字符串, 校验后的覆盖项)
+        self._overrides_cache: Optional[Tuple[str, Dict[str, Dict[str, int]]]] = None
+
+    def get(self, base_url: str, model: str) -> EndpointLimiter:
+        key = f"{base_url.rstrip('/')}|{model}"
+        rpm, tpm, max_inflight = self._limits_for(key, model)
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            limiter = EndpointLimiter(key, rpm, tpm, max_inflight)
+            self._limiters[key] = limiter
+        else:
+            limiter.configure(rpm, tpm, max_inflight)
+        return limiter
+
+    async def acquire(self, base_url: str, model: str, session_id: Optional[str], estimated_tokens: int) -> RatePermit:
+        """等待指定端点放行"""
+        limiter = self.get(base_url, model)
+        permit = await limiter.acquire(session_id or "", estimated_tokens)
+        if limiter.waiting:
+            log_pipeline.debug(f"[RATE LIMIT] {limiter.key} inflight={limiter.inflight} waiting={limiter.waiting}")
+        return permit
+
+    def _limits_for(self, key: str, model: str) -> Tuple[int, int, int]:
+        """读取限额：RATE_LIMIT_OVERRIDES 中 "base_url|model" 或 "model" 优先，其余使用默认值"""
+        limits = {
+            "rpm": settings.RATE_LIMIT_RPM,
+            "tpm": settings.RATE_LIMIT_TPM,
+            "max_inflight": settings.RATE_LIMIT_MAX_INFLIGHT,
+        }
+        overrides = self._overrides()
+        limits.update(overrides.get(model, {}))
+        limits.update(overrides.get(key, {}))
+        return int(limits["rpm"]), int(limits["tpm"]), int(limits["max_inflight"])
+
+    def _overrides(self) -> Dict[str, Dict[str, int]]:
+        """校验后的 RATE_LIMIT_OVERRIDES，原始字符串变化时重新校验
+
+        条目必须是对象，字段值必须能转换为整数；不合法的条目或字段记录警告后忽略。
+        """
+        raw = settings.RATE_LIMIT_OVERRIDES or ""
+        if self._overrides_cache is not None and self._overrides_cache[0] == raw:
+            return self._overrides_cache[1]
+
+        parsed = parse_json_object(
+            "RATE_LIMIT_OVERRIDES", raw,
+            on_error=lambda message: log_pipeline.warning(f"[RATE LIMIT] {message}")
+        )
+        overrides: Dict[str, Dict[str, int]] = {}
+        for name, entry in parsed.items():
+            if not isinstance(entry, dict):
+                log_pipeline.warning(f"[RATE LIMIT] 忽略 RATE_LIMIT_OVERRIDES[{name!r}]: 必须是对象")
+                continue
+            limits: Dict[str, int] = {}
+            for field, value in entry.items():
+                if field not in _LIMIT_FIELDS:
+                    log_pipeline.warning(f"[RATE LIMIT] 忽略 RATE_LIMIT_OVERRIDES[{name!r}] 的未知字段 {field!r}")
+                    continue
+                try:
+                    if isinstance(value, bool):
+                        raise ValueError(value)
+                    limits[field] = int(value)
+                except (TypeError, ValueError):
+                    log_pipeline.warning(f"[RATE LIMIT] 忽略 RATE_LIMIT_OVERRIDES[{name!r}][{field!r}]: {value!r} 不是整数")
+            overrides[name] = limits
+
+        self._overrides_cache = (raw, overrides)
+        return overrides
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {key: limiter.snapshot() for key, limiter in self._limiters.items()}
+
+
+# 全局限流器注册表实例
+rate_limiter = RateLimiterRegistry()
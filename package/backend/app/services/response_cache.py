@@ -0,0 +1,146 @@
+import asyncio
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models.models import LLMResponseCache
+from app.services.log_pipeline import log_pipeline
+from app.services.metrics import metrics
+
+# 每写入多少条检查一次容量上限
+_EVICT_CHECK_INTERVAL = 100
+
+
+class ResponseCache:
+    """内容寻址的 LLM 响应缓存（SQLite 表，LRU + TTL 淘汰）
+
+    键为 model、完整消息列表、temperature 与阶段的 SHA-256。
+    数据库读写放到线程池执行，每次操作使用独立的数据库会话。
+    """
+
+    def __init__(self):
+        self._writes_since_evict = 0
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, str]], temperature: float, stage: str) -> str:
+        payload = json.dumps(
+            {"model": model, "messages": messages, "temperature": temperature, "stage": stage},
+            ensure_ascii=False,
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        """查询缓存，命中时刷新访问时间"""
+        try:
+            response, expired = await asyncio.to_thread(self._get_sync, key)
+        except Exception as e:
+            log_pipeline.warning(f"[LLM CACHE] 读取失败: {str(e)}")
+            response, expired = None, False
+        if expired:
+            metrics.incr("llm_cache", "expired")
+        metrics.incr("llm_cache", "hits" if response is not None else "misses")
+        return response
+
+    async def put(self, key: str, stage: str, model: str, response: str):
+        """写入缓存（失败不影响主流程）"""
+        if not response:
+            return
+        try:
+            expired, evicted = await asyncio.to_thread(self._put_sync, key, stage, model, response)
+            metrics.incr("llm_cache", "stores")
+            metrics.incr("llm_cache", "expired", expired)
+            metrics.incr("llm_cache", "evictions", evicted)
+        except Exception as e:
+            log_pipeline.warning(f"[LLM CACHE] 写入失败: {str(e)}")
+
+    # 以下同步方法在线程池中执行，计数结果返回给事件循环线程再写入 metrics
+
+    def _get_sync(self, key: str) -> Tuple[Optional[str], bool]:
+        db = SessionLocal()
+        try:
+            entry = db.query(LLMResponseCache).filter(LLMResponseCache.cache_key == key).first()
+            if not entry:
+                return None, False
+            now = datetime.utcnow()
+            ttl = settings.LLM_CACHE_TTL_SECONDS
+            if ttl > 0 and entry.created_at and entry.created_at < now - timedelta(seconds=ttl):
+                db.delete(entry)
+                db.commit()
+                return None, True
+            entry.hit_count = (entry.hit_count or 0) + 1
+            entry.last_accessed_at = now
+            response = entry.response
+            db.commit()
+            return response, False
+        finally:
+            db.close()
+
+    def _put_sync(self, key: str, stage: str, model: str, response: str) -> Tuple[int, int]:
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            entry = db.query(LLMResponseCache).filter(LLMResponseCache.cache_key == key).first()
+            if entry:
+                entry.response = response
+                entry.created_at = now
+                entry.last_accessed_at = now
+            else:
+                db.add(LLMResponseCache(
+                    cache_key=key,
+                    stage=stage,
+                    model=model,
+                    response=response,
+                    hit_count=0,
+                    created_at=now,
+                    last_accessed_at=now
+                ))
+            try:
+                db.commit()
+            except IntegrityError:
+                # 并发写入同一个键，保留先写入的结果
+                db.rollback()
+                return 0, 0
+
+            self._writes_since_evict += 1
+            if self._writes_since_evict < _EVICT_CHECK_INTERVAL:
+                return 0, 0
+            self._writes_since_evict = 0
+            return self._evict(db)
+        finally:
+            db.close()
+
+    def _evict(self, db) -> Tuple[int, int]:
+        """删除过期条目，并按最近访问时间淘汰超出容量的条目，返回 (过期数, 淘汰数)"""
+        expired = 0
+        evicted = 0
+        ttl = settings.LLM_CACHE_TTL_SECONDS
+        if ttl > 0:
+            expired = db.query(LLMResponseCache).filter(
+                LLMResponseCache.created_at < datetime.utcnow() - timedelta(seconds=ttl)
+            ).delete(synchronize_session=False)
+
+        max_entries = settings.LLM_CACHE_MAX_ENTRIES
+        if max_entries > 0:
+            overflow = db.query(LLMResponseCache).count() - max_entries
+            if overflow > 0:
+                stale_ids = [
+                    row.id for row in db.query(LLMResponseCache.id)
+                    .order_by(LLMResponseCache.last_accessed_at)
+                    .limit(overflow)
+                ]
+                db.query(LLMResponseCache).filter(
+                    LLMResponseCache.id.in_(stale_ids)
+                ).delete(synchronize_session=False)
+                evicted = len(stale_ids)
+        db.commit()
+        return expired, evicted
+
+
+# 全局响应缓存实例
+response_cache = ResponseCache()
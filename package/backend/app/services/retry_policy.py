@@ -0,0 +1,188 @@
+import asyncio
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import httpx
+import openai
+
+from app.config import settings
+from app.services.log_pipeline import log_pipeline
+from app.services.metrics import metrics
+
+T = TypeVar("T")
+
+# 错误分类
+RATE_LIMIT = "rate_limit"
+TIMEOUT = "timeout"
+SERVER_ERROR = "server_error"
+CONNECTION = "connection"
+TRUNCATED = "truncated"
+NON_RETRYABLE = "non_retryable"
+
+RETRYABLE_CATEGORIES = {RATE_LIMIT, TIMEOUT, SERVER_ERROR, CONNECTION, TRUNCATED}
+
+
+class OutputTruncatedError(Exception):
+    """输出达到 token 上限被截断（finish_reason == "length"），截断的结果不能作为段落输出
+
+    只有重试时还能放大上限才可重试；未设上限（模型默认）或上限已到 LLM_MAX_TOKENS_CEILING 时
+    重试只会得到同样的截断结果。
+    """
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class RetryBudget:
+    """会话级重试预算
+
+    同一会话内所有 LLM 调用共享，避免上游故障时单个会话无限重试。
+    """
+
+    def __init__(self, total: Optional[int] = None):
+        self.total = settings.RETRY_SESSION_BUDGET if total is None else total
+        self.used = 0
+
+    @property
+    def remaining(self) -> int:
+        return max(self.total - self.used, 0)
+
+    def consume(self) -> bool:
+        """消耗一次重试机会，预算用尽返回 False"""
+        if self.used >= self.total:
+            return False
+        self.used += 1
+        return True
+
+
+def classify_error(exc: BaseException) -> str:
+    """对 LLM 调用异常分类（沿 __cause__ 链查找原始异常）"""
+    current: Optional[BaseException] = exc
+    while current is not None:
+        if isinstance(current, OutputTruncatedError):
+            return TRUNCATED if current.retryable else NON_RETRYABLE
+        if isinstance(current, openai.RateLimitError):
+            return RATE_LIMIT
+        if isinstance(current, (openai.APITimeoutError, asyncio.TimeoutError, httpx.TimeoutException)):
+            return TIMEOUT
+        if isinstance(current, openai.APIStatusError):
+            return _classify_status(current.status_code)
+        if isinstance(current, (openai.APIConnectionError, httpx.TransportError)):
+            return CONNECTION
+        current = current.__cause__
+    return NON_RETRYABLE
+
+
+def _classify_status(status_code: int) -> str:
+    if status_code == 429:
+        return RATE_LIMIT
+    if status_code == 408:
+        return TIMEOUT
+    if status_code == 409 or status_code >= 500:
+        return SERVER_ERROR
+    return NON_RETRYABLE
+
+
+def get_retry_after(exc: BaseException) -> Optional[float]:
+    """解析 Retry-After / retry-after-ms 响应头（秒）"""
+    current: Optional[BaseException] = exc
+    while current is not None:
+        response = getattr(current, "response", None)
+        if isinstance(response, httpx.Response):
+            return _parse_retry_after(response.headers)
+        current = current.__cause__
+    return None
+
+
+def _parse_retry_after(headers: httpx.Headers) -> Optional[float]:
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(float(retry_after_ms) / 1000, 0.0)
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+        return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """LLM 调用重试策略
+
+    - 对限流、超时、5xx、连接错误和输出截断重试，其余 4xx 直接失败
+    - 指数退避 + 全抖动（full jitter），并遵守 Retry-After
+    - 受会话级 RetryBudget 约束
+    """
+
+    def compute_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """计算第 attempt 次重试前的等待时间"""
+        ceiling = min(settings.RETRY_MAX_DELAY, settings.RETRY_BASE_DELAY * (2 ** (attempt - 1)))
+        delay = random.uniform(0, ceiling)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, settings.RETRY_MAX_RETRY_AFTER))
+        return delay
+
+    async def run(
+        self,
+        task: Callable[[], Awaitable[T]],
+        budget: Optional[RetryBudget] = None,
+        label: str = "",
+        on_retry: Optional[Callable[[int, str, float], Awaitable[None]]] = None
+    ) -> T:
+        """执行任务，按策略重试
+
+        Args:
+            task: 无参协程工厂，每次尝试都会重新调用
+            budget: 会话级重试预算
+            label: 日志标签
+            on_retry: 每次重试前回调 (attempt, category, delay)
+        """
+        max_attempts = max(settings.RETRY_MAX_ATTEMPTS, 1)
+        attempt = 1
+        while True:
+            metrics.incr("retry", "attempts")
+            try:
+                result = await task()
+                if attempt > 1:
+                    metrics.incr("retry", "succeeded_after_retry")
+                return result
+            except Exception as exc:
+                category = classify_error(exc)
+                if category not in RETRYABLE_CATEGORIES:
+                    metrics.incr("retry", "non_retryable")
+                    raise
+                if attempt >= max_attempts:
+                    metrics.incr("retry", f"gave_up.{category}")
+                    raise
+                if budget is not None and not budget.consume():
+                    metrics.incr("retry", "budget_exhausted")
+                    raise
+
+                delay = self.compute_delay(attempt, get_retry_after(exc))
+                metrics.incr("retry", f"retries.{category}")
+                metrics.incr("retry", "backoff_seconds", delay)
+                log_pipeline.warning(
+                    f"[RETRY] {label} attempt {attempt}/{max_attempts} failed ({category}): {str(exc)}; "
+                    f"retrying in {delay:.2f}s"
+                )
+                if on_retry is not None:
+                    await on_retry(attempt, category, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+
+# 全局重试策略实例
+retry_policy = RetryPolicy()
@@ -0,0 +1,184 @@
+import re
+from typing import List, Optional
+
+# 非正文段落类别
+REFERENCE = "reference"
+CODE = "code"
+FORMULA = "formula"
+TABLE = "table"
+URL = "url"
+
+CATEGORIES = (REFERENCE, CODE, FORMULA, TABLE, URL)
+
+_CJK = re.compile(r'[\u4e00-\u9fff]')
+_WORD = re.compile(r'[\u4e00-\u9fff]|[A-Za-z]{2,}')
+
+_URL = re.compile(r'(?:https?|ftp)://\S+|www\.\S+|doi\s*[:：]\s*\S+', re.IGNORECASE)
+# 链接前允许的短标签，例如 "[1]"、"- "、"项目地址："
+_URL_LABEL_MAX_WORDS = 6
+
+_FENCE = re.compile(r'^(```|~~~)')
+
+_REFERENCE_HEADING = re.compile(
+    r'^(?:#+\s*)?(?:第?[0-9一二三四五六七八九十]+[章节.、\s]*)?'
+    r'(?:参考文献|参考资料|引用文献|references|bibliography|works cited)\s*[:：]?$',
+    re.IGNORECASE
+)
+_ENTRY_NUMBER = re.compile(r'^(?:\[\d{1,3}\]|［\d{1,3}］|\(\d{1,3}\)|（\d{1,3}）|\d{1,3}[.、]\s*(?=\S))')
+# GB/T 7714 文献类型标识，如 [J]、[M]、[EB/OL]
+_DOC_TYPE = re.compile(r'\[(?:J|M|C|D|R|S|P|N|G|Z|A|DB|CP|EB|EB/OL|J/OL|M/OL|C/OL|DB/OL)\]')
+_YEAR = re.compile(r'(?<!\d)(?:19|20)\d{2}(?!\d)')
+_CITATION_HINT = re.compile(r'et al\.|等\.|[Vv]ol\.|pp\.|\d+\s*\(\d+\)\s*[:：]\s*\d+')
+
+_TABLE_SEPARATOR = re.compile(r'^\|?\s*:?-{3,}:?\s*(?:\|\s*:?-{3,}:?\s*)+\|?$')
+
+_LATEX_BLOCK = re.compile(r'^(?:\$\$|\\\[|\\\]|\\begin\{|\\end\{)')
+_LATEX_COMMAND = re.compile(r'\\[A-Za-z]+')
+_MATH_SYMBOLS = set('=<>≤≥≠≈±×÷∑∏∫√∞∂∇∈∉⊂⊆∪∩→←↔⇒⇔^_{}()[]+-*/|')
+# 公式行编号，如 "(1)"、"（2-3）"
+_EQUATION_NUMBER = re.compile(r'[(（]\s*\d+(?:[.-]\d+)?\s*[)）]\s*$')
+_SENTENCE_END = re.compile(r'[.!?。！？]\s*$')
+# 公式中常见的函数名，不算作英文单词
+_MATH_FUNCTIONS = {"sin", "cos", "tan", "cot", "log", "exp", "lim", "max", "min", "sup", "inf", "det", "arg", "mod"}
+
+_CODE_LINE = re.compile(
+    r'^(?:def |class |import |from \S+ import |#include|#define|package |using |public |private |protected |'
+    r'static |const |let |var |function |return\b|if\s*\(|for\s*\(|while\s*\(|switch\s*\(|else\b|try\s*[:{]|'
+    r'except\b|catch\s*\(|@\w+|//|/\*|\*/|SELECT |INSERT |UPDATE |DELETE |CREATE )'
+)
+_CODE_ENDING = re.compile(r'(?:[;{}]|\):|\)\s*\{)$')
+# 代码结构特征：函数调用（标识符后紧跟括号）、赋值或比较运算符、下标、行尾花括号
+_CODE_SIGNAL = re.compile(
+    r'[A-Za-z_][\w.]*\([^()]*\)|[\w\])]\s*(?:[-+*/%&|^]?=|==|!=|<=|>=|->|=>)\s*\S|[A-Za-z_]\w*\[[^\]]*\]|[{}]\s*$'
+)
+# 以函数调用结果赋值的语句，如 "x = np.array(data)"（Python 等语言没有行尾分号）
+_CODE_ASSIGNMENT = re.compile(r'^[A-Za-z_][\w.]*(?:\[[^\]]*\])?\s*[-+*/]?=\s*[A-Za-z_][\w.]*\(.*\)$')
+_CODE_COMMENT = re.compile(r'(?:#|//).*$')
+_CODE_STRING = re.compile(r'"[^"]*"|\'[^\']*\'')
+# 英文正文：普通单词（可带句末标点，不含全大写的 SQL 关键字等）达到该数量且占多数时不是代码
+_PROSE_WORD = re.compile(r'^[A-Za-z][a-z]*[,.;:]?$')
+_PROSE_MIN_WORDS = 6
+
+
+def _words(text: str) -> int:
+    """正文词数：汉字按字计，英文按单词计"""
+    return len(_WORD.findall(text))
+
+
+def _is_url(text: str) -> bool:
+    if not _URL.search(text):
+        return False
+    return _words(_URL.sub(" ", text)) <= _URL_LABEL_MAX_WORDS
+
+
+def _is_table_row(text: str) -> bool:
+    if _TABLE_SEPARATOR.match(text):
+        return True
+    if text.startswith("|") and text.endswith("|") and text.count("|") >= 3:
+        return True
+    # 从表格软件复制的制表符分隔行：至少三列且每列都很短
+    cells = [cell for cell in text.split("\t") if cell.strip()]
+    return len(cells) >= 3 and all(_words(cell) <= 12 for cell in cells)
+
+
+def _is_formula(text: str) -> bool:
+    if _LATEX_BLOCK.match(text):
+        return True
+    if _CJK.search(text):
+        return False
+    body = _EQUATION_NUMBER.sub("", text)
+    body = _LATEX_COMMAND.sub(" ", body)
+    if not any(ch in "=≤≥≠≈∑∏∫√" for ch in body):
+        return False
+    symbols = sum(1 for ch in body if ch in _MATH_SYMBOLS)
+    words = [word for word in re.findall(r'[A-Za-z]{3,}', body) if word.lower() not in _MATH_FUNCTIONS]
+    # 以句末标点结尾且含英文单词的是叙述句，如 "Let x = 5 and y = 10."
+    if words and _SENTENCE_END.search(body):
+        return False
+    # 变量名通常为单个字母，超过两个英文单词时视为正文句子
+    return len(words) <= 2 and symbols >= 2
+
+
+def _is_english_prose(text: str) -> bool:
+    tokens = text.split()
+    words = sum(1 for token in tokens if _PROSE_WORD.match(token))
+    return words >= _PROSE_MIN_WORDS and words * 2 >= len(tokens)
+
+
+def _is_code(text: str) -> bool:
+    stripped = _CODE_STRING.sub('""', text)
+    stripped = _CODE_COMMENT.sub("", stripped) if not stripped.startswith(("#include", "#define")) else stripped
+    # 注释和字符串之外出现汉字或成句英文的是正文，出现 LaTeX 命令的交给公式判断
+    if _CJK.search(stripped) or _is_english_prose(stripped) or _LATEX_COMMAND.search(stripped):
+        return False
+    stripped = stripped.strip()
+    if _CODE_LINE.match(text) or _CODE_ASSIGNMENT.match(stripped):
+        return True
+    return bool(_CODE_ENDING.search(stripped)) and bool(_CODE_SIGNAL.search(stripped))
+
+
+def _is_reference_entry(text: str) -> bool:
+    """参考文献条目：带编号，且有文献类型标识，或同时有年份和引用格式特征（以句号结尾的是正文）"""
+    if not _ENTRY_NUMBER.match(text):
+        return False
+    if _DOC_TYPE.search(text):
+        return True
+    return not text.endswith("。") and bool(_YEAR.search(text)) and bool(_CITATION_HINT.search(text))
+
+
+def classify_segment(text: str) -> Optional[str]:
+    """判断单个段落是否为非正文内容，返回类别，正文返回 None（不考虑前后段落）"""
+    text = text.strip()
+    if not text:
+        return None
+    if _FENCE.match(text):
+        return CODE
+    if _is_url(text):
+        return URL
+    if _is_table_row(text):
+        return TABLE
+    if _is_reference_entry(text):
+        return REFERENCE
+    # 代码行也常含 "=" 和括号，先于公式判断
+    if _is_code(text):
+        return CODE
+    if _is_formula(text):
+        return FORMULA
+    return None
+
+
+def classify_segments(texts: List[str]) -> List[Optional[str]]:
+    """对全部段落做一次启发式分类，返回与 texts 等长的类别列表（正文为 None）
+
+    在单段判断之外利用前后文：代码块围栏（```）之间的段落都归为代码，
+    参考文献标题之后带编号或年份的段落都归为参考文献，直到出现不像条目的段落。
+    """
+    categories: List[Optional[str]] = []
+    in_fence = False
+    in_references = False
+
+    for text in texts:
+        text = text.strip()
+        if _FENCE.match(text):
+            in_fence = not in_fence
+            categories.append(CODE)
+            continue
+        if in_fence:
+            categories.append(CODE)
+            continue
+
+        if _REFERENCE_HEADING.match(text):
+            # 标题本身按短段落处理
+            in_references = True
+            categories.append(None)
+            continue
+
+        category = classify_segment(text)
+        if in_references:
+            if category is None and (_ENTRY_NUMBER.match(text) or _YEAR.search(text) or _DOC_TYPE.search(text)):
+                category = REFERENCE
+            elif category is None:
+                in_references = False
+        categories.append(category)
+
+    return categories
@@ -1,7 +1,20 @@
 import asyncio
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 import json
+import zlib
 from asyncio import Queue
+from app.config import settings
+from app.services.log_pipeline import log_pipeline
+
+# 流式内容协议版本
+# 1: 每个 content 消息携带增量 content 和累计 full_text
+# 2: content 只携带增量和序号 seq，定期发送带校验和的 content_snapshot
+STREAM_PROTOCOL_VERSION = 2
+
+
+def text_checksum(text: str) -> str:
+    """文本校验和（UTF-8 字节的 CRC32，8 位十六进制）"""
+    return f"{zlib.crc32(text.encode('utf-8')) & 0xffffffff:08x}"
 
 class StreamManager:
     """流式响应管理器"""
@@ -31,6 +44,10 @@ class StreamManager:
                 if not self.connections[session_id]:
                     del self.connections[session_id]
 
+    def delta_stream(self, session_id: str, segment_index: int, stage: str) -> "DeltaStream":
+        """创建一个段落的增量流"""
+        return DeltaStream(self, session_id, segment_index, stage)
+
     async def broadcast(self, session_id: str, data: Dict[str, Any]):
         """广播消息给指定会话的所有连接"""
         # 不加锁以避免阻塞，只在读取连接列表时加锁（如果需要严格一致性，但这里为了性能可以放宽）
@@ -42,15 +59,15 @@ class StreamManager:
         
         if not queues:
             # 只记录非 content 类型的消息，避免刷屏
-            if data.get('type') != 'content':
-                print(f"[STREAM WARNING] No active connections for session {session_id}, message type: {data.get('type')}", flush=True)
+            if data.get('type') not in ('content', 'content_snapshot'):
+                log_pipeline.debug(f"[STREAM WARNING] No active connections for session {session_id}, message type: {data.get('type')}")
             return
 
         message = f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
         
         # 只记录非 content 类型的消息，避免刷屏
-        if data.get('type') != 'content':
-            print(f"[STREAM BROADCAST] Session: {session_id}, Type: {data.get('type')}, Connections: {len(queues)}", flush=True)
+        if data.get('type') not in ('content', 'content_snapshot'):
+            log_pipeline.debug(f"[STREAM BROADCAST] Session: {session_id}, Type: {data.get('type')}, Connections: {len(queues)}")
         
         failed_queues = []
         for queue in queues:
@@ -58,10 +75,10 @@ class StreamManager:
                 # 使用 put_nowait 避免阻塞
                 queue.put_nowait(message)
             except asyncio.QueueFull:
-                print(f"[STREAM ERROR] Queue full for session {session_id}, dropping message", flush=True)
+                log_pipeline.warning(f"[STREAM ERROR] Queue full for session {session_id}, dropping message")
                 failed_queues.append(queue)
             except Exception as e:
-                print(f"[STREAM ERROR] Failed to push to queue: {e}", flush=True)
+                log_pipeline.warning(f"[STREAM ERROR] Failed to push to queue: {e}")
                 failed_queues.append(queue)
         
         # 清理失败的队列
@@ -71,5 +88,69 @@ class StreamManager:
                     if session_id in self.connections and failed_queue in self.connections[session_id]:
                         self.connections[session_id].remove(failed_queue)
 
+class DeltaStream:
+    """单个段落单个阶段的增量流
+
+    每个增量分配递增序号（从 1 开始，重试时新建实例重新计数），
+    每隔 STREAM_SNAPSHOT_INTERVAL 个增量及结束时发送一次快照，
+    客户端发现序号缺口或校验和不一致时用快照文本覆盖本地内容。
+    """
+
+    def __init__(
+        self,
+        manager: "StreamManager",
+        session_id: str,
+        segment_index: int,
+        stage: str,
+        snapshot_interval: Optional[int] = None
+    ):
+        self.manager = manager
+        self.session_id = session_id
+        self.segment_index = segment_index
+        self.stage = stage
+        self.snapshot_interval = settings.STREAM_SNAPSHOT_INTERVAL if snapshot_interval is None else snapshot_interval
+        self.seq = 0
+        self._parts: List[str] = []
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    async def push(self, chunk: str):
+        """推送一个增量"""
+        self.seq += 1
+        self._parts.append(chunk)
+        await self.manager.broadcast(self.session_id, {
+            "type": "content",
+            "protocol_version": STREAM_PROTOCOL_VERSION,
+            "segment_index": self.segment_index,
+            "stage": self.stage,
+            "seq": self.seq,
+            "content": chunk
+        })
+        if self.snapshot_interval > 0 and self.seq % self.snapshot_interval == 0:
+            await self.snapshot()
+
+    async def snapshot(self, final: bool = False):
+        """发送带校验和的全文快照"""
+        text = self.text
+        await self.manager.broadcast(self.session_id, {
+            "type": "content_snapshot",
+            "protocol_version": STREAM_PROTOCOL_VERSION,
+            "segment_index": self.segment_index,
+            "stage": self.stage,
+            "seq": self.seq,
+            "text": text,
+            "length": len(text),
+            "checksum": text_checksum(text),
+            "final": final
+        })
+
+    async def finish(self) -> str:
+        """发送最终快照并返回完整文本"""
+        await self.snapshot(final=True)
+        return self.text
+
+
 # 全局实例
 stream_manager = StreamManager()
\ No newline at end of file
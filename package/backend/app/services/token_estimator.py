@@ -0,0 +1,109 @@
+import math
+import re
+from typing import Optional
+
+from app.config import settings
+from app.services.log_pipeline import log_pipeline
+
+# 与 GPT 系列 BPE 预分词相近的切分：CJK 字符、英文单词、数字、空白、其余符号
+_PIECE_PATTERN = re.compile(
+    r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]"  # 汉字
+    r"|[\u3040-\u30ff\uac00-\ud7af]"  # 日文假名、韩文
+    r"|[A-Za-z\u00c0-\u024f]+"  # 拉丁字母单词
+    r"|\d+"
+    r"|\s+"
+    r"|[^\sA-Za-z\d]"
+)
+
+# 校准系数：以 cl100k_base / o200k_base 在中英文学术文本上的实测比例为准
+# 常见英文单词（不超过 8 个字母）基本是 1 个 token，更长的单词约每 6 个字母 1 个 token
+_SHORT_WORD_LETTERS = 8
+_LETTERS_PER_TOKEN = 6
+_DIGITS_PER_TOKEN = 3
+
+
+class TokenEstimator:
+    """离线 token 估算器
+
+    默认使用校准过的启发式规则，无需任何网络访问：
+    - 汉字按 TOKEN_CJK_RATIO（默认 1.0）计
+    - 英文按单词长度计，数字每 3 位 1 个 token
+    - 标点和其他符号各 1 个 token，普通空格并入相邻单词
+
+    TOKEN_ESTIMATOR=tiktoken 且本地已安装 tiktoken 并缓存了编码文件时，
+    使用真实 BPE 计数；加载失败自动回退到启发式规则。
+    """
+
+    def __init__(self):
+        self._encoding = None
+        self._encoding_name: Optional[str] = None
+        self._encoding_failed = False
+
+    @property
+    def backend(self) -> str:
+        return "tiktoken" if self._get_encoding() is not None else "heuristic"
+
+    def count(self, text: Optional[str]) -> int:
+        """估算文本的 token 数"""
+        if not text:
+            return 0
+        encoding = self._get_encoding()
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+        return self.heuristic_count(text)
+
+    def heuristic_count(self, text: str) -> int:
+        cjk_ratio = settings.TOKEN_CJK_RATIO
+        cjk_tokens = 0.0
+        tokens = 0
+        for match in _PIECE_PATTERN.finditer(text):
+            piece = match.group(0)
+            first = piece[0]
+            if first.isspace():
+                # 单个空格并入下一个单词；换行、缩进等连续空白单独成 token
+                if piece != " ":
+                    tokens += 1
+            elif len(piece) == 1 and _is_cjk(first):
+                cjk_tokens += cjk_ratio
+            elif first.isdigit():
+                tokens += math.ceil(len(piece) / _DIGITS_PER_TOKEN)
+            elif first.isalpha():
+                if len(piece) <= _SHORT_WORD_LETTERS:
+                    tokens += 1
+                else:
+                    tokens += math.ceil(len(piece) / _LETTERS_PER_TOKEN)
+            else:
+                tokens += 1
+        return tokens + int(math.ceil(cjk_tokens))
+
+    def _get_encoding(self):
+        if settings.TOKEN_ESTIMATOR != "tiktoken" or self._encoding_failed:
+            return None
+        name = settings.TOKEN_ENCODING
+        if self._encoding is not None and self._encoding_name == name:
+            return self._encoding
+        try:
+            import tiktoken
+            self._encoding = tiktoken.get_encoding(name)
+            self._encoding_name = name
+        except Exception as e:
+            # 未安装或编码文件未缓存（离线环境无法下载）
+            self._encoding_failed = True
+            log_pipeline.warning(f"[TOKEN] 无法加载 tiktoken 编码 {name}，使用启发式估算: {str(e)}")
+            return None
+        return self._encoding
+
+
+def _is_cjk(char: str) -> bool:
+    code = ord(char)
+    return (
+        0x3400 <= code <= 0x4dbf
+        or 0x4e00 <= code <= 0x9fff
+        or 0xf900 <= code <= 0xfaff
+        or 0x3040 <= code <= 0x30ff
+        or 0xac00 <= code <= 0xd7af
+    )
+
+
+# 全局 token 估算器实例
+token_estimator = TokenEstimator()
@@ -8,6 +8,7 @@ from app.utils.auth import (
     create_access_token,
     verify_token
 )
+from app.utils.json_setting import parse_json_object
 
 __all__ = [
     "generate_card_key",
@@ -16,5 +17,6 @@ __all__ = [
     "verify_password",
     "get_password_hash",
     "create_access_token",
-    "verify_token"
+    "verify_token",
+    "parse_json_object"
 ]
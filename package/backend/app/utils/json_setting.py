@@ -0,0 +1,31 @@
+import json
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# 配置名 -> (原始字符串, 解析结果)
+_cache: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+
+
+def parse_json_object(
+    name: str,
+    raw: str,
+    on_error: Optional[Callable[[str], None]] = None
+) -> Dict[str, Any]:
+    """解析 JSON 对象格式的配置项（如 RATE_LIMIT_OVERRIDES），结果按配置名和原始字符串缓存
+
+    配置可在运行时修改，原始字符串变化时重新解析；无法解析时返回空字典，
+    错误信息交给 on_error（每个原始字符串只回调一次），由调用方记录日志。
+    """
+    raw = raw or ""
+    cached = _cache.get(name)
+    if cached is not None and cached[0] == raw:
+        return cached[1]
+    try:
+        parsed = json.loads(raw) if raw.strip() else {}
+        if not isinstance(parsed, dict):
+            raise ValueError(f"{name} 必须是 JSON 对象")
+    except ValueError as e:
+        if on_error is not None:
+            on_error(f"无法解析 {name}: {str(e)}")
+        parsed = {}
+    _cache[name] = (raw, parsed)
+    return parsed
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+数据库访问对事件循环的阻塞基准
+N 个会话并发跑完整的优化流程，对比：
+  - 旧实现：同步 Session 直接在事件循环上提交、查询
+  - 新实现：SessionExecutor 在专用线程中执行数据库操作
+统计事件循环延迟（ticker 实际唤醒时间与预期的偏差）与总耗时。
+AI 调用替换为固定耗时的 sleep（不构造提示词、不经过 SDK），只保留数据库访问的开销。
+
+用法:
+    python benchmarks/bench_db.py --sessions 10 --paragraphs 20 --db-latency-ms 2
+
+--db-latency-ms 模拟每条 SQL 的额外耗时（如网络数据库或繁忙的磁盘），0 表示本地 SQLite 的真实开销。
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+backend_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(backend_dir))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+_db_dir = tempfile.mkdtemp(prefix="bench_db_")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_dir}/bench.db"
+
+from sqlalchemy import event  # noqa: E402
+
+from app.config import settings  # noqa: E402
+from app.database import SessionExecutor, SessionLocal, engine, init_db  # noqa: E402
+from app.models.models import OptimizationSession, User  # noqa: E402
+from app.services.ai_service import CallUsage  # noqa: E402
+from app.services.concurrency import concurrency_manager  # noqa: E402
+from app.services.log_pipeline import log_pipeline  # noqa: E402
+from app.services.optimization_service import OptimizationService  # noqa: E402
+from loop_lag import LoopLagMonitor, format_report, now  # noqa: E402
+
+PARAGRAPH = "深度学习模型借助注意力机制来开展特征提取工作，从而显著提升了下游任务的性能表现。" * 3
+
+
+class InlineSessionExecutor(SessionExecutor):
+    """旧实现：数据库操作直接在事件循环线程中执行"""
+
+    async def run(self, fn, *args):
+        return fn(*args)
+
+
+def patch_ai_calls(llm_latency: float):
+    async def call_segment(self, ai_service, stage, idx, input_text, prompt, history):
+        await asyncio.sleep(llm_latency)
+        call_usage = CallUsage()
+        call_usage.model = "bench"
+        return input_text, call_usage
+    OptimizationService._call_segment = call_segment
+
+
+def create_sessions(count: int, paragraphs: int, tag: str):
+    db = SessionLocal()
+    try:
+        text = "\n\n".join(f"{i}. {PARAGRAPH}" for i in range(paragraphs))
+        ids = []
+        for i in range(count):
+            user = User(card_key=f"{tag}-{i}", access_link=f"{tag}-{i}", is_active=True, usage_limit=0, usage_count=0)
+            db.add(user)
+            db.flush()
+            session = OptimizationSession(
+                user_id=user.id, session_id=f"{tag}-{i}", original_text=text,
+                processing_mode="paper_polish_enhance", current_stage="polish", status="queued", progress=0.0
+            )
+            db.add(session)
+            db.flush()
+            ids.append(session.id)
+        db.commit()
+        return ids
+    finally:
+        db.close()
+
+
+async def run_session(executor_cls, session_id: int):
+    db_executor = executor_cls(SessionLocal())
+    try:
+        session_obj = await db_executor.run(
+            lambda: db_executor.session.query(OptimizationSession).filter(OptimizationSession.id == session_id).first()
+        )
+        await OptimizationService(db_executor, session_obj).start_optimization()
+    finally:
+        await db_executor.close()
+
+
+async def run_case(name: str, executor_cls, args, statements):
+    ids = create_sessions(args.sessions, args.paragraphs, name)
+    statements["count"] = 0
+    statements["commits"] = 0
+    monitor = LoopLagMonitor()
+    monitor.start()
+    started = now()
+    await asyncio.gather(*(run_session(executor_cls, session_id) for session_id in ids))
+    elapsed = now() - started
+    await monitor.stop()
+    print(format_report(name, monitor.report(), elapsed))
+    print(f"{'':<28} SQL 语句 {statements['count']} 条, 事务提交 {statements['commits']} 次")
+
+
+async def main(args):
+    settings.LOG_LEVEL = "WARNING"
+    # AIService 初始化需要合法的地址，实际不会发出请求
+    settings.OPENAI_BASE_URL = "http://127.0.0.1:9/v1"
+    settings.OPENAI_API_KEY = "bench"
+    concurrency_manager.max_concurrent = args.sessions
+    patch_ai_calls(args.llm_latency_ms / 1000)
+
+    statements = {"count": 0, "commits": 0}
+    db_latency = args.db_latency_ms / 1000
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def slow_statement(conn, cursor, statement, parameters, context, executemany):
+        statements["count"] += 1
+        if db_latency:
+            time.sleep(db_latency)
+
+    @event.listens_for(engine, "commit")
+    def count_commit(conn):
+        statements["commits"] += 1
+
+    await run_case("inline (事件循环上执行)", InlineSessionExecutor, args, statements)
+    await run_case("SessionExecutor (专用线程)", SessionExecutor, args, statements)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="数据库访问的事件循环阻塞基准")
+    parser.add_argument("--sessions", type=int, default=10, help="并发会话数")
+    parser.add_argument("--paragraphs", type=int, default=20, help="每个会话的段落数")
+    parser.add_argument("--llm-latency-ms", type=float, default=50.0, help="模拟的 LLM 响应耗时")
+    parser.add_argument("--db-latency-ms", type=float, default=1.0, help="模拟的每条 SQL 额外耗时")
+    print(f"Python {sys.version.split()[0]}")
+    init_db()
+    log_pipeline.start()
+    asyncio.run(main(parser.parse_args()))
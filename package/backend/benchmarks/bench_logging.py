@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+日志管道基准测试
+模拟 N 个并发会话，每次 LLM 调用都记录多 KB 的提示词与完整响应，
+对比旧的 print(..., flush=True) 与 LogPipeline 对事件循环造成的阻塞。
+
+用法:
+    python benchmarks/bench_logging.py --sessions 50 --calls 20 --write-latency-ms 0.2
+
+--write-latency-ms 模拟慢速终端（如 Windows 控制台）每次写入的耗时。
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import sys
+import time
+from pathlib import Path
+
+backend_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(backend_dir))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from app.config import settings  # noqa: E402
+from app.services.log_pipeline import LogPipeline  # noqa: E402
+from loop_lag import LoopLagMonitor, format_report, now  # noqa: E402
+
+PROMPT = "你是一位世界顶级的学术编辑。" * 300  # 约 4KB 系统提示词
+RESPONSE = "深度学习模型借助注意力机制来开展特征提取工作。" * 80
+
+
+class SlowStream(io.TextIOBase):
+    """模拟慢速终端：每次 write/flush 都会同步阻塞一段时间"""
+
+    def __init__(self, write_latency: float):
+        self.write_latency = write_latency
+        self.bytes_written = 0
+
+    def write(self, text):
+        if self.write_latency:
+            time.sleep(self.write_latency)
+        self.bytes_written += len(text)
+        return len(text)
+
+    def flush(self):
+        if self.write_latency:
+            time.sleep(self.write_latency)
+
+
+async def legacy_session(calls: int, llm_latency: float):
+    """旧实现：在事件循环上同步打印完整请求与响应"""
+    for _ in range(calls):
+        messages = [{"role": "system", "content": PROMPT}, {"role": "user", "content": RESPONSE}]
+        print("\n" + "=" * 80, flush=True)
+        print("[AI REQUEST] Model:", "gpt-5", flush=True)
+        for idx, msg in enumerate(messages):
+            content = msg["content"]
+            print(f"  Message [{idx}] Role: {msg['role']}", flush=True)
+            print(f"  Content: {content[:300] + '...' if len(content) > 300 else content}", flush=True)
+        print("=" * 80 + "\n", flush=True)
+        await asyncio.sleep(llm_latency)
+        print("[AI RESPONSE] Content:", flush=True)
+        print(RESPONSE, flush=True)
+        print("[AI RESPONSE] Content Length:", len(RESPONSE), flush=True)
+
+
+async def pipeline_session(pipeline: LogPipeline, calls: int, llm_latency: float):
+    """新实现：只在事件循环上入队"""
+    for _ in range(calls):
+        messages = [{"role": "system", "content": PROMPT}, {"role": "user", "content": RESPONSE}]
+        pipeline.info(f"[AI REQUEST] model=gpt-5, messages={len(messages)}")
+        for idx, msg in enumerate(messages):
+            pipeline.log_body("DEBUG", f"[AI REQUEST] [{idx}] {msg['role']}", msg["content"])
+        await asyncio.sleep(llm_latency)
+        pipeline.info(f"[AI RESPONSE] length={len(RESPONSE)}")
+        pipeline.log_body("DEBUG", "[AI RESPONSE] Content", RESPONSE)
+
+
+async def run_case(name: str, make_tasks):
+    monitor = LoopLagMonitor()
+    monitor.start()
+    started = now()
+    await asyncio.gather(*make_tasks())
+    elapsed = now() - started
+    await monitor.stop()
+    print(format_report(name, monitor.report(), elapsed), file=sys.__stdout__)
+
+
+async def main(args):
+    sink = SlowStream(args.write_latency_ms / 1000)
+    llm_latency = args.llm_latency_ms / 1000
+
+    with contextlib.redirect_stdout(sink):
+        await run_case(
+            "print(flush=True)",
+            lambda: [legacy_session(args.calls, llm_latency) for _ in range(args.sessions)]
+        )
+
+    for level in ("DEBUG", "INFO"):
+        settings.LOG_LEVEL = level
+        pipeline = LogPipeline(stream=sink, max_queue_size=100000)
+        pipeline.start()
+        await run_case(
+            f"LogPipeline(LOG_LEVEL={level})",
+            lambda: [pipeline_session(pipeline, args.calls, llm_latency) for _ in range(args.sessions)]
+        )
+        pipeline.stop(timeout=60)
+        print(f"{'':<28} 写出 {pipeline.written} 条, 丢弃 {pipeline.dropped} 条", file=sys.__stdout__)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="日志管道事件循环阻塞基准")
+    parser.add_argument("--sessions", type=int, default=50, help="并发会话数")
+    parser.add_argument("--calls", type=int, default=20, help="每个会话的 LLM 调用次数")
+    parser.add_argument("--llm-latency-ms", type=float, default=50.0, help="模拟的 LLM 响应耗时")
+    parser.add_argument("--write-latency-ms", type=float, default=0.2, help="模拟的终端单次写入耗时")
+    print(f"Python {sys.version.split()[0]}")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+token 估算基准测试
+在中文、英文和中英混合的学术语料上对比：
+  - 旧计量：count_chinese_characters（原历史压缩阈值使用，英文恒为 0）
+  - 旧估算：汉字 + 其余字符 / 4
+  - 新估算：token_estimator 启发式规则
+若本地安装了 tiktoken 且已缓存编码文件，同时给出真实 BPE 计数和误差。
+
+用法:
+    python benchmarks/bench_tokens.py --repeat 200 --encoding o200k_base
+    python benchmarks/bench_tokens.py --file paper.txt
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+backend_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from app.config import settings  # noqa: E402
+from app.services.ai_service import count_chinese_characters  # noqa: E402
+from app.services.token_estimator import token_estimator  # noqa: E402
+
+ZH_CORPUS = (
+    "深度学习模型借助注意力机制来开展特征提取工作，从而显著提升了下游任务的性能表现。"
+    "本文提出了一种基于图神经网络的多模态融合方法，通过构建跨模态的语义关联图，"
+    "实现了文本与图像特征在统一表示空间中的对齐。实验结果表明，该方法在三个公开数据集上"
+    "均取得了优于现有基线模型的效果，其中在检索任务上的平均准确率提升了约百分之四。\n"
+)
+
+EN_CORPUS = (
+    "Deep learning models leverage attention mechanisms to extract salient features, "
+    "which substantially improves performance on downstream tasks. In this paper, we propose "
+    "a multimodal fusion approach based on graph neural networks that aligns textual and visual "
+    "representations in a shared embedding space. Experimental results on three public benchmarks "
+    "demonstrate consistent improvements over strong baselines, with a mean accuracy gain of 4.2%.\n"
+)
+
+MIXED_CORPUS = (
+    "我们在 ImageNet-1K 上使用 ResNet-50 作为 backbone，batch size 设为 256，学习率为 1e-3，"
+    "并采用 AdamW optimizer 训练 90 个 epoch。与 ViT-B/16 相比，所提方法的 Top-1 accuracy "
+    "提升了 1.8%，FLOPs 降低约 23%。相关代码见 https://github.com/example/repo，"
+    "实验设置遵循 He et al. (2016) 与 Dosovitskiy et al. (2021) 的工作。\n"
+)
+
+
+def legacy_estimate(text: str) -> int:
+    """user-010 之前 estimate_tokens 的实现"""
+    chinese_count = count_chinese_characters(text)
+    return chinese_count + (len(text) - chinese_count + 3) // 4
+
+
+def load_reference(encoding_name: str):
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        print(f"[INFO] 无法加载 tiktoken {encoding_name}（{type(e).__name__}），仅输出估算值\n")
+        return None
+
+
+def timed(func, text: str):
+    started = time.perf_counter()
+    value = func(text)
+    return value, time.perf_counter() - started
+
+
+def run(corpora, encoding, threshold: int):
+    header = f"{'语料':<8}{'字符数':>9}{'旧汉字计数':>11}{'旧估算':>9}{'新估算':>9}{'参考BPE':>9}{'新估算误差':>11}{'估算吞吐':>12}"
+    print(header)
+    print("-" * len(header))
+    for name, text in corpora:
+        chars = count_chinese_characters(text)
+        legacy = legacy_estimate(text)
+        estimated, elapsed = timed(token_estimator.heuristic_count, text)
+        throughput = len(text.encode("utf-8")) / elapsed / 1024 / 1024 if elapsed else float("inf")
+        if encoding is not None:
+            reference = len(encoding.encode(text, disallowed_special=()))
+            error = f"{(estimated - reference) / reference * 100:+.1f}%" if reference else "-"
+            reference_text = str(reference)
+        else:
+            reference_text, error = "-", "-"
+        print(
+            f"{name:<8}{len(text):>9}{chars:>11}{legacy:>9}{estimated:>9}"
+            f"{reference_text:>9}{error:>11}{throughput:>9.1f}MB/s"
+        )
+
+    print()
+    print(f"历史压缩触发点（HISTORY_COMPRESSION_THRESHOLD={threshold}，按单段样本累加）")
+    for name, text in corpora[:3]:
+        sample = text.split("\n")[0]
+        per_chars = count_chinese_characters(sample)
+        per_tokens = token_estimator.heuristic_count(sample)
+        old = f"{threshold // per_chars + 1} 段" if per_chars else "永不触发"
+        new = f"{threshold // per_tokens + 1} 段" if per_tokens else "永不触发"
+        print(f"  {name:<8} 旧（汉字计数）: {old:<10} 新（token）: {new}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="token 估算基准测试")
+    parser.add_argument("--repeat", type=int, default=200, help="每种语料重复的段数")
+    parser.add_argument("--encoding", default=settings.TOKEN_ENCODING, help="参考 tiktoken 编码")
+    parser.add_argument("--file", action="append", default=[], help="额外的语料文件（可多次指定）")
+    parser.add_argument("--threshold", type=int, default=settings.HISTORY_COMPRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    corpora = [
+        ("中文", ZH_CORPUS * args.repeat),
+        ("英文", EN_CORPUS * args.repeat),
+        ("混合", MIXED_CORPUS * args.repeat),
+        ("交替", (ZH_CORPUS + EN_CORPUS + MIXED_CORPUS) * args.repeat),
+    ]
+    for path in args.file:
+        corpora.append((Path(path).name[:8], Path(path).read_text(encoding="utf-8")))
+
+    print(f"TOKEN_CJK_RATIO={settings.TOKEN_CJK_RATIO}\n")
+    run(corpora, load_reference(args.encoding), args.threshold)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+端到端压测驱动
+1. 以管理员身份批量生成卡密
+2. 按设定的节奏调用 /api/optimization/start 提交会话
+3. 每个会话挂一个 SSE 客户端（/sessions/{id}/stream），并轮询进度直到结束
+4. 输出吞吐（会话/小时）、完成耗时与排队等待的 p50/p95
+
+配合 mock_llm_server.py 使用可以在不产生 API 费用的情况下压测整条流水线：
+    python benchmarks/mock_llm_server.py --port 9000 --tps 80
+    python benchmarks/load_test.py --sessions 40 --ramp 20 --mock-url http://127.0.0.1:9000/v1
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+backend_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from app.config import settings  # noqa: E402
+
+# 批量生成卡密接口单次上限
+_KEY_BATCH_SIZE = 100
+
+# 会话结束状态
+_FINAL_STATUSES = {"completed", "failed", "stopped"}
+
+SAMPLE_PARAGRAPHS = [
+    "深度学习模型借助注意力机制来开展特征提取工作，从而显著提升了下游任务的性能表现。"
+    "本文提出了一种基于图神经网络的多模态融合方法，通过构建跨模态的语义关联图，实现了文本与图像特征在统一表示空间中的对齐。",
+    "实验结果表明，该方法在三个公开数据集上均取得了优于现有基线模型的效果，其中在检索任务上的平均准确率提升了约百分之四。"
+    "消融实验进一步验证了各个模块的有效性，尤其是跨模态注意力模块对性能提升的贡献最为显著。",
+    "Deep learning models leverage attention mechanisms to extract salient features, which substantially improves "
+    "performance on downstream tasks. We further analyse the robustness of the proposed method under distribution shift.",
+]
+
+
+class SessionResult:
+    """单个压测会话的时间线"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.session_id: Optional[str] = None
+        self.submitted_at: Optional[float] = None
+        self.processing_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.first_content_at: Optional[float] = None
+        self.status = "pending"
+        self.error: Optional[str] = None
+        self.sse_events: Dict[str, int] = {}
+
+    @property
+    def queue_wait(self) -> Optional[float]:
+        if self.submitted_at is None or self.processing_at is None:
+            return None
+        return self.processing_at - self.submitted_at
+
+    @property
+    def completion_time(self) -> Optional[float]:
+        if self.status != "completed" or self.submitted_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.submitted_at
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+def build_text(index: int, paragraphs: int, text: Optional[str]) -> str:
+    """生成会话原文；默认在每段前加上会话编号，避免命中响应缓存"""
+    if text:
+        return text
+    parts = []
+    for i in range(paragraphs):
+        parts.append(f"[{index}-{i}] {SAMPLE_PARAGRAPHS[i % len(SAMPLE_PARAGRAPHS)]}")
+    return "\n\n".join(parts)
+
+
+async def admin_login(client: httpx.AsyncClient, username: str, password: str) -> str:
+    response = await client.post("/api/admin/login", json={"username": username, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def create_card_keys(client: httpx.AsyncClient, token: str, count: int, usage_limit: int) -> List[str]:
+    keys: List[str] = []
+    while len(keys) < count:
+        batch = min(_KEY_BATCH_SIZE, count - len(keys))
+        response = await client.post(
+            "/api/admin/batch-generate-keys",
+            params={"count": batch, "prefix": "LOAD", "usage_limit": usage_limit},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        response.raise_for_status()
+        keys.extend(item["card_key"] for item in response.json()["keys"])
+    return keys
+
+
+async def follow_sse(client: httpx.AsyncClient, result: SessionResult, card_key: str):
+    """挂载 SSE 客户端，统计事件类型与首个内容事件时间"""
+    url = f"/api/optimization/sessions/{result.session_id}/stream"
+    try:
+        async with client.stream(
+            "GET", url, params={"card_key": card_key},
+            # 关闭压缩，避免 GZip 中间件缓冲事件
+            headers={"Accept": "text/event-stream", "Accept-Encoding": "identity"},
+            timeout=httpx.Timeout(None, connect=10.0),
+        ) as response:
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                payload = line[5:].strip()
+                # stream_manager 推送的消息本身带有 "data: " 前缀，EventSourceResponse 会再包一层
+                if payload.startswith("data:"):
+                    payload = payload[5:].strip()
+                try:
+                    event_type = json.loads(payload).get("type", "unknown")
+                except (ValueError, AttributeError):
+                    # 心跳等非 JSON 数据
+                    continue
+                result.sse_events[event_type] = result.sse_events.get(event_type, 0) + 1
+                if event_type == "content" and result.first_content_at is None:
+                    result.first_content_at = time.monotonic()
+                    # 收到内容说明已开始处理，比轮询更精确
+                    if result.processing_at is None or result.processing_at > result.first_content_at:
+                        result.processing_at = result.first_content_at
+    except (httpx.HTTPError, asyncio.CancelledError):
+        pass
+
+
+async def run_session(
+    client: httpx.AsyncClient,
+    result: SessionResult,
+    card_key: str,
+    payload: Dict[str, Any],
+    args: argparse.Namespace,
+):
+    result.submitted_at = time.monotonic()
+    try:
+        response = await client.post("/api/optimization/start", params={"card_key": card_key}, json=payload)
+        response.raise_for_status()
+        result.session_id = response.json()["session_id"]
+    except httpx.HTTPError as e:
+        result.status = "submit_failed"
+        result.error = str(e)
+        result.finished_at = time.monotonic()
+        return
+
+    sse_task = asyncio.create_task(follow_sse(client, result, card_key)) if not args.no_sse else None
+    deadline = result.submitted_at + args.session_timeout
+    try:
+        while time.monotonic() < deadline:
+            try:
+                response = await client.get(
+                    f"/api/optimization/sessions/{result.session_id}/progress",
+                    params={"card_key": card_key},
+                )
+                response.raise_for_status()
+                progress = response.json()
+            except httpx.HTTPError as e:
+                result.error = str(e)
+                await asyncio.sleep(args.poll_interval)
+                continue
+
+            status = progress.get("status")
+            if status != "queued" and result.processing_at is None:
+                result.processing_at = time.monotonic()
+            if status in _FINAL_STATUSES:
+                result.status = status
+                result.error = progress.get("error_message")
+                result.finished_at = time.monotonic()
+                return
+            await asyncio.sleep(args.poll_interval)
+        result.status = "timeout"
+        result.finished_at = time.monotonic()
+    finally:
+        if sse_task:
+            sse_task.cancel()
+            await asyncio.gather(sse_task, return_exceptions=True)
+
+
+async def sample_queue(client: httpx.AsyncClient, card_key: str, samples: List[Dict[str, int]], interval: float):
+    """定期采样全局队列状态"""
+    while True:
+        try:
+            response = await client.get("/api/optimization/status", params={"card_key": card_key})
+            if response.status_code == 200:
+                data = response.json()
+                samples.append({"active": data["current_users"], "queued": data["queue_length"]})
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(interval)
+
+
+def format_seconds(value: Optional[float]) -> str:
+    return f"{value:8.2f}s" if value is not None else "       -"
+
+
+def print_report(results: List[SessionResult], elapsed: float, queue_samples: List[Dict[str, int]]):
+    statuses: Dict[str, int] = {}
+    for result in results:
+        statuses[result.status] = statuses.get(result.status, 0) + 1
+    completed = [r.completion_time for r in results if r.completion_time is not None]
+    waits = [r.queue_wait for r in results if r.queue_wait is not None]
+    first_content = [
+        r.first_content_at - r.submitted_at for r in results
+        if r.first_content_at is not None and r.submitted_at is not None
+    ]
+    events: Dict[str, int] = {}
+    for result in results:
+        for event_type, count in result.sse_events.items():
+            events[event_type] = events.get(event_type, 0) + count
+
+    print()
+    print(f"会话总数 {len(results)}，耗时 {elapsed:.1f}s，状态 {statuses}")
+    print(f"吞吐: {len(completed) / elapsed * 3600 if elapsed else 0:.1f} 会话/小时")
+    print(f"{'指标（从提交起计）':<16}{'p50':>10}{'p95':>10}{'max':>10}")
+    for name, values in (("完成耗时", completed), ("排队等待", waits), ("首个流式内容", first_content)):
+        print(
+            f"{name:<16}{format_seconds(percentile(values, 0.50)):>10}"
+            f"{format_seconds(percentile(values, 0.95)):>10}{format_seconds(max(values) if values else None):>10}"
+        )
+    if queue_samples:
+        print(
+            f"并发峰值 {max(s['active'] for s in queue_samples)}，"
+            f"排队峰值 {max(s['queued'] for s in queue_samples)}"
+        )
+    if events:
+        print(f"SSE 事件: {events}")
+    failures = [r for r in results if r.status not in ("completed",)]
+    for result in failures[:5]:
+        print(f"  #{result.index} {result.status}: {result.error}")
+
+
+async def main_async(args: argparse.Namespace):
+    text = Path(args.text_file).read_text(encoding="utf-8") if args.text_file else None
+    limits = httpx.Limits(max_connections=args.sessions * 2 + 10, max_keepalive_connections=args.sessions * 2 + 10)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=30.0) as client:
+        token = await admin_login(client, args.admin_username, args.admin_password)
+        card_keys = await create_card_keys(client, token, args.users or args.sessions, args.usage_limit)
+        print(f"[LOAD] 已生成 {len(card_keys)} 个卡密，开始提交 {args.sessions} 个会话（{args.ramp:.0f}s 内均匀提交）")
+
+        model_config = None
+        if args.mock_url:
+            model_config = {"model": args.model, "api_key": "mock", "base_url": args.mock_url}
+
+        results = [SessionResult(i) for i in range(args.sessions)]
+        queue_samples: List[Dict[str, int]] = []
+        sampler = asyncio.create_task(sample_queue(client, card_keys[0], queue_samples, args.poll_interval))
+        started = time.monotonic()
+        tasks = []
+        for i, result in enumerate(results):
+            payload = {
+                "original_text": build_text(i, args.paragraphs, text),
+                "processing_mode": args.mode,
+                "use_cache": args.use_cache,
+            }
+            if model_config:
+                payload.update(polish_config=model_config, enhance_config=model_config, emotion_config=model_config)
+            card_key = card_keys[i % len(card_keys)]
+            tasks.append(asyncio.create_task(run_session(client, result, card_key, payload, args)))
+            if args.ramp > 0 and i < args.sessions - 1:
+                await asyncio.sleep(args.ramp / max(args.sessions - 1, 1))
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - started
+        sampler.cancel()
+        await asyncio.gather(sampler, return_exceptions=True)
+
+        print_report(results, elapsed, queue_samples)
+
+        if args.mock_url:
+            try:
+                stats_url = args.mock_url.rstrip("/").rsplit("/v1", 1)[0] + "/stats"
+                response = await client.get(stats_url)
+                print(f"模拟上游: {response.json()}")
+            except httpx.HTTPError:
+                pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端压测驱动")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000", help="后端地址")
+    parser.add_argument("--admin-username", default=settings.ADMIN_USERNAME)
+    parser.add_argument("--admin-password", default=settings.ADMIN_PASSWORD)
+    parser.add_argument("--sessions", type=int, default=20, help="提交的会话总数")
+    parser.add_argument("--users", type=int, default=0, help="卡密数量，默认每个会话一个")
+    parser.add_argument("--usage-limit", type=int, default=1000, help="卡密使用次数上限")
+    parser.add_argument("--ramp", type=float, default=10.0, help="在多少秒内均匀提交全部会话，0 表示同时提交")
+    parser.add_argument("--mode", default="paper_polish_enhance",
+                        choices=["paper_polish", "paper_polish_enhance", "emotion_polish"])
+    parser.add_argument("--paragraphs", type=int, default=8, help="自动生成的原文段落数")
+    parser.add_argument("--text-file", default=None, help="使用指定文件作为所有会话的原文")
+    parser.add_argument("--mock-url", default=None, help="模拟上游地址（如 http://127.0.0.1:9000/v1），作为会话的模型配置")
+    parser.add_argument("--model", default="mock", help="配合 --mock-url 使用的模型名")
+    parser.add_argument("--use-cache", action="store_true", help="启用 LLM 响应缓存（默认关闭以测量真实调用）")
+    parser.add_argument("--no-sse", action="store_true", help="不挂载 SSE 客户端")
+    parser.add_argument("--poll-interval", type=float, default=4.0,
+                        help="进度轮询间隔（秒），默认与前端一致；也是排队等待的测量精度")
+    parser.add_argument("--session-timeout", type=float, default=1800.0, help="单个会话的最长等待时间（秒）")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+事件循环阻塞测量工具
+以固定间隔调度一个 ticker 协程，统计实际唤醒时间与预期时间的偏差
+"""
+
+import asyncio
+import time
+from typing import Dict, List
+
+
+class LoopLagMonitor:
+    """事件循环延迟监视器"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task = None
+        self._running = False
+
+    async def _tick(self):
+        loop = asyncio.get_running_loop()
+        while self._running:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(loop.time() - expected, 0.0))
+
+    def start(self):
+        self._running = True
+        self._task = asyncio.create_task(self._tick())
+
+    async def stop(self):
+        self._running = False
+        if self._task:
+            await self._task
+
+    def report(self) -> Dict[str, float]:
+        """返回延迟统计（毫秒）"""
+        if not self.samples:
+            return {"samples": 0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0, "stalled_ms": 0.0}
+        ordered = sorted(self.samples)
+
+        def pick(q: float) -> float:
+            return ordered[min(int(len(ordered) * q), len(ordered) - 1)] * 1000
+
+        return {
+            "samples": len(ordered),
+            "p50_ms": round(pick(0.50), 3),
+            "p99_ms": round(pick(0.99), 3),
+            "max_ms": round(ordered[-1] * 1000, 3),
+            # 超过 1ms 的延迟累计，近似为事件循环被阻塞的总时间
+            "stalled_ms": round(sum(s for s in ordered if s > 0.001) * 1000, 1),
+        }
+
+
+def format_report(name: str, report: Dict[str, float], elapsed: float) -> str:
+    return (
+        f"{name:<28} 耗时 {elapsed:6.2f}s | lag p50 {report['p50_ms']:7.3f}ms "
+        f"p99 {report['p99_ms']:8.3f}ms max {report['max_ms']:8.3f}ms | 累计阻塞 {report['stalled_ms']:8.1f}ms"
+    )
+
+
+def now() -> float:
+    return time.perf_counter()
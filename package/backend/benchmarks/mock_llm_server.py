@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+本地模拟 OpenAI 兼容接口（/v1/chat/completions），用于压测，不产生真实 API 费用
+- 支持流式（SSE，含 stream_options.include_usage）与非流式响应
+- 首 token 延迟按指定分布采样，输出按 tokens/s 匀速生成
+- 可配置 5xx 错误率与 429 限流率（带 Retry-After）
+- 输出内容为最后一条用户消息的原文（润色后长度与输入相当）
+
+用法:
+    python benchmarks/mock_llm_server.py --port 9000 --latency lognormal:0.8,0.5 --tps 60
+    python benchmarks/mock_llm_server.py --error-rate 0.02 --rate-limit-rate 0.05
+
+后端指向模拟服务:
+    OPENAI_BASE_URL=http://127.0.0.1:9000/v1  OPENAI_API_KEY=mock  POLISH_MODEL=mock ...
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+backend_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(backend_dir))
+
+import uvicorn  # noqa: E402
+from fastapi import FastAPI, Request  # noqa: E402
+from fastapi.responses import JSONResponse, StreamingResponse  # noqa: E402
+
+from app.services.token_estimator import token_estimator  # noqa: E402
+
+# 流式输出的发送间隔（秒），每个 chunk 包含该间隔内生成的 token
+_CHUNK_INTERVAL = 0.05
+
+
+class LatencyDistribution:
+    """首 token 延迟分布，格式 kind:参数
+
+    fixed:0.5 | uniform:0.2,1.5 | exponential:0.8（均值） | lognormal:0.8,0.5（中位数, sigma）
+    """
+
+    def __init__(self, spec: str):
+        kind, _, params = spec.partition(":")
+        self.kind = kind.strip().lower()
+        self.params = [float(p) for p in params.split(",") if p.strip()]
+        required = {"fixed": 1, "uniform": 2, "exponential": 1, "lognormal": 2}
+        if self.kind not in required or len(self.params) != required[self.kind]:
+            raise ValueError(f"无效的延迟分布: {spec}")
+
+    def sample(self) -> float:
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return random.uniform(self.params[0], self.params[1])
+        if self.kind == "exponential":
+            return random.expovariate(1.0 / self.params[0]) if self.params[0] > 0 else 0.0
+        median, sigma = self.params
+        return random.lognormvariate(0.0, sigma) * median
+
+    def __str__(self) -> str:
+        return f"{self.kind}:{','.join(str(p) for p in self.params)}"
+
+
+class MockLLM:
+    """模拟上游的行为配置与请求计数"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.latency = LatencyDistribution(args.latency)
+        self.tps = args.tps
+        self.tps_jitter = args.tps_jitter
+        self.error_rate = args.error_rate
+        self.rate_limit_rate = args.rate_limit_rate
+        self.retry_after = args.retry_after
+        self.output_ratio = args.output_ratio
+        self.counters: Dict[str, int] = {
+            "requests": 0, "streamed": 0, "errors": 0, "rate_limited": 0,
+            "completed": 0, "disconnected": 0, "prompt_tokens": 0, "completion_tokens": 0,
+        }
+        self.inflight = 0
+        self.max_inflight = 0
+
+    def build_output(self, messages: List[Dict[str, Any]], max_tokens: Optional[int]) -> str:
+        text = ""
+        for message in reversed(messages):
+            if message.get("role") == "user":
+                text = str(message.get("content") or "")
+                break
+        if text and self.output_ratio != 1.0:
+            length = max(int(len(text) * self.output_ratio), 1)
+            text = (text * (length // len(text) + 1))[:length]
+        if max_tokens:
+            # 粗略按 max_tokens 截断（token 估算与后端一致）
+            while text and token_estimator.count(text) > max_tokens:
+                text = text[:int(len(text) * 0.9)]
+        return text or "OK"
+
+    def sample_tps(self) -> float:
+        jitter = random.uniform(-self.tps_jitter, self.tps_jitter) if self.tps_jitter else 0.0
+        return max(self.tps * (1 + jitter), 0.1)
+
+
+def create_app(mock: MockLLM) -> FastAPI:
+    app = FastAPI(title="Mock OpenAI-compatible LLM")
+
+    @app.get("/stats")
+    async def stats():
+        return {**mock.counters, "inflight": mock.inflight, "max_inflight": mock.max_inflight}
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        mock.counters["requests"] += 1
+
+        roll = random.random()
+        if roll < mock.rate_limit_rate:
+            mock.counters["rate_limited"] += 1
+            return JSONResponse(
+                status_code=429,
+                headers={"Retry-After": str(mock.retry_after)},
+                content={"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error"}},
+            )
+        if roll < mock.rate_limit_rate + mock.error_rate:
+            mock.counters["errors"] += 1
+            return JSONResponse(
+                status_code=random.choice([500, 502, 503]),
+                content={"error": {"message": "Upstream error (mock)", "type": "server_error"}},
+            )
+
+        messages = body.get("messages") or []
+        model = body.get("model") or "mock"
+        output = mock.build_output(messages, body.get("max_tokens"))
+        prompt_tokens = sum(token_estimator.count(str(m.get("content") or "")) for m in messages)
+        completion_tokens = token_estimator.count(output)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": 0},
+        }
+        ttft = mock.latency.sample()
+        tps = mock.sample_tps()
+        completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+
+        if not body.get("stream"):
+            mock.inflight += 1
+            mock.max_inflight = max(mock.max_inflight, mock.inflight)
+            try:
+                await asyncio.sleep(ttft + completion_tokens / tps)
+            finally:
+                mock.inflight -= 1
+            mock.counters["completed"] += 1
+            mock.counters["prompt_tokens"] += prompt_tokens
+            mock.counters["completion_tokens"] += completion_tokens
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": output},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            }
+
+        mock.counters["streamed"] += 1
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+        def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+        async def events():
+            mock.inflight += 1
+            mock.max_inflight = max(mock.max_inflight, mock.inflight)
+            try:
+                yield chunk({"role": "assistant", "content": ""})
+                await asyncio.sleep(ttft)
+                # 按字符比例近似每个 chunk 的 token 数
+                chars_per_chunk = max(int(len(output) * tps * _CHUNK_INTERVAL / max(completion_tokens, 1)), 1)
+                for start in range(0, len(output), chars_per_chunk):
+                    yield chunk({"content": output[start:start + chars_per_chunk]})
+                    await asyncio.sleep(_CHUNK_INTERVAL)
+                yield chunk({}, "stop")
+                if include_usage:
+                    usage_chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [],
+                        "usage": usage,
+                    }
+                    yield f"data: {json.dumps(usage_chunk)}\n\n"
+                yield "data: [DONE]\n\n"
+                mock.counters["completed"] += 1
+                mock.counters["prompt_tokens"] += prompt_tokens
+                mock.counters["completion_tokens"] += completion_tokens
+            except asyncio.CancelledError:
+                # 客户端断开（超时或取消）
+                mock.counters["disconnected"] += 1
+                raise
+            finally:
+                mock.inflight -= 1
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟 OpenAI 兼容接口")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", default="lognormal:0.8,0.5", help="首 token 延迟分布（秒），见 LatencyDistribution")
+    parser.add_argument("--tps", type=float, default=60.0, help="每个请求的生成速度（token/s）")
+    parser.add_argument("--tps-jitter", type=float, default=0.2, help="生成速度的随机波动比例")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 5xx 的比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回 429 的比例")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429 响应的 Retry-After（秒）")
+    parser.add_argument("--output-ratio", type=float, default=1.0, help="输出长度相对输入的比例")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    mock = MockLLM(args)
+    print(
+        f"[MOCK LLM] http://{args.host}:{args.port}/v1 latency={mock.latency} tps={args.tps} "
+        f"error_rate={args.error_rate} rate_limit_rate={args.rate_limit_rate}"
+    )
+    uvicorn.run(create_app(mock), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
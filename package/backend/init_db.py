@@ -46,7 +46,9 @@ def check_tables():
             "change_logs",
             "queue_status",
             "system_settings",
-            "custom_prompts"
+            "custom_prompts",
+            "llm_response_cache",
+            "llm_usage"
         ]
         
         missing_tables = [t for t in expected_tables if t not in tables]
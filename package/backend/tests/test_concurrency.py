@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models.models import ConcurrencySlot, SystemSetting
+from app.services.concurrency import (
+    ConcurrencyManager,
+    MemoryConcurrencyBackend,
+    RedisConcurrencyBackend,
+    SqlConcurrencyBackend,
+)
+
+# 共享后端测试用的短租约（秒）
+LEASE_SECONDS = 1.0
+
+
+def memory_backend(tmp_path):
+    return MemoryConcurrencyBackend(1)
+
+
+def sql_backend(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'slots.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine, tables=[ConcurrencySlot.__table__, SystemSetting.__table__])
+    backend = SqlConcurrencyBackend(1, session_factory=sessionmaker(bind=engine))
+    backend.lease_seconds = LEASE_SECONDS
+    return backend
+
+
+def redis_backend(tmp_path):
+    fakeredis = pytest.importorskip("fakeredis")
+    backend = RedisConcurrencyBackend(1, client=fakeredis.aioredis.FakeRedis(), prefix="test:concurrency")
+    backend.lease_seconds = LEASE_SECONDS
+    return backend
+
+
+async def slot_scenario(backend, leases_expire: bool):
+    """申请、排队、释放、出队和租约过期：所有后端共用同一套 SlotState 语义"""
+    await backend.set_limit(2)
+    assert await backend.enter("a")
+    assert await backend.enter("b")
+    assert not await backend.enter("c")
+    assert await backend.snapshot("c") == (2, 2, 1, 1)
+
+    # 已激活的会话重复申请直接返回
+    assert await backend.enter("a")
+    assert await backend.snapshot() == (2, 2, 1, None)
+
+    # 释放后按排队顺序激活
+    await backend.release("a")
+    assert await backend.poll("c") is True
+    assert await backend.poll("a") is None
+
+    # 排队中放弃等待
+    assert not await backend.enter("d")
+    await backend.dequeue("d")
+    assert await backend.poll("d") is None
+    assert await backend.snapshot() == (2, 2, 0, None)
+
+    # 租约过期：只有 c 续期，b 的名额到期后自动释放
+    await asyncio.sleep(LEASE_SECONDS * 0.6)
+    await backend.renew(["c"])
+    await asyncio.sleep(LEASE_SECONDS * 0.6)
+    assert await backend.poll("c") is True
+    if leases_expire:
+        assert await backend.poll("b") is None
+        assert await backend.enter("e")
+    else:
+        assert await backend.poll("b") is True
+        assert not await backend.enter("e")
+
+    # 上限调整后立即激活等待中的会话
+    await backend.set_limit(3)
+    assert await backend.poll("e") is True
+    assert backend.limit == 3
+
+
+@pytest.mark.parametrize("factory, leases_expire", [
+    (memory_backend, False),
+    (sql_backend, True),
+    (redis_backend, True),
+], ids=["memory", "sql", "redis"])
+def test_slot_backend(tmp_path, factory, leases_expire):
+    async def run():
+        await slot_scenario(factory(tmp_path), leases_expire)
+    asyncio.run(run())
+
+
+def test_sql_backends_share_slots(tmp_path):
+    """两个 sql 后端实例（模拟两个 worker 进程）共享上限与排队顺序"""
+    first = sql_backend(tmp_path)
+    second = SqlConcurrencyBackend(1, session_factory=first._session_factory)
+
+    async def run():
+        await first.set_limit(1)
+        assert await first.enter("a")
+        assert not await second.enter("b")
+        assert second.limit == 1
+        await first.release("a")
+        assert await second.poll("b") is True
+    asyncio.run(run())
+
+
+class SlowPollBackend(MemoryConcurrencyBackend):
+    """查询较慢的后端（模拟共享后端的网络往返），记录同时进行的查询数"""
+
+    def __init__(self, default_limit: int):
+        super().__init__(default_limit)
+        self.polling = 0
+        self.max_polling = 0
+
+    async def poll(self, session_id):
+        self.polling += 1
+        self.max_polling = max(self.max_polling, self.polling)
+        try:
+            await asyncio.sleep(0.05)
+            return await super().poll(session_id)
+        finally:
+            self.polling -= 1
+
+
+def test_manager_polls_outside_condition_lock():
+    backend = SlowPollBackend(1)
+    manager = ConcurrencyManager(backend=backend)
+
+    async def run():
+        assert await manager.acquire("a")
+        waiters = [asyncio.create_task(manager.acquire(name, timeout=5)) for name in ("b", "c", "d")]
+        await asyncio.sleep(0.2)
+        # 等待者的后端查询互不阻塞
+        assert backend.max_polling > 1
+        for name in ("a", "b", "c"):
+            await manager.release(name)
+            await asyncio.sleep(0.2)
+        assert all(await asyncio.wait_for(asyncio.gather(*waiters), timeout=2))
+        await manager.release("d")
+    asyncio.run(run())
@@ -0,0 +1,34 @@
+import pytest
+
+from app.config import settings
+from app.services.deadline_policy import DeadlinePolicy
+
+
+@pytest.fixture(autouse=True)
+def deadline_settings(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_DEADLINE_ADAPTIVE", True)
+    monkeypatch.setattr(settings, "LLM_DEADLINE_MIN", 20.0)
+    monkeypatch.setattr(settings, "LLM_DEADLINE_MAX", 600.0)
+    monkeypatch.setattr(settings, "LLM_DEADLINE_SAFETY", 2.0)
+    monkeypatch.setattr(settings, "LLM_DEADLINE_DEFAULT_TPS", 20.0)
+    monkeypatch.setattr(settings, "LLM_REQUEST_TIMEOUT", 60.0)
+
+
+def test_cold_model_uses_request_timeout_as_floor():
+    policy = DeadlinePolicy()
+    assert policy.request_timeout("gpt-5", 100) == 60.0
+
+
+def test_non_streaming_latency_and_reasoning_extend_deadline():
+    policy = DeadlinePolicy()
+    # 非流式推理模型：40 秒返回 200 个可见 token 和 1000 个推理 token
+    for _ in range(3):
+        policy.record("gpt-5", 1200, 40.0, reasoning_tokens=1000)
+    assert policy.request_timeout("gpt-5", 200) >= 2.0 * 40.0
+
+
+def test_warm_fast_model_uses_deadline_min():
+    policy = DeadlinePolicy()
+    for _ in range(3):
+        policy.record("fast", 100, 2.0, 0.3)
+    assert policy.request_timeout("fast", 100) == 20.0
@@ -0,0 +1,55 @@
+import pytest
+
+from app.config import settings
+from app.services.rate_limiter import RateLimiterRegistry
+
+BASE_URL = "https://api.example.com/v1"
+KEY = f"{BASE_URL}|gpt-5"
+
+
+@pytest.fixture
+def defaults(monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_RPM", 10)
+    monkeypatch.setattr(settings, "RATE_LIMIT_TPM", 1000)
+    monkeypatch.setattr(settings, "RATE_LIMIT_MAX_INFLIGHT", 2)
+    return 10, 1000, 2
+
+
+def test_overrides_by_model_and_endpoint(monkeypatch, defaults):
+    monkeypatch.setattr(
+        settings, "RATE_LIMIT_OVERRIDES",
+        f'{{"gpt-5": {{"rpm": 60, "tpm": "5000"}}, "{KEY}": {{"max_inflight": 4}}}}'
+    )
+    registry = RateLimiterRegistry()
+    assert registry._limits_for(KEY, "gpt-5") == (60, 5000, 4)
+    assert registry._limits_for(f"{BASE_URL}|other", "other") == defaults
+
+
+@pytest.mark.parametrize("raw", [
+    '{"gpt-5": 60000}',
+    '{"gpt-5": [1, 2]}',
+    '{"gpt-5": {"rpm": "fast", "tpm": null, "max_inflight": true}}',
+    '{"gpt-5": {"burst": 5}}',
+    '[1, 2]',
+    'not json',
+])
+def test_invalid_overrides_fall_back_to_defaults(monkeypatch, defaults, raw):
+    monkeypatch.setattr(settings, "RATE_LIMIT_OVERRIDES", raw)
+    registry = RateLimiterRegistry()
+    assert registry._limits_for(KEY, "gpt-5") == defaults
+    # 同一配置再次读取走缓存
+    assert registry._limits_for(KEY, "gpt-5") == defaults
+
+
+def test_invalid_fields_keep_valid_ones(monkeypatch, defaults):
+    monkeypatch.setattr(settings, "RATE_LIMIT_OVERRIDES", '{"gpt-5": {"rpm": "7", "tpm": "x"}, "bad": 1}')
+    registry = RateLimiterRegistry()
+    assert registry._limits_for(KEY, "gpt-5") == (7, 1000, 2)
+
+
+def test_overrides_reload_when_setting_changes(monkeypatch, defaults):
+    registry = RateLimiterRegistry()
+    monkeypatch.setattr(settings, "RATE_LIMIT_OVERRIDES", '{"gpt-5": {"rpm": 5}}')
+    assert registry._limits_for(KEY, "gpt-5")[0] == 5
+    monkeypatch.setattr(settings, "RATE_LIMIT_OVERRIDES", '{"gpt-5": {"rpm": 6}}')
+    assert registry._limits_for(KEY, "gpt-5")[0] == 6
@@ -0,0 +1,96 @@
+import pytest
+
+from app.services.segment_classifier import (
+    CODE,
+    FORMULA,
+    REFERENCE,
+    TABLE,
+    URL,
+    classify_segment,
+    classify_segments,
+)
+
+PROSE = [
+    "The proposed framework consists of three main stages, which are described in detail below (see Figure 2):",
+    "Previous studies have reported similar findings (Smith et al., 2020; Wang, 2021):",
+    "Figure 3 (a) shows the results; (b) shows the baseline;",
+    "Our method improves accuracy by 5% over the baseline (Table 3);",
+    "We set the learning rate = 0.001 and batch size = 32 for all experiments;",
+    "The accuracy = 95% on the test set, which is higher than all baselines.",
+    "Let x = 5 and y = 10.",
+    "如图2所示，本文方法在三个数据集上均优于基线（见表3）；",
+    "1. 本文提出了一种基于图神经网络的多模态融合方法，在2021年的实验中表现更好。",
+    "see https://example.com for the complete experimental details of our approach",
+]
+
+CODE_LINES = [
+    "def train(model, data):",
+    "int main() {",
+    'printf("你好");',
+    "for (int i = 0; i < n; i++) {",
+    "public static void main(String[] args) {",
+    "import numpy as np",
+    "x = np.array(data)",
+    "result = model.predict(features)  # 预测结果",
+    "self.layers[i].forward(x);",
+    "SELECT name, age FROM users WHERE age > 30 AND status = 'active';",
+    "#include <stdio.h>",
+]
+
+REFERENCES = [
+    "[1] 张三, 李四. 基于深度学习的文本分析方法研究[J]. 计算机学报, 2020, 43(5): 1-10.",
+    "[2] 王五. 自然语言处理导论[M]. 北京: 清华大学出版社, 2019.",
+    "[3] Vaswani A, Shazeer N, et al. Attention is all you need. NeurIPS, 2017, pp. 5998-6008.",
+]
+
+
+@pytest.mark.parametrize("text", PROSE)
+def test_prose_is_not_passthrough(text):
+    assert classify_segment(text) is None
+
+
+@pytest.mark.parametrize("text", CODE_LINES)
+def test_code_lines(text):
+    assert classify_segment(text) == CODE
+
+
+@pytest.mark.parametrize("text", REFERENCES)
+def test_reference_entries(text):
+    assert classify_segment(text) == REFERENCE
+
+
+@pytest.mark.parametrize("text, category", [
+    ("E = mc^2 (1)", FORMULA),
+    ("E = mc^2.", FORMULA),
+    ("y = max(a, b) + log(x).", FORMULA),
+    ("L = \\sum_{i=1}^{n} w_i x_i", FORMULA),
+    ("$$\\frac{a}{b} = c$$", FORMULA),
+    ("| 方法 | 准确率 | 召回率 |", TABLE),
+    ("|---|---|---|", TABLE),
+    ("方法\t准确率\t召回率", TABLE),
+    ("代码地址：https://github.com/foo/bar", URL),
+    ("[4] https://example.com/dataset", URL),
+])
+def test_other_categories(text, category):
+    assert classify_segment(text) == category
+
+
+def test_document_context():
+    """围栏之间的段落都是代码；参考文献标题后的条目直到正文段落为止"""
+    texts = [
+        "第一章 引言",
+        "深度学习模型借助注意力机制开展特征提取工作，从而显著提升了下游任务的性能表现。",
+        "```python",
+        "model.fit(train_data)",
+        "loss curve looks good here",
+        "```",
+        "The proposed framework consists of three main stages, which are described in detail below (see Figure 2):",
+        "参考文献",
+        "[1] 张三. 文本分析方法研究[J]. 计算机学报, 2020.",
+        "Smith J, Doe A. Attention is all you need. NeurIPS, 2017.",
+        "致谢",
+        "感谢导师的悉心指导，感谢实验室同学在论文写作过程中给予的帮助。",
+    ]
+    assert classify_segments(texts) == [
+        None, None, CODE, CODE, CODE, CODE, None, None, REFERENCE, REFERENCE, None, None,
+    ]
@@ -18,12 +18,22 @@ const ConfigManager = ({ adminToken }) => {
     EMOTION_API_KEY: '',
     EMOTION_BASE_URL: '',
     MAX_CONCURRENT_USERS: '',
+    CONTEXT_STRATEGY: '',
+    CONTEXT_WINDOW_SIZE: '',
     HISTORY_COMPRESSION_THRESHOLD: '',
+    HISTORY_SUMMARY_MAX_TOKENS: '',
+    HISTORY_COMPRESSION_SPECULATIVE_RATIO: '',
     COMPRESSION_MODEL: '',
     COMPRESSION_API_KEY: '',
     COMPRESSION_BASE_URL: '',
     DEFAULT_USAGE_LIMIT: '',
-    SEGMENT_SKIP_THRESHOLD: ''
+    SEGMENT_SKIP_THRESHOLD: '',
+    SEGMENT_PARALLELISM: '',
+    WRITE_BEHIND_MAX_DELAY_MS: '',
+    MESSAGE_LAYOUT: '',
+    LOG_LEVEL: '',
+    LOG_BODY_SAMPLE_RATE: '',
+    LOG_MAX_BODY_CHARS: ''
   });
 
   useEffect(() => {
@@ -49,12 +59,22 @@ const ConfigManager = ({ adminToken }) => {
         EMOTION_API_KEY: response.data.emotion?.api_key || '',
         EMOTION_BASE_URL: response.data.emotion?.base_url || '',
         MAX_CONCURRENT_USERS: response.data.system.max_concurrent_users?.toString() || '',
+        CONTEXT_STRATEGY: response.data.system.context_strategy || '',
+        CONTEXT_WINDOW_SIZE: response.data.system.context_window_size?.toString() || '',
         HISTORY_COMPRESSION_THRESHOLD: response.data.system.history_compression_threshold?.toString() || '',
+        HISTORY_SUMMARY_MAX_TOKENS: response.data.system.history_summary_max_tokens?.toString() || '',
+        HISTORY_COMPRESSION_SPECULATIVE_RATIO: response.data.system.history_compression_speculative_ratio?.toString() || '',
         COMPRESSION_MODEL: response.data.system.compression_model || '',
         COMPRESSION_API_KEY: response.data.compression?.api_key || '',
         COMPRESSION_BASE_URL: response.data.compression?.base_url || '',
         DEFAULT_USAGE_LIMIT: response.data.system.default_usage_limit?.toString() || '',
-        SEGMENT_SKIP_THRESHOLD: response.data.system.segment_skip_threshold?.toString() || ''
+        SEGMENT_SKIP_THRESHOLD: response.data.system.segment_skip_threshold?.toString() || '',
+        SEGMENT_PARALLELISM: response.data.system.segment_parallelism?.toString() || '',
+        WRITE_BEHIND_MAX_DELAY_MS: response.data.system.write_behind_max_delay_ms?.toString() || '',
+        MESSAGE_LAYOUT: response.data.system.message_layout || '',
+        LOG_LEVEL: response.data.system.log_level || '',
+        LOG_BODY_SAMPLE_RATE: response.data.system.log_body_sample_rate?.toString() || '',
+        LOG_MAX_BODY_CHARS: response.data.system.log_max_body_chars?.toString() || ''
       });
     } catch (error) {
       toast.error('获取配置失败');
@@ -275,7 +295,38 @@ const ConfigManager = ({ adminToken }) => {
 
           <div>
             <label className="block text-sm font-medium text-gray-500 mb-2">
-              历史压缩阈值（字符）
+              段落上下文策略
+            </label>
+            <select
+              value={formData.CONTEXT_STRATEGY}
+              onChange={(e) => setFormData({...formData, CONTEXT_STRATEGY: e.target.value})}
+              className="w-full px-4 py-2.5 bg-gray-50 border border-gray-200 rounded-xl focus:bg-white focus:ring-2 focus:ring-blue-500/20 focus:border-blue-500 transition-all text-sm"
+            >
+              <option value="summary">滚动摘要（全部历史，超过阈值压缩）</option>
+              <option value="window">最近 K 段输出</option>
+              <option value="neighbors">相邻段落原文</option>
+              <option value="none">不带上下文</option>
+            </select>
+            <p className="mt-1.5 text-xs text-gray-400">按处理模式单独设置可在 .env 中配置 CONTEXT_STRATEGY_OVERRIDES</p>
+          </div>
+
+          <div>
+            <label className="block text-sm font-medium text-gray-500 mb-2">
+              上下文窗口段数
+            </label>
+            <input
+              type="number"
+              value={formData.CONTEXT_WINDOW_SIZE}
+              onChange={(e) => setFormData({...formData, CONTEXT_WINDOW_SIZE: e.target.value})}
+              placeholder="3"
+              className="w-full px-4 py-2.5 bg-gray-50 border border-gray-200 rounded-xl focus:bg-white focus:ring-2 focus:ring-blue-500/20 focus:border-blue-500 transition-all text-sm"
+            />
+            <p className="mt-1.5 text-xs text-gray-400">“最近 K 段输出”策略保留的段数</p>
+          </div>
+
+          <div>
+            <label className="block text-sm font-medium text-gray-500 mb-2">
+              历史压缩阈值（token）
             </label>
             <input
               type="number"
@@ -286,6 +337,35 @@ const ConfigManager = ({ adminToken }) => {
             />
           </div>
 
+          <div>
+            <label className="block text-sm font-medium text-gray-500 mb-2">
+              提前压缩比例
+            </label>
+            <input
+              type="number"
+              step="0.05"
+              value={formData.HISTORY_COMPRESSION_SPECULATIVE_RATIO}
+              onChange={(e) => setFormData({...formData, HISTORY_COMPRESSION_SPECULATIVE_RATIO: e.target.value})}
+              placeholder="0.8"
+              className="w-full px-4 py-2.5 bg-gray-50 border border-gray-200 rounded-xl focus:bg-white focus:ring-2 focus:ring-blue-500/20 focus:border-blue-500 transition-all text-sm"
+            />
+            <p className="mt-1.5 text-xs text-gray-400">历史达到阈值的该比例时在后台提前压缩，与后续段落并行，0 表示关闭</p>
+          </div>
+
+          <div>
+            <label className="block text-sm font-medium text-gray-500 mb-2">
+              摘要长度上限（Token）
+            </label>
+            <input
+              type="number"
+              value={formData.HISTORY_SUMMARY_MAX_TOKENS}
+              onChange={(e) => setFormData({...formData, HISTORY_SUMMARY_MAX_TOKENS: e.target.value})}
+              placeholder="800"
+              className="w-full px-4 py-2.5 bg-gray-50 border border-gray-200 rounded-xl focus:bg-white focus:ring-2 focus:ring-blue-500/20 focus:border-blue-500 transition-all text-sm"
+            />
+            <p className="mt-1.5 text-xs text-gray-400">每次压缩将上次摘要与新增内容合并为不超过该长度的摘要，0 表示不限制</p>
+          </div>
+
           <div>
             <label className="block text-sm font-medium text-gray-500 mb-2">
               压缩模型
@@ -352,6 +432,98 @@ const ConfigManager = ({ adminToken }) => {
             />
             <p className="mt-1.5 text-xs text-gray-400">小于此字数的段落将被识别为标题并跳过</p>
           </div>
+
+          <div>
+            <label className="block text-sm font-medium text-gray-500 mb-2">
+              段落并行数
+            </label>
+            <input
+              type="number"
+              value={formData.SEGMENT_PARALLELISM}
+              onChange={(e) => setFormData({...formData, SEGMENT_PARALLELISM: e.target.value})}
+              placeholder="4"
+              className="w-full px-4 py-2.5 bg-gray-50 border border-gray-200 rounded-xl focus:bg-white focus:ring-2 focus:ring-blue-500/20 focus:border-blue-500 transition-all text-sm"
+            />
+            <p className="mt-1.5 text-xs text-gray-400">开启段落并行的会话内同时处理的段落数，以相邻原文为上下文</p>
+          </div>
+
+          <div>
+            <label className="block text-sm font-medium text-gray-500 mb-2">
+              写入缓冲时间（毫秒）
+            </label>
+            <input
+              type="number"
+              value={formData.WRITE_BEHIND_MAX_DELAY_MS}
+              onChange={(e) => setFormData({...formData, WRITE_BEHIND_MAX_DELAY_MS: e.target.value})}
+              placeholder="500"
+              className="w-full px-4 py-2.5 bg-gray-50 border border-gray-200 rounded-xl focus:bg-white focus:ring-2 focus:ring-blue-500/20 focus:border-blue-500 transition-all text-sm"
+            />
+            <p className="mt-1.5 text-xs text-gray-400">进度等更新合并提交的最长等待时间，AI 调用前总会先写入已完成的结果</p>
+          </div>
+
+          <div>
+            <label className="block text-sm font-medium text-gray-500 mb-2">
+              请求消息布局
+            </label>
+            <select
+              value={formData.MESSAGE_LAYOUT}
+              onChange={(e) => setFormData({...formData, MESSAGE_LAYOUT: e.target.value})}
+              className="w-full px-4 py-2.5 bg-gray-50 border border-gray-200 rounded-xl focus:bg-white focus:ring-2 focus:ring-blue-500/20 focus:border-blue-500 transition-all text-sm"
+            >
+              <option value="prefix_cache">系统提示词在前（利于前缀缓存）</option>
+              <option value="legacy">历史在前（旧布局）</option>
+            </select>
+            <p className="mt-1.5 text-xs text-gray-400">系统提示词在前时，上游可复用提示词前缀缓存，降低延迟与费用</p>
+          </div>
+
+          <div>
+            <label className="block text-sm font-medium text-gray-500 mb-2">
+              日志级别
+            </label>
+            <select
+              value={formData.LOG_LEVEL}
+              onChange={(e) => setFormData({...formData, LOG_LEVEL: e.target.value})}
+              className="w-full px-4 py-2.5 bg-gray-50 border border-gray-200 rounded-xl focus:bg-white focus:ring-2 focus:ring-blue-500/20 focus:border-blue-500 transition-all text-sm"
+            >
+              <option value="DEBUG">DEBUG</option>
+              <option value="INFO">INFO</option>
+              <option value="WARNING">WARNING</option>
+              <option value="ERROR">ERROR</option>
+              <option value="OFF">OFF</option>
+            </select>
+            <p className="mt-1.5 text-xs text-gray-400">DEBUG 级别才会输出请求与响应正文</p>
+          </div>
+
+          <div>
+            <label className="block text-sm font-medium text-gray-500 mb-2">
+              正文日志采样率
+            </label>
+            <input
+              type="number"
+              step="0.1"
+              min="0"
+              max="1"
+              value={formData.LOG_BODY_SAMPLE_RATE}
+              onChange={(e) => setFormData({...formData, LOG_BODY_SAMPLE_RATE: e.target.value})}
+              placeholder="1.0"
+              className="w-full px-4 py-2.5 bg-gray-50 border border-gray-200 rounded-xl focus:bg-white focus:ring-2 focus:ring-blue-500/20 focus:border-blue-500 transition-all text-sm"
+            />
+            <p className="mt-1.5 text-xs text-gray-400">0-1 之间，按比例抽样记录正文</p>
+          </div>
+
+          <div>
+            <label className="block text-sm font-medium text-gray-500 mb-2">
+              正文日志截断长度（字符）
+            </label>
+            <input
+              type="number"
+              value={formData.LOG_MAX_BODY_CHARS}
+              onChange={(e) => setFormData({...formData, LOG_MAX_BODY_CHARS: e.target.value})}
+              placeholder="2000"
+              className="w-full px-4 py-2.5 bg-gray-50 border border-gray-200 rounded-xl focus:bg-white focus:ring-2 focus:ring-blue-500/20 focus:border-blue-500 transition-all text-sm"
+            />
+            <p className="mt-1.5 text-xs text-gray-400">0 表示不截断</p>
+          </div>
         </div>
       </div>
 
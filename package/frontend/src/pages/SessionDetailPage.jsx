@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import toast from 'react-hot-toast';
 import {
@@ -6,6 +6,17 @@ import {
   CheckCircle, AlertCircle, Shield, Square
 } from 'lucide-react';
 import { optimizationAPI } from '../api';
+import { textChecksum } from '../utils/checksum';
+
+const getStageText = (segment, stage) => (
+  stage === 'enhance' ? segment.enhanced_text : segment.polished_text
+) || '';
+
+const withStageText = (segment, stage, text) => (
+  stage === 'enhance'
+    ? { ...segment, enhanced_text: text }
+    : { ...segment, polished_text: text }
+);
 
 const SessionDetailPage = () => {
   const { sessionId } = useParams();
@@ -16,6 +27,8 @@ const SessionDetailPage = () => {
   const [activeTab, setActiveTab] = useState('result');
   const [showExportModal, setShowExportModal] = useState(false);
   const [exportFormat, setExportFormat] = useState('txt');
+  // 每个 段落:阶段 的流式状态：最后收到的序号，以及是否因缺口等待快照
+  const streamStateRef = useRef({});
 
   useEffect(() => {
     let eventSource = null;
@@ -34,8 +47,12 @@ const SessionDetailPage = () => {
           const data = JSON.parse(event.data);
           if (data.type === 'content') {
             handleStreamUpdate(data);
+          } else if (data.type === 'content_snapshot') {
+            handleStreamSnapshot(data);
           } else if (data.type === 'history_compressed') {
             toast.info(data.message);
+          } else if (data.type === 'segment_retry') {
+            handleSegmentRetry(data);
           }
         } catch (error) {
           console.error('Error parsing SSE data:', error);
@@ -58,6 +75,24 @@ const SessionDetailPage = () => {
   }, [sessionId]);
 
   const handleStreamUpdate = (data) => {
+    // 协议 v2：按序号校验增量，出现缺口时暂停追加，等待下一个快照覆盖
+    let reset = false;
+    if (data.protocol_version >= 2) {
+      const key = `${data.segment_index}:${data.stage}`;
+      const state = streamStateRef.current[key] || { seq: 0, dirty: false };
+      if (data.seq === 1) {
+        reset = true;
+        state.dirty = false;
+      } else if (data.seq !== state.seq + 1) {
+        state.dirty = true;
+      }
+      state.seq = data.seq;
+      streamStateRef.current[key] = state;
+      if (state.dirty) {
+        return;
+      }
+    }
+
     setSegments(prevSegments => {
       const newSegments = [...prevSegments];
       const segmentIndex = data.segment_index;
@@ -70,14 +105,9 @@ const SessionDetailPage = () => {
         return prevSegments;
       }
 
-      const segment = { ...newSegments[segmentIndex] };
-      
-      // 更新内容
-      if (data.stage === 'polish' || data.stage === 'emotion_polish') {
-        segment.polished_text = (segment.polished_text || "") + data.content;
-      } else if (data.stage === 'enhance') {
-        segment.enhanced_text = (segment.enhanced_text || "") + data.content;
-      }
+      // 更新内容（序号 1 表示新一轮输出，从空文本开始）
+      const currentText = reset ? '' : getStageText(newSegments[segmentIndex], data.stage);
+      const segment = withStageText(newSegments[segmentIndex], data.stage, currentText + data.content);
       
       // 标记为处理中（如果尚未标记）
       if (segment.status !== 'processing') {
@@ -97,6 +127,41 @@ const SessionDetailPage = () => {
     });
   };
 
+  const handleStreamSnapshot = (data) => {
+    const key = `${data.segment_index}:${data.stage}`;
+    const state = streamStateRef.current[key] || { seq: 0, dirty: false };
+    const dirty = state.dirty;
+    streamStateRef.current[key] = { seq: data.seq, dirty: false };
+
+    setSegments(prevSegments => {
+      const segment = prevSegments[data.segment_index];
+      if (!segment) {
+        return prevSegments;
+      }
+      // 本地文本与快照一致时无需更新
+      if (!dirty && textChecksum(getStageText(segment, data.stage)) === data.checksum) {
+        return prevSegments;
+      }
+      const newSegments = [...prevSegments];
+      newSegments[data.segment_index] = withStageText(segment, data.stage, data.text);
+      return newSegments;
+    });
+  };
+
+  const handleSegmentRetry = (data) => {
+    // 重试时丢弃该段落已收到的流式内容，序号从头开始
+    delete streamStateRef.current[`${data.segment_index}:${data.stage}`];
+    setSegments(prevSegments => {
+      const segment = prevSegments[data.segment_index];
+      if (!segment) {
+        return prevSegments;
+      }
+      const newSegments = [...prevSegments];
+      newSegments[data.segment_index] = withStageText(segment, data.stage, '');
+      return newSegments;
+    });
+  };
+
   const loadSessionDetail = async () => {
     try {
       const response = await optimizationAPI.getSessionDetail(sessionId);
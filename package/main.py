@@ -57,7 +57,9 @@ from app.database import init_db
 from app.routes import admin, prompts, optimization
 from app.models.models import CustomPrompt
 from app.database import SessionLocal
-from app.services.ai_service import get_default_polish_prompt, get_default_enhance_prompt
+from app.services.ai_service import get_default_polish_prompt, get_default_enhance_prompt, client_registry
+from app.services.log_pipeline import log_pipeline
+from app.services.job_queue import job_queue
 
 # 检查默认密钥（仅警告，不退出）
 if settings.SECRET_KEY == "your-secret-key-change-this-in-production":
@@ -165,6 +167,28 @@ async def startup_event():
     finally:
         db.close()
 
+    # 启动日志后台写线程
+    log_pipeline.start()
+
+    # 预热 LLM 客户端连接池
+    client_registry.warmup()
+
+    # 启动任务工作池：继续处理排队中的会话和上次运行被中断的会话
+    await job_queue.start(optimization.run_optimization)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """关闭时释放资源"""
+    # 停止任务工作池并释放租约，重启后从已完成的段落继续
+    await job_queue.stop()
+
+    # 关闭共享的 LLM 客户端连接池
+    await client_registry.aclose()
+
+    # 写出剩余日志
+    log_pipeline.stop()
+
 
 @app.get("/health")
 async def health_check():
@@ -190,11 +214,12 @@ def _check_url_format(base_url: Optional[str]) -> tuple:
     if not base_url or not base_url.strip():
         return False, "Base URL 未配置"
     
-    # 验证 base_url 是否符合 OpenAI API 格式
+    # 验证 base_url 是否符合 OpenAI API 格式（支持逗号分隔的多个端点）
     # 使用更严格的 URL 验证模式
-    url_pattern = re.compile(r'^https?://[^\s/$.?#].[^\s]*$', re.IGNORECASE)
-    if not url_pattern.match(base_url):
-        return False, "Base URL 格式不正确，应为有效的 HTTP/HTTPS URL"
+    url_pattern = re.compile(r'^https?://[^\s/$.?#].[^\s,]*$', re.IGNORECASE)
+    for url in base_url.split(","):
+        if not url_pattern.match(url.strip()):
+            return False, "Base URL 格式不正确，应为有效的 HTTP/HTTPS URL"
     
     return True, None
 